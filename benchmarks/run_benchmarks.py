@@ -0,0 +1,323 @@
+"""
+Benchmarks for the hot paths of the projects in this repository.
+
+run all benchmarks and store the results:
+    python benchmarks/run_benchmarks.py run --output results.json
+compare against a stored baseline, exits with 1 if anything got slower than the threshold:
+    python benchmarks/run_benchmarks.py compare baseline.json results.json
+"""
+
+import argparse
+import datetime
+import functools
+import json
+import pathlib
+import platform
+import string
+import sys
+import time
+
+import numpy as np
+
+REPO_DIR = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR / "enigma"))
+sys.path.insert(0, str(REPO_DIR / "circle_packings"))
+
+import enigma
+import crack_enigma
+import metrics_enigma
+
+LANGUAGE_STATS = REPO_DIR / "enigma" / "language_stats.dill"
+
+MESSAGE = (
+    "The Enigma machine is a cipher device developed and used in the early- to mid-20th century to protect"
+    " commercial, diplomatic, and military communication. It was employed extensively by Nazi Germany during "
+    "World War II, in all branches of the German military. The Germans believed, erroneously, that use of the"
+    " Enigma machine enabled them to communicate securely and thus enjoy a huge advantage in World War II. "
+)
+MESSAGE = "".join(c for c in MESSAGE.lower() if c.islower())
+
+
+def time_function(func, n_repeats: int) -> tuple:
+    """
+    :return: the best wall clock time of n_repeats calls of func and the return value
+    of the fastest call
+    """
+    best_seconds = np.inf
+    best_result = None
+    for _ in range(n_repeats):
+        tick = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - tick
+        if seconds < best_seconds:
+            best_seconds, best_result = seconds, result
+    return best_seconds, best_result
+
+
+def make_enigma(n_rotors: int, n_plugs: int, charset=string.ascii_lowercase):
+    n_chars = len(charset)
+    plugboard = enigma.Swapper(n_positions=n_chars)
+    plugboard.assign_random_swaps(n_swaps=n_plugs, seed=41)
+    rotors = [enigma.Rotor(n_positions=n_chars, seed=seed) for seed in range(n_rotors)]
+    reflector = enigma.Swapper(n_positions=n_chars)
+    reflector.assign_random_swaps(n_swaps=n_chars // 2, seed=3)
+    return enigma.Enigma(rotors, plugboard, reflector, charset=charset)
+
+
+def load_scorer(groupname: str):
+    import dill
+
+    with open(LANGUAGE_STATS, "rb") as read_file:
+        group_likelihood = dill.load(read_file)[groupname]
+    return crack_enigma.GroupLikelihoodScorer(group_likelihood)
+
+
+def encrypt(n_rotors: int, n_plugs: int, len_msg: int, rotor_positions):
+    encoder = make_enigma(n_rotors, n_plugs)
+    encoder.set_rotor_positions(rotor_positions)
+    return encoder, encoder.encode_message(MESSAGE[:len_msg])
+
+
+def encode_messages(encoder: enigma.Enigma, message: str, n_messages: int):
+    for _ in range(n_messages):
+        encoder.set_rotor_positions(len(encoder.rotors) * [3])
+        encoder.encode_message(message)
+
+
+def score_texts(scorer, text: str, n_texts: int):
+    for _ in range(n_texts):
+        scorer.score_text(text)
+
+
+def run_mc(encrypted: str, encoder: enigma.Enigma, scorer, **kwargs) -> int:
+    """
+    :return: the number of proposals of the run, it can stop early if converged
+    """
+    metrics = metrics_enigma.Metrics()
+    crack_enigma.decode_message_MC(
+        encrypted,
+        encoder.rotors,
+        2,
+        encoder.reflector,
+        scorer,
+        metrics=metrics,
+        **kwargs,
+    )
+    return metrics.counters["n_candidates"]
+
+
+def bench_encode_message(quick: bool):
+    rng = np.random.default_rng(42)
+    charset = string.ascii_lowercase
+    for n_rotors in [1, 2, 3]:
+        encoder = make_enigma(n_rotors, 10, charset=charset)
+        for length in [64, 256, 4096]:
+            message = "".join(rng.choice(list(charset), size=length))
+            n_messages = 10 if quick else 100
+            yield (
+                f"enigma.encode_message[rotors={n_rotors},length={length}]",
+                functools.partial(encode_messages, encoder, message, n_messages),
+                n_messages * length,
+                "chars",
+            )
+
+
+def bench_score_text(quick: bool):
+    text = (MESSAGE * 10)[:1000]
+    n_texts = 5 if quick else 50
+    for groupname in ["diads", "triads", "quads"]:
+        yield (
+            f"crack_enigma.score_text[{groupname},length={len(text)}]",
+            functools.partial(score_texts, load_scorer(groupname), text, n_texts),
+            n_texts * len(text),
+            "chars",
+        )
+
+
+def bench_successive_best(quick: bool):
+    scorer = load_scorer("triads")
+    for n_rotors in [1, 2]:
+        encoder, encrypted = encrypt(n_rotors, 2, 100, n_rotors * [15])
+        yield (
+            f"crack_enigma.decode_message_successive_best[rotors={n_rotors},plugs=2]",
+            functools.partial(
+                crack_enigma.decode_message_successive_best,
+                encrypted,
+                encoder.rotors,
+                2,
+                encoder.reflector,
+                scorer,
+                disable_tqdm=True,
+            ),
+            1,
+            "solves",
+        )
+
+
+def bench_mc(quick: bool):
+    scorer = load_scorer("triads")
+    encoder, encrypted = encrypt(1, 2, 200, [15])
+    for n_tries in [1, 16]:
+        yield (
+            f"crack_enigma.decode_message_MC[rotors=1,plugs=2,n_tries={n_tries}]",
+            functools.partial(
+                run_mc,
+                encrypted,
+                encoder,
+                scorer,
+                score_scale=0.2,
+                n_attempts_per_block=100,
+                max_n_blocks=5 if quick else 20,
+                n_tries=n_tries,
+            ),
+            # counted by the run
+            None,
+            "proposals",
+        )
+
+
+def bench_circle_packings(quick: bool):
+    import circle_packings
+
+    for n_circles in [10, 100] if quick else [10, 100, 1000]:
+        yield (
+            f"circle_packings.generate_positions[N={n_circles}]",
+            functools.partial(
+                circle_packings.generate_positions,
+                n_circles,
+                radius=0.1 / np.sqrt(n_circles),
+                with_overlap=False,
+            ),
+            n_circles,
+            "circles",
+        )
+        positions = circle_packings.generate_positions(n_circles)
+        yield (
+            f"circle_packings.calc_exclusion_probability[N={n_circles}]",
+            functools.partial(
+                circle_packings.calc_exclusion_probability,
+                positions,
+                0.1 / np.sqrt(n_circles),
+            ),
+            1000,
+            "test particles",
+        )
+
+
+BENCHMARK_GROUPS = {
+    "encode_message": bench_encode_message,
+    "score_text": bench_score_text,
+    "successive_best": bench_successive_best,
+    "mc": bench_mc,
+    "circle_packings": bench_circle_packings,
+}
+
+
+def run_benchmarks(groups: list, n_repeats: int, quick: bool) -> dict:
+    results = dict()
+    skipped = dict()
+    for group in groups:
+        try:
+            for name, func, n_items, unit in BENCHMARK_GROUPS[group](quick):
+                seconds, result = time_function(func, n_repeats)
+                if n_items is None:
+                    # func counts its items
+                    n_items = result
+                results[name] = {
+                    "seconds": seconds,
+                    "n_items": n_items,
+                    "unit": unit,
+                    "items_per_second": n_items / seconds,
+                }
+                print(f"{name:<75} {seconds:.3e} s {n_items / seconds:.3e} {unit}/s")
+        except ImportError as err:
+            # the projects do not share their dependencies
+            skipped[group] = str(err)
+            print(f"skipping {group}: {err}")
+
+    return {
+        "meta": {
+            "date": datetime.datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "n_repeats": n_repeats,
+            "quick": quick,
+        },
+        "results": results,
+        "skipped": skipped,
+    }
+
+
+def compare_results(baseline: dict, current: dict, threshold: float) -> list:
+    """
+    :return: names of the benchmarks that are slower than the baseline by more than threshold.
+    Throughputs are compared, so quick runs can be compared to full runs.
+    """
+    regressions = list()
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            print(f"{name:<75} new")
+            continue
+        ratio = (
+            baseline["results"][name]["items_per_second"] / result["items_per_second"]
+        )
+        if ratio > 1 + threshold:
+            flag = "REGRESSION"
+            regressions.append(name)
+        elif ratio < 1 / (1 + threshold):
+            flag = "improved"
+        else:
+            flag = ""
+        print(f"{name:<75} {ratio:6.2f}x slowdown {flag}")
+    for name in baseline["results"]:
+        if name not in current["results"]:
+            print(f"{name:<75} missing")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--output", default="benchmark_results.json")
+    run_parser.add_argument(
+        "--groups", nargs="+", choices=list(BENCHMARK_GROUPS), default=None
+    )
+    run_parser.add_argument("--n-repeats", type=int, default=3)
+    run_parser.add_argument(
+        "--quick", action="store_true", help="smaller workloads for a smoke test"
+    )
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="compare results against a baseline"
+    )
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative slowdown that counts as regression",
+    )
+
+    args = parser.parse_args()
+    if args.command == "run":
+        groups = args.groups if args.groups is not None else list(BENCHMARK_GROUPS)
+        results = run_benchmarks(groups, args.n_repeats, args.quick)
+        with open(args.output, "w") as out_file:
+            json.dump(results, out_file, indent=2)
+    else:
+        with open(args.baseline, "r") as baseline_file:
+            baseline = json.load(baseline_file)
+        with open(args.current, "r") as current_file:
+            current = json.load(current_file)
+        regressions = compare_results(baseline, current, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s)")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import itertools
+import multiprocessing
+import os
+
+import enigma
+
+# the machine of a worker process, set once when the worker starts
+_worker_enigma = None
+
+
+def _init_worker(enigma_: enigma.Enigma):
+    global _worker_enigma
+    _worker_enigma = enigma_
+
+
+def _encode_chunk(enigma_: enigma.Enigma, chunk: list) -> list:
+    messages, start_positions = zip(*chunk)
+    return enigma_.encode_batch(list(messages), list(start_positions))
+
+
+def _encode_chunk_in_worker(chunk: list) -> list:
+    return _encode_chunk(_worker_enigma, chunk)
+
+
+def _iter_chunks(jobs, chunk_size: int):
+    jobs = iter(jobs)
+    while True:
+        chunk = list(itertools.islice(jobs, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class BulkEncoder:
+    """
+    Encode many (message, start_positions) jobs on a pool of worker processes.
+    The machine is sent to each worker once when the pool starts, the jobs are sent in
+    chunks of chunk_size and the results come back in the order of the jobs.
+    Inputs with fewer than min_n_jobs_for_pool jobs are encoded in this process.
+    """
+
+    def __init__(
+        self,
+        enigma_: enigma.Enigma,
+        n_workers: int = None,
+        chunk_size: int = 1000,
+        min_n_jobs_for_pool: int = 10000,
+    ):
+        self.enigma = enigma_
+        self.n_workers = n_workers if n_workers is not None else os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.min_n_jobs_for_pool = min_n_jobs_for_pool
+
+    def imap(self, jobs):
+        """
+        :param jobs: iterable of (message, start_positions)
+        :return: generator of the encoded messages, in the order of the jobs
+        """
+        jobs = iter(jobs)
+        # look ahead to decide if a pool is worth starting
+        head = list(itertools.islice(jobs, self.min_n_jobs_for_pool))
+        if len(head) < self.min_n_jobs_for_pool or self.n_workers <= 1:
+            for chunk in _iter_chunks(itertools.chain(head, jobs), self.chunk_size):
+                yield from _encode_chunk(self.enigma, chunk)
+            return
+
+        chunks = _iter_chunks(itertools.chain(head, jobs), self.chunk_size)
+        with multiprocessing.Pool(
+            self.n_workers, initializer=_init_worker, initargs=(self.enigma,)
+        ) as pool:
+            for encoded_chunk in pool.imap(_encode_chunk_in_worker, chunks):
+                yield from encoded_chunk
+
+    def map(self, jobs) -> list:
+        return list(self.imap(jobs))
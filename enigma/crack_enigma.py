@@ -1,11 +1,20 @@
 import collections
+import contextlib
+import functools
+import hashlib
+import itertools
+import json
 import math
+import multiprocessing
+import os
 import string
+import time
 import numpy as np
 import copy
 import tqdm
 
 import enigma
+import metrics_enigma
 
 
 def conv_number_to_base(n: int, b: int) -> list:
@@ -18,6 +27,14 @@ def conv_number_to_base(n: int, b: int) -> list:
     return digits[::-1]
 
 
+def _lin_idxs_to_positions(lin_idxs: np.ndarray, n_dims: int, n_val_per_dim: int):
+    # same order as MultiindexIiterator, the first dimension is the most significant
+    positions = np.empty((len(lin_idxs), n_dims), dtype=np.int64)
+    for dim in reversed(range(n_dims)):
+        lin_idxs, positions[:, dim] = np.divmod(lin_idxs, n_val_per_dim)
+    return positions
+
+
 class MultiindexIiterator:
     """
     iterate over a grid of points in a linear way.
@@ -30,125 +47,2221 @@ class MultiindexIiterator:
     [1,2]
     ....
     [2,2]
+    start, stop and step select a range of the linear index like range() does,
+    slicing the iterator gives a new iterator over the selected part.
+    The multiindex is incremented like an odometer instead of being converted from the linear index.
     """
 
-    def __init__(self, n_dims, n_val_per_dim):
+    def __init__(self, n_dims, n_val_per_dim, start=0, stop=None, step=1):
         self.n_dims = n_dims
         self.n_val_per_dim = n_val_per_dim
-        self.lin_idx = 0
+        n_total = self.n_val_per_dim**self.n_dims
+        self.lin_range = range(n_total)[start:stop:step]
+        if self.lin_range.step <= 0:
+            raise ValueError("only positive steps are supported")
+        # the step as multiindex, added to the odometer at each iteration
+        # (steps larger than the grid can only produce a single element)
+        self._step_digits = self._to_multiindex(self.lin_range.step % n_total)
+        self._highest_step_dim = min(
+            (dim for dim, digit in enumerate(self._step_digits) if digit > 0),
+            default=self.n_dims,
+        )
+        self.lin_idx = self.lin_range.start
+        self._digits = None
+
+        self.len = len(self.lin_range)
+
+    def _to_multiindex(self, lin_idx: int) -> list:
+        baseconverted = conv_number_to_base(lin_idx, self.n_val_per_dim)
+        n_pad_zeros = self.n_dims - len(baseconverted)
+        return n_pad_zeros * [0] + baseconverted
+
+    def __len__(self):
+        return self.len
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            sub_range = self.lin_range[item]
+            return MultiindexIiterator(
+                self.n_dims,
+                self.n_val_per_dim,
+                start=sub_range.start,
+                stop=sub_range.stop,
+                step=sub_range.step,
+            )
+        return self._to_multiindex(self.lin_range[item])
+
+    def __iter__(self):
+        self.lin_idx = self.lin_range.start
+        self._digits = self._to_multiindex(self.lin_idx) if self.len > 0 else None
+        return self
+
+    def __next__(self):
+        if self.lin_idx < self.lin_range.stop:
+            current = self._digits.copy()
+            self.lin_idx += self.lin_range.step
+            # add the step digit by digit, starting with the least significant one.
+            # digits above the step only change if there is a carryover
+            carryover = 0
+            dim = self.n_dims - 1
+            while dim >= 0 and (dim >= self._highest_step_dim or carryover):
+                carryover, self._digits[dim] = divmod(
+                    self._digits[dim] + self._step_digits[dim] + carryover,
+                    self.n_val_per_dim,
+                )
+                dim -= 1
+            return current
+        else:
+            raise StopIteration
+
+    def iter_blocks(self, block_size: int):
+        """
+        :return: generator of arrays (block_size x n_dims) with consecutive multiindices,
+        the last block can be smaller
+        """
+        for block_start in range(0, self.len, block_size):
+            lin_idxs = np.array(self.lin_range[block_start : block_start + block_size])
+            yield _lin_idxs_to_positions(lin_idxs, self.n_dims, self.n_val_per_dim)
+
+
+class TextScorerBase:
+    def score_text(self, text: str) -> float:
+        raise NotImplementedError
+
+
+class GroupLikelihoodScorer(TextScorerBase):
+    def __init__(self, loglikelihooddict: dict, not_known_penalty_factor=2):
+        """
+        :param loglikelihooddict:
+        :param not_known_penalty_factor: If a group is encountered that is not in the loglikelihooddict,
+        choose a penalty based on the least liely group and the additional penalty factor
+        """
+        least_likely = min(loglikelihooddict, key=lambda k: loglikelihooddict[k])
+        # partial instead of a lambda so the scorer can be sent to worker processes
+        self.lld = collections.defaultdict(
+            functools.partial(
+                float, loglikelihooddict[least_likely] * not_known_penalty_factor
+            ),
+            loglikelihooddict,
+        )
+        self.n_chars_group = len(least_likely)
+
+    def score_text(self, text: str) -> float:
+        score = 0.0
+        n_groups = len(text) - self.n_chars_group + 1
+        for i in range(n_groups):
+            group = text[i : i + self.n_chars_group]
+            score += self.lld[group]
+        score /= n_groups
+        return score
+
+
+class DenseGroupLikelihoodScorer(TextScorerBase):
+    """
+    Same scores as GroupLikelihoodScorer, but the loglikelihoods of all
+    len(charset)**n_chars_group groups (including the penalty of unknown groups) are stored in a
+    dense array that is indexed by the groups' characters as digits in base len(charset).
+    Texts of character indices are scored without building strings, also many at once.
+    """
+
+    def __init__(
+        self,
+        loglikelihooddict: dict,
+        charset: str = string.ascii_lowercase,
+        not_known_penalty_factor=2,
+    ):
+        scorer = GroupLikelihoodScorer(
+            loglikelihooddict, not_known_penalty_factor=not_known_penalty_factor
+        )
+        self._init_from_group_scorer(scorer, charset)
+
+    @classmethod
+    def from_group_scorer(cls, scorer: GroupLikelihoodScorer, charset: str):
+        dense_scorer = cls.__new__(cls)
+        dense_scorer._init_from_group_scorer(scorer, charset)
+        return dense_scorer
+
+    def _init_from_group_scorer(self, scorer: GroupLikelihoodScorer, charset: str):
+        self.charset = charset
+        self.n_chars = len(charset)
+        self.n_chars_group = scorer.n_chars_group
+        self.char_to_number_map = {char: i for i, char in enumerate(charset)}
+
+        self.table = np.full(
+            self.n_chars**self.n_chars_group, scorer.lld.default_factory(), dtype=float
+        )
+        for group, loglikelihood in scorer.lld.items():
+            if all(char in self.char_to_number_map for char in group):
+                group_idx = 0
+                for char in group:
+                    group_idx = group_idx * self.n_chars + self.char_to_number_map[char]
+                self.table[group_idx] = loglikelihood
+        self.table.setflags(write=False)
+        self.max_loglikelihood = float(np.max(self.table))
+
+    def text_to_ints(self, text: str) -> np.ndarray:
+        return np.array(
+            [self.char_to_number_map[char] for char in text], dtype=np.int64
+        )
+
+    def get_group_idxs(self, texts: np.ndarray) -> np.ndarray:
+        """
+        :param texts: character indices, one text or one text per row
+        :return: the table index of each window of n_chars_group characters
+        """
+        n_groups = texts.shape[-1] - self.n_chars_group + 1
+        group_idxs = np.zeros(texts.shape[:-1] + (n_groups,), dtype=np.int64)
+        for i in range(self.n_chars_group):
+            group_idxs *= self.n_chars
+            group_idxs += texts[..., i : i + n_groups]
+        return group_idxs
+
+    def get_window_loglikelihoods(self, texts: np.ndarray) -> np.ndarray:
+        return self.table[self.get_group_idxs(texts)]
+
+    def score_batch(self, texts: np.ndarray) -> np.ndarray:
+        """
+        :param texts: 2D array of character indices, one text per row
+        :return: the score of each text
+        """
+        loglikelihoods = self.get_window_loglikelihoods(texts)
+        # cumsum adds up in order, so the result is identical to the summation in score_text
+        return np.cumsum(loglikelihoods, axis=-1)[..., -1] / loglikelihoods.shape[-1]
+
+    def score_batch_bounded(
+        self,
+        decrypt_chunk,
+        n_texts: int,
+        len_text: int,
+        threshold: float,
+        chunk_size: int = 32,
+    ):
+        """
+        Score texts that are decrypted chunk by chunk. A text is dropped as soon as its
+        partial score plus the maximum loglikelihood for each remaining window can not
+        reach threshold anymore. The scores of the other texts are identical to score_batch.
+
+        :param decrypt_chunk: function (text indices, start, stop) that returns the
+        characters start ... stop-1 of these texts as array (n_indices x (stop - start))
+        :param threshold: texts that can not score higher than this may be dropped
+        :return: the scores, -inf for dropped texts, and the number of characters
+        that did not have to be decrypted
+        """
+        n_groups = len_text - self.n_chars_group + 1
+        chunk_size = max(chunk_size, self.n_chars_group)
+        # only drop texts that are below the threshold by more than rounding errors
+        threshold_total = threshold * n_groups
+        threshold_total -= 1e-9 * (abs(threshold_total) + 1)
+
+        alive = np.arange(n_texts)
+        totals = np.zeros(n_texts)
+        tails = np.zeros((n_texts, 0), dtype=np.int64)
+        n_scored_groups = 0
+        n_chars_saved = 0
+        for start in range(0, len_text, chunk_size):
+            stop = min(start + chunk_size, len_text)
+            texts = np.concatenate([tails, decrypt_chunk(alive, start, stop)], axis=1)
+            loglikelihoods = self.get_window_loglikelihoods(texts)
+            # continue the summation in order, so the totals are the same as in score_batch
+            totals[alive] = np.cumsum(
+                np.concatenate([totals[alive, np.newaxis], loglikelihoods], axis=1),
+                axis=1,
+            )[:, -1]
+            n_scored_groups += loglikelihoods.shape[1]
+            tails = texts[:, texts.shape[1] - self.n_chars_group + 1 :]
+
+            bounds = (
+                totals[alive] + (n_groups - n_scored_groups) * self.max_loglikelihood
+            )
+            keep = bounds >= threshold_total
+            n_chars_saved += int(np.sum(~keep)) * (len_text - stop)
+            alive = alive[keep]
+            tails = tails[keep]
+            if not len(alive):
+                break
+
+        scores = np.full(n_texts, -np.inf)
+        scores[alive] = totals[alive] / n_groups
+        return scores, n_chars_saved
+
+    def score_ints(self, text: np.ndarray) -> float:
+        return float(self.score_batch(text))
+
+    def score_text(self, text: str) -> float:
+        return self.score_ints(self.text_to_ints(text))
+
+
+class IndexOfCoincidenceScorer(TextScorerBase):
+    """
+    Index of coincidence, the probability that two characters drawn from the text are equal.
+    Language text has a much higher index than random text, and it does not change under
+    a substitution of the characters. Cheap to compute, so it can rank rotor positions
+    before the expensive scoring.
+    """
+
+    def __init__(self, charset: str = string.ascii_lowercase):
+        self.charset = charset
+        self.n_chars = len(charset)
+        self.char_to_number_map = {char: i for i, char in enumerate(charset)}
+
+    def score_batch(self, texts: np.ndarray) -> np.ndarray:
+        """
+        :param texts: 2D array of character indices, one text per row
+        :return: the index of coincidence of each text
+        """
+        n_texts, len_text = texts.shape
+        offsets = self.n_chars * np.arange(n_texts)[:, np.newaxis]
+        counts = np.bincount(
+            (texts + offsets).ravel(), minlength=n_texts * self.n_chars
+        ).reshape(n_texts, self.n_chars)
+        return np.sum(counts * (counts - 1), axis=1) / max(len_text * (len_text - 1), 1)
+
+    def score_text(self, text: str) -> float:
+        text_ints = np.array([self.char_to_number_map[char] for char in text])
+        return float(self.score_batch(text_ints.reshape(1, -1))[0])
+
+
+def _positions_by_char(ints: np.ndarray, n_chars: int) -> list:
+    """
+    :return: list with the sorted positions of each character in ints
+    """
+    order = np.argsort(ints, kind="stable")
+    return np.split(order, np.cumsum(np.bincount(ints, minlength=n_chars))[:-1])
+
+
+class PlugboardCrackingState:
+    """
+    Decryption of a ciphertext at fixed rotor start positions, with incremental updates for
+    plug board changes. Changing a plug only changes the output at positions where the
+    ciphertext character or the output of the rotors (before the plug board) is one of the
+    re-plugged characters, so only those positions and their overlapping n-gram windows are
+    recomputed. The positions of each character in the ciphertext and in the output of
+    the rotors are indexed, so a change and its undo take O(number of affected positions).
+
+    The plug board of compiled_enigma's machine must only be changed through this object.
+    """
+
+    def __init__(
+        self,
+        compiled_enigma: enigma.CompiledEnigma,
+        encrypted_message: str,
+        scorer: DenseGroupLikelihoodScorer,
+        rotor_positions,
+    ):
+        self.plugboard = compiled_enigma.enigma.plug_board
+        self.scorer = scorer
+        self.rotor_positions = list(rotor_positions)
+        self.encrypted_ints = compiled_enigma.enigma.chars_to_ints(encrypted_message)
+        self.core_table = compiled_enigma.get_core_table(
+            rotor_positions, len(self.encrypted_ints)
+        )
+
+        plug_board = self.plugboard.get_permutation()
+        steps = np.arange(len(self.encrypted_ints))
+        # output of the rotors before the last pass through the plug board
+        self.mid_ints = self.core_table[steps, plug_board[self.encrypted_ints]]
+        self.decrypted_ints = plug_board[self.mid_ints]
+        self.window_loglikelihoods = scorer.get_window_loglikelihoods(
+            self.decrypted_ints
+        )
+        self.total_loglikelihood = float(np.sum(self.window_loglikelihoods))
+
+        n_chars = self.plugboard.n_positions
+        self._cipher_positions = _positions_by_char(self.encrypted_ints, n_chars)
+        # positions that change their mid character are appended to the list of the new
+        # character, stale entries are only dropped when a list is read
+        self._mid_positions = [
+            [positions] for positions in _positions_by_char(self.mid_ints, n_chars)
+        ]
+        # only written and read at the positions that are deduplicated, see _unique
+        self._scratch = np.empty(len(self.encrypted_ints), dtype=np.int64)
+
+        self._undo_record = None
+        self.n_updated_positions = 0
+
+    @property
+    def score(self) -> float:
+        return self.total_loglikelihood / len(self.window_loglikelihoods)
+
+    def get_decrypted_message(self) -> str:
+        return "".join(self.scorer.charset[i] for i in self.decrypted_ints)
+
+    def set_element_swap(self, e1: int, e2: int) -> float:
+        changed = {e1, e2, self.plugboard.get_output(e1), self.plugboard.get_output(e2)}
+        return self._change_plugs(
+            changed, lambda: self.plugboard.set_element_swap(e1, e2)
+        )
+
+    def unset_element_swap(self, e1: int, e2: int) -> float:
+        return self._change_plugs(
+            {e1, e2}, lambda: self.plugboard.unset_element_swap(e1, e2)
+        )
+
+    def move_one_swap_side(self, move_from: int, move_to: int) -> float:
+        changed = {move_from, move_to, self.plugboard.get_output(move_from)}
+        return self._change_plugs(
+            changed, lambda: self.plugboard.move_one_swap_side(move_from, move_to)
+        )
+
+    def _change_plugs(self, changed: set, change_plugboard) -> float:
+        """
+        :param changed: all characters whose plug board output can change
+        :return: the new score
+        """
+        old_partners = {char: self.plugboard.get_output(char) for char in changed}
+        affected = self._unique(
+            np.concatenate(
+                [self._cipher_positions[char] for char in changed]
+                + [self._get_mid_positions(char) for char in changed]
+            )
+        )
+        change_plugboard()
+        plug_board = self.plugboard.get_permutation()
+
+        old_mid = self.mid_ints[affected]
+        old_decrypted = self.decrypted_ints[affected]
+        new_mid = self.core_table[affected, plug_board[self.encrypted_ints[affected]]]
+        old_mid_positions = self._move_mid_positions(affected, new_mid)
+        self.mid_ints[affected] = new_mid
+        self.decrypted_ints[affected] = plug_board[new_mid]
+        # lists of characters that are not read for a long time are compacted
+        for char in old_mid_positions:
+            if len(self._mid_positions[char]) > 64:
+                self._get_mid_positions(char)
+
+        # windows that contain a changed output character,
+        # window w covers the positions w ... w + n_chars_group - 1
+        n_chars_group = self.scorer.n_chars_group
+        changed_positions = affected[self.decrypted_ints[affected] != old_decrypted]
+        windows = (changed_positions[:, np.newaxis] - np.arange(n_chars_group)).ravel()
+        windows = self._unique(
+            windows[(windows >= 0) & (windows < len(self.window_loglikelihoods))]
+        )
+        old_loglikelihoods = self.window_loglikelihoods[windows]
+        group_idxs = np.zeros(len(windows), dtype=np.int64)
+        for offset in range(n_chars_group):
+            group_idxs *= self.scorer.n_chars
+            group_idxs += self.decrypted_ints[windows + offset]
+        new_loglikelihoods = self.scorer.table[group_idxs]
+        self.window_loglikelihoods[windows] = new_loglikelihoods
+
+        old_total = self.total_loglikelihood
+        self.total_loglikelihood += float(
+            np.sum(new_loglikelihoods) - np.sum(old_loglikelihoods)
+        )
+        self.n_updated_positions += len(affected)
+
+        self._undo_record = (
+            old_partners,
+            affected,
+            old_mid,
+            old_decrypted,
+            old_mid_positions,
+            windows,
+            old_loglikelihoods,
+            old_total,
+        )
+        return self.score
+
+    def _unique(self, positions: np.ndarray) -> np.ndarray:
+        """
+        :return: positions without repetitions, in O(len(positions)) without sorting
+        """
+        # one of the writes to a repeated position wins, only its entry is kept
+        entry_idxs = np.arange(len(positions))
+        self._scratch[positions] = entry_idxs
+        return positions[self._scratch[positions] == entry_idxs]
+
+    def _get_mid_positions(self, char: int) -> np.ndarray:
+        """
+        :return: positions where the output of the rotors is char
+        """
+        chunks = self._mid_positions[char]
+        if len(chunks) == 1:
+            positions = chunks[0]
+        else:
+            positions = self._unique(np.concatenate(chunks))
+        positions = positions[self.mid_ints[positions] == char]
+        self._mid_positions[char] = [positions]
+        return positions
+
+    def _move_mid_positions(self, positions, new_mid) -> dict:
+        """
+        add positions whose rotor output changes to the index of their new output,
+        their old entries are dropped lazily
+
+        :return: the previous index of each touched character, to restore on undo
+        """
+        is_moved = self.mid_ints[positions] != new_mid
+        moved_positions = positions[is_moved]
+        moved_mid = new_mid[is_moved]
+
+        # stable sorts of small integers are radix sorts
+        order = np.argsort(
+            moved_mid.astype(np.min_scalar_type(self.plugboard.n_positions - 1)),
+            kind="stable",
+        )
+        moved_positions = moved_positions[order]
+        bounds = np.searchsorted(
+            moved_mid[order], np.arange(self.plugboard.n_positions + 1)
+        )
+        previous = {}
+        for char in np.flatnonzero(np.diff(bounds)).tolist():
+            # new lists, the previous ones stay valid for the undo
+            previous[char] = self._mid_positions[char]
+            self._mid_positions[char] = previous[char] + [
+                moved_positions[bounds[char] : bounds[char + 1]]
+            ]
+        return previous
+
+    def undo(self):
+        """
+        revert the last plug change
+        """
+        if self._undo_record is None:
+            raise RuntimeError("there is no change to undo")
+        (
+            old_partners,
+            affected,
+            old_mid,
+            old_decrypted,
+            old_mid_positions,
+            windows,
+            old_loglikelihoods,
+            old_total,
+        ) = self._undo_record
+        self._undo_record = None
+
+        # all current and previous partners of the changed characters are in old_partners
+        for char in old_partners:
+            if self.plugboard.get_output(char) != char:
+                self.plugboard.unset_element_swap(char, self.plugboard.get_output(char))
+        for char, partner in old_partners.items():
+            if partner != char:
+                self.plugboard.set_element_swap(char, partner)
+
+        self.mid_ints[affected] = old_mid
+        self.decrypted_ints[affected] = old_decrypted
+        for char, chunks in old_mid_positions.items():
+            self._mid_positions[char] = chunks
+        self.window_loglikelihoods[windows] = old_loglikelihoods
+        self.total_loglikelihood = old_total
+
+
+# number of groups up to which GroupLikelihoodScorers are converted to a dense table of
+# float64, at most 128 MiB. Triads of bytes (256**3 == 2**24) are still converted,
+# quads of a printable charset (100**4 groups, 800 MB) are not
+_MAX_DENSE_TABLE_SIZE = 2**24
+
+
+def as_dense_scorer(scorer: TextScorerBase, charset: str) -> TextScorerBase:
+    """
+    :return: a DenseGroupLikelihoodScorer for GroupLikelihoodScorers whose table has at most
+    _MAX_DENSE_TABLE_SIZE entries, other scorers as they are
+    """
+    if (
+        isinstance(scorer, GroupLikelihoodScorer)
+        and len(charset) ** scorer.n_chars_group <= _MAX_DENSE_TABLE_SIZE
+    ):
+        return DenseGroupLikelihoodScorer.from_group_scorer(scorer, charset)
+    return scorer
+
+
+def _as_batch_scorer(scorer: TextScorerBase, charset: str) -> TextScorerBase:
+    """
+    :return: as_dense_scorer(scorer, charset), raises a ValueError if it can not score
+    batches of texts, i.e. a GroupLikelihoodScorer whose dense table would be too large
+    """
+    scorer = as_dense_scorer(scorer, charset)
+    if not hasattr(scorer, "score_batch"):
+        raise ValueError(
+            f"the scorer can not score batches, the dense table of a GroupLikelihoodScorer "
+            f"is limited to {_MAX_DENSE_TABLE_SIZE} groups"
+        )
+    return scorer
+
+
+def _decrypt_and_score(
+    compiled_enigma: enigma.CompiledEnigma,
+    encrypted_message: str,
+    scorer: TextScorerBase,
+    rotor_positions,
+) -> float:
+    if isinstance(scorer, DenseGroupLikelihoodScorer):
+        encrypted_ints = compiled_enigma.enigma.chars_to_ints(encrypted_message)
+        return scorer.score_ints(
+            compiled_enigma.encode_ints(encrypted_ints, rotor_positions)
+        )
+    decoder_try = compiled_enigma.encode_message(encrypted_message, rotor_positions)
+    return scorer.score_text(decoder_try)
+
+
+class ScoreCache:
+    """
+    Bounded cache of the scores of the decryptions of one message with one scorer, keyed by
+    the rotor positions and the permutation of the plug board. The least recently used score
+    is dropped when max_size scores are stored. Markov chains keep revisiting the same
+    settings, a hit saves the decryption and the scoring.
+    """
+
+    def __init__(self, max_size: int = 100000):
+        self.max_size = max_size
+        self._scores = collections.OrderedDict()
+        self.n_hits = 0
+        self.n_misses = 0
+
+    def __len__(self):
+        return len(self._scores)
+
+    def get(self, rotor_positions, plug_board: np.ndarray):
+        """
+        :param plug_board: permutation of the plug board, see Swapper.get_permutation
+        :return: the cached score, None if it is not there
+        """
+        key = (tuple(int(pos) for pos in rotor_positions), plug_board.tobytes())
+        score = self._scores.get(key)
+        if score is None:
+            self.n_misses += 1
+            return None
+        self.n_hits += 1
+        self._scores.move_to_end(key)
+        return score
+
+    def put(self, rotor_positions, plug_board: np.ndarray, score: float):
+        key = (tuple(int(pos) for pos in rotor_positions), plug_board.tobytes())
+        self._scores[key] = score
+        self._scores.move_to_end(key)
+        if len(self._scores) > self.max_size:
+            self._scores.popitem(last=False)
+
+    def decrypt_and_score(
+        self,
+        compiled_enigma: enigma.CompiledEnigma,
+        encrypted_message: str,
+        scorer: TextScorerBase,
+        rotor_positions,
+    ) -> float:
+        """
+        :return: the score of _decrypt_and_score, from the cache if it is there
+        """
+        plug_board = compiled_enigma.enigma.plug_board.get_permutation()
+        score = self.get(rotor_positions, plug_board)
+        if score is None:
+            score = _decrypt_and_score(
+                compiled_enigma, encrypted_message, scorer, rotor_positions
+            )
+            self.put(rotor_positions, plug_board, score)
+        return score
+
+    def get_stats(self) -> dict:
+        n_lookups = self.n_hits + self.n_misses
+        return dict(
+            n_hits=self.n_hits,
+            n_misses=self.n_misses,
+            hit_rate=self.n_hits / n_lookups if n_lookups else 0.0,
+            size=len(self._scores),
+        )
+
+
+def _cached_decrypt_and_score(
+    compiled_enigma: enigma.CompiledEnigma,
+    encrypted_message: str,
+    scorer: TextScorerBase,
+    rotor_positions,
+    score_cache: ScoreCache = None,
+) -> float:
+    if score_cache is None:
+        return _decrypt_and_score(
+            compiled_enigma, encrypted_message, scorer, rotor_positions
+        )
+    return score_cache.decrypt_and_score(
+        compiled_enigma, encrypted_message, scorer, rotor_positions
+    )
+
+
+def _split_range(n_total: int, n_shards: int) -> list:
+    # contiguous shards of the linear index space
+    bounds = np.linspace(0, n_total, num=n_shards + 1, dtype=np.int64).tolist()
+    return [
+        (start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start
+    ]
+
+
+def _reduce_shard_results(shard_results: list, top_k: int) -> list:
+    """
+    merge lists of (score, linear index) from shards. Equal scores are ordered by their index,
+    so the result does not depend on how the index space was split.
+    """
+    merged = [result for shard_result in shard_results for result in shard_result]
+    merged.sort(key=lambda result: (-result[0], result[1]))
+    return merged[:top_k]
+
+
+class _Checkpointer:
+    """
+    Keeps the state of a run that is needed to resume it and writes it to a json file,
+    at most every interval seconds unless forced. The file is replaced atomically, so a killed
+    run always leaves a complete checkpoint. Without a path nothing is written.
+    """
+
+    def __init__(self, path: str, interval: float, run: dict):
+        """
+        :param run: parameters of the run, a checkpoint of a different run is not resumed
+        """
+        self.path = path
+        self.interval = interval
+        # compared as it is read back, json turns tuples into lists
+        run = json.loads(json.dumps(run))
+        self.state = {"run": run}
+        self.last_write = time.monotonic()
+        if path is not None and os.path.exists(path):
+            with open(path, "r") as read_file:
+                state = json.load(read_file)
+            if state["run"] != run:
+                raise ValueError(f"the checkpoint {path} belongs to a different run")
+            self.state = state
+
+    def get(self, key: str, default=None):
+        return self.state.get(key, default)
+
+    def update(self, force: bool = False, **sections):
+        self.state.update(sections)
+        if self.path is None:
+            return
+        if force or time.monotonic() - self.last_write >= self.interval:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as write_file:
+                json.dump(self.state, write_file)
+            os.replace(tmp_path, self.path)
+            self.last_write = time.monotonic()
+
+
+def _message_digest(message) -> str:
+    if isinstance(message, str):
+        message = message.encode("utf-32")
+    return hashlib.sha256(message).hexdigest()
+
+
+def _scorer_digest(scorer: TextScorerBase) -> str:
+    """
+    :return: hash of the type and group size of the scorer, and of the table of dense scorers
+    """
+    digest = hashlib.sha256(type(scorer).__name__.encode())
+    digest.update(str(getattr(scorer, "n_chars_group", None)).encode())
+    if isinstance(scorer, DenseGroupLikelihoodScorer):
+        digest.update(scorer.table.tobytes())
+    return digest.hexdigest()
+
+
+def _machine_run_params(machine: enigma.Enigma) -> dict:
+    """
+    :return: the parts of the machine that a checkpointed search does not change
+    """
+    return dict(
+        rotor_seeds=[rotor.seed for rotor in machine.rotors],
+        reflector=[list(pair) for pair in sorted(machine.reflector.swap_dict.items())],
+        charset=_message_digest(machine.charset),
+    )
+
+
+def _decrypt_with_odometer_table(
+    odometer_table: np.ndarray,
+    start_values: np.ndarray,
+    plugged_ints: np.ndarray,
+    plug_board: np.ndarray,
+    first_step: int = 0,
+) -> np.ndarray:
+    """
+    :param start_values: odometer values of the rotor start positions,
+    see Enigma.get_odometer_values
+    :param plugged_ints: characters of the message after the plug board, starting at the
+    character first_step
+    :return: array (n_starts x len(plugged_ints)) with the decryption for each start value
+    """
+    n_values, n_chars = odometer_table.shape
+    # the table has at most _MAX_ODOMETER_TABLE_SIZE entries, 32 bit indices halve the traffic
+    steps = np.arange(first_step + 1, first_step + len(plugged_ints) + 1) % n_values
+    idxs = start_values.astype(np.int32)[:, np.newaxis] + steps.astype(np.int32)
+    np.subtract(idxs, n_values, out=idxs, where=idxs >= n_values)
+    idxs *= n_chars
+    idxs += plugged_ints.astype(np.int32)
+    return plug_board[odometer_table.ravel().take(idxs)]
+
+
+def _sweep_rotor_range(
+    decoder_enigma: enigma.Enigma,
+    encrypted_ints: np.ndarray,
+    scorer: TextScorerBase,
+    lin_start: int,
+    lin_stop: int,
+    block_size: int,
+    top_k: int,
+    progress_bar=None,
+    lin_idxs: np.ndarray = None,
+    bounded: bool = False,
+    counters: collections.Counter = None,
+    odometer_table: np.ndarray = None,
+    threshold: float = -np.inf,
+) -> tuple:
+    """
+    :param scorer: scorer with a score_batch method
+    :param lin_idxs: sorted linear indices of the rotor positions to sweep, if given only
+    lin_idxs[lin_start:lin_stop] are swept instead of all positions in [lin_start, lin_stop)
+    :param bounded: decrypt and score a DenseGroupLikelihoodScorer chunk by chunk and stop
+    early for positions that can not make it into the top_k anymore
+    :param counters: if given, n_candidates, n_scorer_calls, encode_seconds and
+    score_seconds of the sweep are added to it
+    :param odometer_table: Enigma.get_odometer_core_table of decoder_enigma, if given each
+    character is decrypted with one lookup in it instead of going through all rotors
+    :param threshold: with bounded scoring, positions that can not beat it are dropped as well
+    :return: list of the top_k (score, linear index) of the swept rotor positions,
+    and the number of characters that did not have to be decrypted
+    """
+    n_chars = len(decoder_enigma.charset)
+    n_rotors = len(decoder_enigma.rotors)
+    if lin_idxs is None:
+        positions = MultiindexIiterator(
+            n_rotors, n_chars, start=lin_start, stop=lin_stop
+        )
+        position_blocks = positions.iter_blocks(block_size)
+    else:
+        lin_idxs = lin_idxs[lin_start:lin_stop]
+        position_blocks = (
+            _lin_idxs_to_positions(lin_idxs[i : i + block_size], n_rotors, n_chars)
+            for i in range(0, len(lin_idxs), block_size)
+        )
+    bounded = bounded and isinstance(scorer, DenseGroupLikelihoodScorer)
+    plug_board = decoder_enigma.plug_board.get_permutation()
+    plugged_ints = plug_board[encrypted_ints]
+
+    scores = list()
+    min_threshold = threshold
+    n_chars_saved = 0
+    # timed per block, which is cheap compared to the decryption of a block
+    encode_seconds = 0.0
+    tick = time.perf_counter()
+    for start_positions in position_blocks:
+        if odometer_table is not None:
+            start_values = decoder_enigma.get_odometer_values(start_positions)
+
+        def decrypt_chunk(idxs, start, stop):
+            # characters [start, stop) of the message for the start positions at idxs
+            nonlocal encode_seconds
+            chunk_tick = time.perf_counter()
+            if odometer_table is not None:
+                decrypted = _decrypt_with_odometer_table(
+                    odometer_table,
+                    start_values[idxs],
+                    plugged_ints[start:stop],
+                    plug_board,
+                    first_step=start,
+                )
+            else:
+                position_sequence = decoder_enigma._rotor_position_sequence(
+                    start_positions[idxs], stop - start, first_step=start
+                )
+                decrypted = plug_board[
+                    decoder_enigma._apply_core(
+                        plugged_ints[np.newaxis, start:stop], position_sequence
+                    )
+                ]
+            encode_seconds += time.perf_counter() - chunk_tick
+            return decrypted
+
+        if bounded:
+            block_scores, n_saved = scorer.score_batch_bounded(
+                decrypt_chunk, len(start_positions), len(encrypted_ints), threshold
+            )
+            n_chars_saved += n_saved
+        else:
+            block_scores = scorer.score_batch(
+                decrypt_chunk(slice(None), 0, len(encrypted_ints))
+            )
+        scores.append(block_scores)
+        if bounded and sum(map(len, scores)) >= top_k:
+            # the score that a position has to beat to get into the top_k
+            threshold = max(
+                min_threshold,
+                -np.partition(-np.concatenate(scores), top_k - 1)[top_k - 1],
+            )
+        if progress_bar is not None:
+            progress_bar.update(len(start_positions))
+    if counters is not None:
+        counters["n_candidates"] += sum(map(len, scores))
+        counters["n_scorer_calls"] += len(scores)
+        counters["encode_seconds"] += encode_seconds
+        counters["score_seconds"] += time.perf_counter() - tick - encode_seconds
+    if not scores:
+        return list(), n_chars_saved
+    scores = np.concatenate(scores)
+
+    # stable sort keeps the first of equal scores in front
+    best_idxs = np.argsort(-scores, kind="stable")[:top_k]
+    if lin_idxs is None:
+        return [(scores[idx], lin_start + int(idx)) for idx in best_idxs], n_chars_saved
+    return [(scores[idx], int(lin_idxs[idx])) for idx in best_idxs], n_chars_saved
+
+
+# number of entries up to which the rotor sweeps precompute Enigma.get_odometer_core_table
+_MAX_ODOMETER_TABLE_SIZE = 2**26
+
+# state of the worker processes of the parallel searches, set once when a worker starts
+_worker_state = dict()
+
+
+def _init_search_worker(state: dict):
+    _worker_state.clear()
+    _worker_state.update(state)
+
+
+def _sweep_rotor_range_in_worker(task: tuple) -> tuple:
+    scorer_name, lin_start, lin_stop, top_k, lin_idxs = task
+    counters = collections.Counter()
+    result = _sweep_rotor_range(
+        _worker_state["decoder_enigma"],
+        _worker_state["encrypted_ints"],
+        _worker_state["scorers"][scorer_name],
+        lin_start,
+        lin_stop,
+        _worker_state["block_size"],
+        top_k,
+        lin_idxs=lin_idxs,
+        bounded=_worker_state["bounded"],
+        counters=counters,
+        odometer_table=_worker_state["odometer_table"],
+    )
+    return lin_stop - lin_start, result, counters
+
+
+def _sweep_stage(
+    pool,
+    decoder_enigma: enigma.Enigma,
+    encrypted_ints: np.ndarray,
+    scorers: dict,
+    scorer_name: str,
+    block_size: int,
+    top_k: int,
+    n_shards: int,
+    progress_bar,
+    lin_idxs: np.ndarray = None,
+    bounded: bool = False,
+    lin_start: int = 0,
+    lin_stop: int = None,
+    metrics: metrics_enigma.Metrics = None,
+    odometer_table: np.ndarray = None,
+) -> tuple:
+    """
+    sweep the rotor positions in [lin_start, lin_stop), or lin_idxs[lin_start:lin_stop],
+    in this process if pool is None and in n_shards shards on the pool otherwise
+
+    :param metrics: if given, the counters of the stage are added and a sweep_stage event
+    is emitted. With a pool, encode_seconds and score_seconds are summed over the workers.
+    :return: list of the top_k (score, linear index) and the number of characters
+    that did not have to be decrypted
+    """
+    if lin_stop is None:
+        if lin_idxs is None:
+            lin_stop = len(decoder_enigma.charset) ** len(decoder_enigma.rotors)
+        else:
+            lin_stop = len(lin_idxs)
+    tick = time.perf_counter()
+    counters = collections.Counter()
+
+    if pool is None:
+        shard_results = [
+            _sweep_rotor_range(
+                decoder_enigma,
+                encrypted_ints,
+                scorers[scorer_name],
+                lin_start,
+                lin_stop,
+                block_size,
+                top_k,
+                progress_bar=progress_bar,
+                lin_idxs=lin_idxs,
+                bounded=bounded,
+                counters=counters,
+                odometer_table=odometer_table,
+            )
+        ]
+    else:
+        shard_results = list()
+        for n_done, result, shard_counters in pool.imap_unordered(
+            _sweep_rotor_range_in_worker,
+            [
+                (
+                    scorer_name,
+                    lin_start + shard_start,
+                    lin_start + shard_stop,
+                    top_k,
+                    lin_idxs,
+                )
+                for shard_start, shard_stop in _split_range(
+                    lin_stop - lin_start, n_shards
+                )
+            ],
+        ):
+            shard_results.append(result)
+            counters.update(shard_counters)
+            progress_bar.update(n_done)
+    results, n_chars_saved = zip(*shard_results)
+
+    if metrics is not None:
+        metrics.add(counters)
+        seconds = time.perf_counter() - tick
+        metrics.emit(
+            "sweep_stage",
+            stage=scorer_name,
+            lin_start=lin_start,
+            lin_stop=lin_stop,
+            seconds=seconds,
+            candidates_per_second=counters["n_candidates"] / seconds,
+            **counters,
+        )
+    return _reduce_shard_results(results, top_k), sum(n_chars_saved)
+
+
+def _add_search_stats(stats: dict, n_chars_total: int, n_chars_saved: int):
+    stats["n_chars_total"] = stats.get("n_chars_total", 0) + n_chars_total
+    stats["n_chars_saved"] = stats.get("n_chars_saved", 0) + n_chars_saved
+
+
+def sweep_rotor_positions(
+    encrypted_message: str,
+    decoder_enigma: enigma.Enigma,
+    scorer: TextScorerBase,
+    block_size: int = 2048,
+    top_k: int = 1,
+    disable_tqdm=True,
+    n_workers: int = 1,
+    prefilter_fraction: float = None,
+    bounded: bool = False,
+    stats: dict = None,
+    checkpoint_path: str = None,
+    checkpoint_interval: float = 60.0,
+    metrics: metrics_enigma.Metrics = None,
+):
+    """
+    Decrypt and score the message for all rotor start positions, block_size positions at a time.
+    The plug board of decoder_enigma is used as it is. The scorer must be a
+    GroupLikelihoodScorer or have a score_batch method.
+    The result is the same as looping over all positions with encode_message and score_text,
+    ties are won by the position that comes first in the order of MultiindexIiterator.
+    With n_workers > 1, contiguous shards of the positions are searched on a process pool,
+    the result does not depend on the number of workers.
+
+    :param prefilter_fraction: if given, the positions are ranked by the index of
+    coincidence of their decryption first and only this fraction of the best
+    positions (at least top_k) is scored with the scorer
+    :param bounded: decrypt and score in chunks and stop early for positions that can not
+    get into the top_k anymore, see DenseGroupLikelihoodScorer.score_batch_bounded.
+    The result is the same.
+    :param stats: if given, the number of characters of all decryptions in the scoring
+    stage and how many of them were saved by bounded scoring are added to
+    stats["n_chars_total"] and stats["n_chars_saved"]
+    :param checkpoint_path: if given, the progress is written to this json file at most every
+    checkpoint_interval seconds and a run with the same parameters resumes from it
+    :param metrics: if given, a sweep_stage event is emitted for each stage
+    :return: list of the top_k (score, rotor positions), best first
+    """
+    checkpointer = _Checkpointer(
+        checkpoint_path,
+        checkpoint_interval,
+        run=dict(
+            kind="sweep_rotor_positions",
+            message=_message_digest(encrypted_message),
+            **_machine_run_params(decoder_enigma),
+            swap_dict=[
+                list(pair)
+                for pair in sorted(decoder_enigma.plug_board.swap_dict.items())
+            ],
+            scorer=_scorer_digest(scorer),
+            top_k=top_k,
+            prefilter_fraction=prefilter_fraction,
+        ),
+    )
+    results = _sweep_rotor_positions(
+        encrypted_message,
+        decoder_enigma,
+        scorer,
+        block_size,
+        top_k,
+        disable_tqdm,
+        n_workers,
+        prefilter_fraction,
+        bounded,
+        stats,
+        checkpointer,
+        metrics,
+    )
+    checkpointer.update(force=True)
+    return results
+
+
+def _sweep_rotor_positions(
+    encrypted_message: str,
+    decoder_enigma: enigma.Enigma,
+    scorer: TextScorerBase,
+    block_size: int,
+    top_k: int,
+    disable_tqdm,
+    n_workers: int,
+    prefilter_fraction: float,
+    bounded: bool,
+    stats: dict,
+    checkpointer: _Checkpointer,
+    metrics: metrics_enigma.Metrics,
+):
+    """
+    see sweep_rotor_positions, the progress of the scoring stage is kept in the
+    "rotor_sweep" section of the checkpoint
+    """
+    n_chars = len(decoder_enigma.charset)
+    n_rotors = len(decoder_enigma.rotors)
+    encrypted_ints = decoder_enigma.chars_to_ints(encrypted_message)
+    scorers = {"scorer": _as_batch_scorer(scorer, decoder_enigma.charset)}
+    # all positions are swept, so the core permutation of every odometer value is needed
+    if n_chars ** (n_rotors + 1) <= _MAX_ODOMETER_TABLE_SIZE:
+        odometer_table = decoder_enigma.get_odometer_core_table()
+    else:
+        odometer_table = None
+
+    n_positions = n_chars**n_rotors
+    n_total = n_positions
+    if prefilter_fraction is not None:
+        scorers["prefilter"] = IndexOfCoincidenceScorer(decoder_enigma.charset)
+        n_prefiltered = min(
+            max(top_k, math.ceil(prefilter_fraction * n_positions)), n_positions
+        )
+        n_total += n_prefiltered
+
+    if n_workers > 1:
+        pool_context = multiprocessing.Pool(
+            n_workers,
+            initializer=_init_search_worker,
+            initargs=(
+                dict(
+                    decoder_enigma=decoder_enigma,
+                    encrypted_ints=encrypted_ints,
+                    scorers=scorers,
+                    block_size=block_size,
+                    bounded=bounded,
+                    odometer_table=odometer_table,
+                ),
+            ),
+        )
+    else:
+        pool_context = contextlib.nullcontext()
+    with pool_context as pool, tqdm.tqdm(
+        total=n_total, disable=disable_tqdm
+    ) as progress_bar:
+        lin_idxs = None
+        if prefilter_fraction is not None:
+            prefilter_results, _ = _sweep_stage(
+                pool,
+                decoder_enigma,
+                encrypted_ints,
+                scorers,
+                "prefilter",
+                block_size,
+                n_prefiltered,
+                4 * n_workers,
+                progress_bar,
+                metrics=metrics,
+                odometer_table=odometer_table,
+            )
+            # sorted, so ties are still won by the first position
+            lin_idxs = np.sort(
+                np.array([lin_idx for _, lin_idx in prefilter_results], dtype=np.int64)
+            )
+        n_scored = n_positions if lin_idxs is None else len(lin_idxs)
+        progress = checkpointer.get(
+            "rotor_sweep", dict(n_done=0, best_results=list(), n_chars_saved=0)
+        )
+        best_results = [tuple(result) for result in progress["best_results"]]
+        n_chars_saved = progress["n_chars_saved"]
+        progress_bar.update(progress["n_done"])
+        # without checkpoints all positions are swept in one go
+        if checkpointer.path is None:
+            segment_size = n_scored
+        else:
+            segment_size = 16 * block_size * n_workers
+        for segment_start in range(progress["n_done"], n_scored, segment_size):
+            segment_stop = min(segment_start + segment_size, n_scored)
+            segment_results, segment_n_chars_saved = _sweep_stage(
+                pool,
+                decoder_enigma,
+                encrypted_ints,
+                scorers,
+                "scorer",
+                block_size,
+                top_k,
+                4 * n_workers,
+                progress_bar,
+                lin_idxs=lin_idxs,
+                bounded=bounded,
+                lin_start=segment_start,
+                lin_stop=segment_stop,
+                metrics=metrics,
+                odometer_table=odometer_table,
+            )
+            best_results = _reduce_shard_results([best_results, segment_results], top_k)
+            n_chars_saved += segment_n_chars_saved
+            checkpointer.update(
+                rotor_sweep=dict(
+                    n_done=segment_stop,
+                    best_results=[
+                        (float(score), lin_idx) for score, lin_idx in best_results
+                    ],
+                    n_chars_saved=n_chars_saved,
+                )
+            )
+
+    if stats is not None:
+        _add_search_stats(stats, n_scored * len(encrypted_ints), n_chars_saved)
+
+    best_positions = _lin_idxs_to_positions(
+        np.array([lin_idx for _, lin_idx in best_results], dtype=np.int64),
+        n_rotors,
+        n_chars,
+    )
+    return [
+        (score, positions)
+        for (score, _), positions in zip(best_results, best_positions.tolist())
+    ]
+
+
+def _plug_candidates(available_plug_positions: list) -> list:
+    """
+    :return: all unordered pairs (first, second) of the available positions,
+    first comes before second in available_plug_positions
+    """
+    return [
+        (first, second)
+        for i, first in enumerate(available_plug_positions)
+        for second in available_plug_positions[i + 1 :]
+    ]
+
+
+def _score_plug_candidates(
+    compiled_enigma: enigma.CompiledEnigma,
+    encrypted_message: str,
+    scorer: DenseGroupLikelihoodScorer,
+    rotor_positions: list,
+    candidates: list,
+    block_size: int = 64,
+    bounded: bool = False,
+) -> tuple:
+    """
+    score the decryption with each candidate plug added to the current plug board.
+    The core table at rotor_positions is cached in compiled_enigma, so every candidate
+    is only a table lookup and one round of plugs reuses the table of the previous round.
+
+    :param candidates: list of free position pairs (first, second)
+    :param block_size: number of candidates decrypted in one array operation
+    :param bounded: decrypt and score in chunks and drop candidates as soon as they can not
+    beat the best score of the previous blocks anymore, their score is -inf then
+    :return: array of the scores, in the order of candidates, and the number of characters
+    that did not have to be decrypted
+    """
+    encrypted_ints = compiled_enigma.enigma.chars_to_ints(encrypted_message)
+    len_msg = len(encrypted_ints)
+    core_table = compiled_enigma.get_core_table(rotor_positions, len_msg)
+    permutation = compiled_enigma.enigma.plug_board.get_permutation()
+    message_idxs = np.arange(len_msg)[np.newaxis, :]
+
+    scores = np.empty(len(candidates))
+    n_chars_saved = 0
+    for block_start in range(0, len(candidates), block_size):
+        pairs = np.array(candidates[block_start : block_start + block_size]).reshape(
+            -1, 2
+        )
+        candidate_idxs = np.arange(len(pairs))[:, np.newaxis]
+        # one plug board permutation per candidate
+        permutations = np.tile(permutation, (len(pairs), 1))
+        permutations[candidate_idxs[:, 0], pairs[:, 0]] = pairs[:, 1]
+        permutations[candidate_idxs[:, 0], pairs[:, 1]] = pairs[:, 0]
+
+        if bounded:
+
+            def decrypt_chunk(idxs, start, stop):
+                chunk_permutations = permutations[idxs]
+                rows = np.arange(len(idxs))[:, np.newaxis]
+                plugged = chunk_permutations[
+                    rows, encrypted_ints[np.newaxis, start:stop]
+                ]
+                return chunk_permutations[
+                    rows, core_table[message_idxs[:, start:stop], plugged]
+                ]
+
+            block_scores, n_saved = scorer.score_batch_bounded(
+                decrypt_chunk,
+                len(pairs),
+                len_msg,
+                np.max(scores[:block_start], initial=-np.inf),
+            )
+            n_chars_saved += n_saved
+        else:
+            plugged = permutations[candidate_idxs, encrypted_ints[np.newaxis, :]]
+            decrypted = permutations[candidate_idxs, core_table[message_idxs, plugged]]
+            block_scores = scorer.score_batch(decrypted)
+        scores[block_start : block_start + len(pairs)] = block_scores
+    return scores, n_chars_saved
+
+
+def _score_plug_candidates_cached(
+    compiled_enigma: enigma.CompiledEnigma,
+    encrypted_message: str,
+    scorer: DenseGroupLikelihoodScorer,
+    rotor_positions: list,
+    candidates: list,
+    score_cache: ScoreCache,
+    bounded: bool = False,
+) -> tuple:
+    """
+    same as _score_plug_candidates, but the candidates whose score is in score_cache are
+    not decrypted. The scores of the other candidates are added to it.
+    """
+    permutation = compiled_enigma.enigma.plug_board.get_permutation()
+    scores = np.empty(len(candidates))
+    candidate_permutations = list()
+    missing_idxs = list()
+    for idx, (first, second) in enumerate(candidates):
+        candidate_permutation = permutation.copy()
+        candidate_permutation[first] = second
+        candidate_permutation[second] = first
+        score = score_cache.get(rotor_positions, candidate_permutation)
+        if score is None:
+            missing_idxs.append(idx)
+            candidate_permutations.append(candidate_permutation)
+        else:
+            scores[idx] = score
+    missing_scores, n_chars_saved = _score_plug_candidates(
+        compiled_enigma,
+        encrypted_message,
+        scorer,
+        rotor_positions,
+        [candidates[idx] for idx in missing_idxs],
+        bounded=bounded,
+    )
+    scores[missing_idxs] = missing_scores
+    for candidate_permutation, score in zip(candidate_permutations, missing_scores):
+        # bounded scoring gives -inf to the candidates it dropped, that is no score
+        if np.isfinite(score):
+            score_cache.put(rotor_positions, candidate_permutation, float(score))
+    return scores, n_chars_saved
+
+
+def _score_plug_candidates_per_start(
+    compiled_enigma: enigma.CompiledEnigma,
+    encrypted_ints: np.ndarray,
+    scorer: DenseGroupLikelihoodScorer,
+    start_positions: list,
+    candidates: list,
+    block_size: int = 64,
+) -> np.ndarray:
+    """
+    same as _score_plug_candidates for several rotor start positions, the plug board is
+    applied to the message once for all of them
+
+    :return: array (len(start_positions) x len(candidates)) of the scores
+    """
+    len_msg = len(encrypted_ints)
+    core_tables = [
+        compiled_enigma.get_core_table(rotor_positions, len_msg)
+        for rotor_positions in start_positions
+    ]
+    permutation = compiled_enigma.enigma.plug_board.get_permutation()
+    message_idxs = np.arange(len_msg)[np.newaxis, :]
+
+    scores = np.empty((len(start_positions), len(candidates)))
+    for block_start in range(0, len(candidates), block_size):
+        pairs = np.array(candidates[block_start : block_start + block_size]).reshape(
+            -1, 2
+        )
+        candidate_idxs = np.arange(len(pairs))[:, np.newaxis]
+        permutations = np.tile(permutation, (len(pairs), 1))
+        permutations[candidate_idxs[:, 0], pairs[:, 0]] = pairs[:, 1]
+        permutations[candidate_idxs[:, 0], pairs[:, 1]] = pairs[:, 0]
+        plugged = permutations[candidate_idxs, encrypted_ints[np.newaxis, :]]
+        for start_idx, core_table in enumerate(core_tables):
+            decrypted = permutations[candidate_idxs, core_table[message_idxs, plugged]]
+            scores[start_idx, block_start : block_start + len(pairs)] = (
+                scorer.score_batch(decrypted)
+            )
+    return scores
+
+
+def _best_plug_in_range(
+    compiled_enigma: enigma.CompiledEnigma,
+    encrypted_message: str,
+    scorer: TextScorerBase,
+    rotor_positions: list,
+    candidates: list,
+    lin_start: int,
+    lin_stop: int,
+    bounded: bool = False,
+    score_cache: ScoreCache = None,
+) -> tuple:
+    """
+    try all plugs candidates[lin_start:lin_stop]
+
+    :param bounded: use bounded scoring for a DenseGroupLikelihoodScorer
+    :param score_cache: if given, only the candidates that are not in it are scored
+    :return: list with the best (score, linear index), empty if there was no candidate,
+    and the number of characters that did not have to be decrypted
+    """
+    if lin_start >= lin_stop:
+        return list(), 0
+
+    if isinstance(scorer, DenseGroupLikelihoodScorer) and score_cache is not None:
+        scores, n_chars_saved = _score_plug_candidates_cached(
+            compiled_enigma,
+            encrypted_message,
+            scorer,
+            rotor_positions,
+            candidates[lin_start:lin_stop],
+            score_cache,
+            bounded=bounded,
+        )
+        best_idx = int(np.argmax(scores))
+        return [(scores[best_idx], lin_start + best_idx)], n_chars_saved
+    if isinstance(scorer, DenseGroupLikelihoodScorer):
+        scores, n_chars_saved = _score_plug_candidates(
+            compiled_enigma,
+            encrypted_message,
+            scorer,
+            rotor_positions,
+            candidates[lin_start:lin_stop],
+            bounded=bounded,
+        )
+        # argmax returns the first of equal scores, like the loop below
+        best_idx = int(np.argmax(scores))
+        return [(scores[best_idx], lin_start + best_idx)], n_chars_saved
+
+    plugboard = compiled_enigma.enigma.plug_board
+    highscore = -np.inf
+    best_result = list()
+    for lin_idx in range(lin_start, lin_stop):
+        first, second = candidates[lin_idx]
+        plugboard.set_element_swap(first, second)
+        score = _cached_decrypt_and_score(
+            compiled_enigma, encrypted_message, scorer, rotor_positions, score_cache
+        )
+        plugboard.unset_element_swap(first, second)
+        if score > highscore:
+            highscore = score
+            best_result = [(score, lin_idx)]
+    return best_result, 0
+
+
+def _best_plug_in_range_in_worker(task: tuple) -> list:
+    swap_dict, rotor_positions, candidates, lin_start, lin_stop = task
+    compiled_enigma = _worker_state["compiled_enigma"]
+    compiled_enigma.enigma.plug_board.swap_dict = swap_dict
+    return _best_plug_in_range(
+        compiled_enigma,
+        _worker_state["encrypted_message"],
+        _worker_state["scorer"],
+        rotor_positions,
+        candidates,
+        lin_start,
+        lin_stop,
+        bounded=_worker_state["bounded"],
+    )
+
+
+def decode_message_successive_best(
+    encrypted_message,
+    rotors: list,
+    n_plugs,
+    reflector: enigma.Swapper,
+    scorer: TextScorerBase,
+    charset=string.ascii_lowercase,
+    disable_tqdm=False,
+    n_workers: int = 1,
+    prefilter_fraction: float = None,
+    bounded: bool = False,
+    stats: dict = None,
+    checkpoint_path: str = None,
+    checkpoint_interval: float = 60.0,
+    metrics: metrics_enigma.Metrics = None,
+    score_cache: ScoreCache = None,
+):
+    """
+    :param n_workers: number of processes for the rotor position sweep and the plug search.
+    The result is the same for any number of workers.
+    :param prefilter_fraction: if given, only this fraction of the rotor positions with the
+    highest index of coincidence (decrypted without plugs) is scored with the scorer
+    :param bounded: stop decrypting candidates that can not beat the best one anymore,
+    the result is the same
+    :param stats: if given, stats["n_chars_total"] and stats["n_chars_saved"] count the
+    decrypted characters of the searches and the ones saved by bounded scoring
+    :param checkpoint_path: if given, the progress of the rotor sweep and the plugs found
+    are written to this json file at most every checkpoint_interval seconds,
+    a run with the same parameters resumes from it and gives the same result
+    :param metrics: if given, events are emitted for each stage of the rotor sweep
+    (sweep_stage) or for the loop over the rotor positions (rotor_loop), for each plug (plug)
+    and at the end (finished)
+    :param score_cache: if given, the scores are looked up in it first, in the plug search
+    and, for scorers that are not dense, in the loop over the rotor positions.
+    Repeated runs on the same message, e.g. with more plugs, then only score new plug
+    settings. Only the search in this process uses it, not the searches of n_workers > 1.
+    The rotor sweep of a dense scorer scores all positions in blocks without it.
+    """
+    n_chars = rotors[0].n_positions
+    scorer = as_dense_scorer(scorer, charset)
+    # test encoder knows the machine
+    decoder_plugboard = enigma.Swapper(n_positions=n_chars)
+    decoder_enigma = enigma.Enigma(
+        copy.deepcopy(rotors),
+        decoder_plugboard,
+        copy.deepcopy(reflector),
+        charset=charset,
+    )
+    # the plug board trials all start from the same rotor positions
+    compiled_enigma = enigma.CompiledEnigma(decoder_enigma)
+
+    checkpointer = _Checkpointer(
+        checkpoint_path,
+        checkpoint_interval,
+        run=dict(
+            kind="decode_message_successive_best",
+            message=_message_digest(encrypted_message),
+            **_machine_run_params(decoder_enigma),
+            scorer=_scorer_digest(scorer),
+            n_plugs=n_plugs,
+            prefilter_fraction=prefilter_fraction,
+        ),
+    )
+
+    # go through all positions and get the score of the output text
+    best_pos = checkpointer.get("best_pos")
+    if best_pos is None and isinstance(scorer, DenseGroupLikelihoodScorer):
+        # all positions at once in blocks
+        [(_, best_pos)] = _sweep_rotor_positions(
+            encrypted_message,
+            decoder_enigma,
+            scorer,
+            2048,
+            1,
+            disable_tqdm,
+            n_workers,
+            prefilter_fraction,
+            bounded,
+            stats,
+            checkpointer,
+            metrics,
+        )
+    elif best_pos is None:
+        positions = MultiindexIiterator(len(rotors), n_chars)
+        if prefilter_fraction is not None:
+            n_prefiltered = math.ceil(prefilter_fraction * n_chars ** len(rotors))
+            prefilter_results = sweep_rotor_positions(
+                encrypted_message,
+                decoder_enigma,
+                IndexOfCoincidenceScorer(charset),
+                top_k=max(n_prefiltered, 1),
+                n_workers=n_workers,
+            )
+            # in the order of MultiindexIiterator, so ties are still won by the first position
+            positions = sorted(pos for _, pos in prefilter_results)
+
+        progress = checkpointer.get(
+            "rotor_loop",
+            dict(
+                n_done=0,
+                highscore=-np.inf,
+                best_pos=[int(pos) for pos in decoder_enigma.get_rotor_positions()],
+            ),
+        )
+        highscore = progress["highscore"]
+        best_pos = progress["best_pos"]
+        counters = collections.Counter()
+        tick = time.perf_counter()
+        for n_done, pos in enumerate(
+            tqdm.tqdm(positions[progress["n_done"] :], disable=disable_tqdm),
+            start=progress["n_done"] + 1,
+        ):
+            counters["n_candidates"] += 1
+            if score_cache is not None:
+                n_misses = score_cache.n_misses
+                score = score_cache.decrypt_and_score(
+                    compiled_enigma, encrypted_message, scorer, pos
+                )
+                counters["n_scorer_calls"] += score_cache.n_misses - n_misses
+            else:
+                decoder_enigma.set_rotor_positions(pos)
+                encode_tick = time.perf_counter()
+                decoder_try = decoder_enigma.encode_message(encrypted_message)
+                score_tick = time.perf_counter()
+                score = scorer.score_text(decoder_try)
+                counters["encode_seconds"] += score_tick - encode_tick
+                counters["score_seconds"] += time.perf_counter() - score_tick
+                counters["n_scorer_calls"] += 1
+            if score > highscore:
+                highscore = score
+                best_pos = pos
+            checkpointer.update(
+                rotor_loop=dict(n_done=n_done, highscore=highscore, best_pos=best_pos)
+            )
+        if metrics is not None:
+            metrics.add(counters)
+            metrics.emit(
+                "rotor_loop",
+                seconds=time.perf_counter() - tick,
+                best_score=float(highscore),
+                best_rotor_positions=best_pos,
+                **counters,
+            )
+    checkpointer.update(force=True, best_pos=best_pos)
+
+    # decode the plugboard
+    # we have 10 plugs to distribute
+    if n_workers > 1 and n_plugs > 0:
+        pool_context = multiprocessing.Pool(
+            n_workers,
+            initializer=_init_search_worker,
+            initargs=(
+                dict(
+                    compiled_enigma=enigma.CompiledEnigma(decoder_enigma),
+                    encrypted_message=encrypted_message,
+                    scorer=scorer,
+                    bounded=bounded,
+                ),
+            ),
+        )
+    else:
+        pool_context = contextlib.nullcontext()
+    with pool_context as pool:
+        available_plug_positions = list(range(n_chars))
+        swaps = checkpointer.get("swaps", list())
+        for first, second in swaps:
+            decoder_plugboard.set_element_swap(first, second)
+            available_plug_positions.remove(first)
+            available_plug_positions.remove(second)
+        for i in tqdm.tqdm(range(len(swaps), n_plugs), disable=disable_tqdm):
+            tick = time.perf_counter()
+            # plugs are symmetric, so only the unordered pairs have to be tried
+            candidates = _plug_candidates(available_plug_positions)
+            if pool is None:
+                shard_results = [
+                    _best_plug_in_range(
+                        compiled_enigma,
+                        encrypted_message,
+                        scorer,
+                        best_pos,
+                        candidates,
+                        0,
+                        len(candidates),
+                        bounded=bounded,
+                        score_cache=score_cache,
+                    )
+                ]
+            else:
+                tasks = [
+                    (
+                        decoder_plugboard.swap_dict,
+                        best_pos,
+                        candidates,
+                        lin_start,
+                        lin_stop,
+                    )
+                    for lin_start, lin_stop in _split_range(
+                        len(candidates), 4 * n_workers
+                    )
+                ]
+                shard_results = pool.map(_best_plug_in_range_in_worker, tasks)
+
+            shard_results, n_chars_saved = zip(*shard_results)
+            if stats is not None:
+                _add_search_stats(
+                    stats, len(candidates) * len(encrypted_message), sum(n_chars_saved)
+                )
+
+            best_swap = (0, 1)
+            best_score = -np.inf
+            best_results = _reduce_shard_results(shard_results, 1)
+            if best_results:
+                [(best_score, lin_idx)] = best_results
+                best_swap = candidates[lin_idx]
+
+            # use the best swap for further decrypting
+            decoder_plugboard.set_element_swap(best_swap[0], best_swap[1])
+            available_plug_positions.remove(best_swap[0])
+            available_plug_positions.remove(best_swap[1])
+            swaps.append(best_swap)
+            checkpointer.update(swaps=swaps)
+            if metrics is not None:
+                seconds = time.perf_counter() - tick
+                metrics.add({"n_candidates": len(candidates), "plug_seconds": seconds})
+                metrics.emit(
+                    "plug",
+                    plug=i,
+                    swap=list(best_swap),
+                    best_score=float(best_score),
+                    n_candidates=len(candidates),
+                    seconds=seconds,
+                    candidates_per_second=len(candidates) / seconds,
+                )
+    checkpointer.update(force=True)
+
+    decoder_enigma.set_rotor_positions(best_pos)
+    decoded_msg = decoder_enigma.encode_message(encrypted_message)
+    if metrics is not None:
+        if score_cache is not None:
+            metrics.emit("score_cache", **score_cache.get_stats())
+        metrics.emit(
+            "finished",
+            function="decode_message_successive_best",
+            **metrics.summary(),
+        )
+
+    return decoded_msg, best_pos, decoder_plugboard
+
+
+def _sweep_message(
+    decoder_enigma: enigma.Enigma,
+    encrypted_message: str,
+    scorer: DenseGroupLikelihoodScorer,
+    top_k: int,
+    bounded: bool = False,
+    odometer_table: np.ndarray = None,
+) -> tuple:
+    """
+    sweep all rotor start positions of one message with the plug board of decoder_enigma
+
+    :return: list of the top_k (score, linear index), best first, and the counters of the sweep
+    """
+    counters = collections.Counter()
+    results, _ = _sweep_rotor_range(
+        decoder_enigma,
+        decoder_enigma.chars_to_ints(encrypted_message),
+        scorer,
+        0,
+        len(decoder_enigma.charset) ** len(decoder_enigma.rotors),
+        2048,
+        top_k,
+        bounded=bounded,
+        counters=counters,
+        odometer_table=odometer_table,
+    )
+    return results, counters
+
+
+def _sweep_message_in_worker(task: tuple) -> tuple:
+    swap_dict, encrypted_message, top_k = task
+    decoder_enigma = _worker_state["decoder_enigma"]
+    decoder_enigma.plug_board.swap_dict = swap_dict
+    return _sweep_message(
+        decoder_enigma,
+        encrypted_message,
+        _worker_state["scorer"],
+        top_k,
+        bounded=_worker_state["bounded"],
+        odometer_table=_worker_state["odometer_table"],
+    )
+
+
+def _start_confidence(results: list) -> float:
+    """
+    :param results: (score, linear index) of the start candidates of a message, best first
+    :return: how much the best candidate scores higher than the second best
+    """
+    if len(results) < 2:
+        return np.inf
+    return float(results[0][0] - results[1][0])
+
+
+def decode_messages_shared_plugboard(
+    encrypted_messages: list,
+    rotors: list,
+    n_plugs: int,
+    reflector: enigma.Swapper,
+    scorer: TextScorerBase,
+    charset=string.ascii_lowercase,
+    n_rotor_candidates: int = 20,
+    max_plug_fit_chars: int = 2000,
+    max_n_rounds: int = 3,
+    min_confidence: float = 1.0,
+    disable_tqdm=True,
+    n_workers: int = 1,
+    bounded: bool = False,
+    metrics: metrics_enigma.Metrics = None,
+):
+    """
+    Crack messages that were encrypted with the same rotors, reflector and plug board but
+    different rotor start positions. One plug board is fitted plug by plug to the summed
+    loglikelihoods of the messages. Without plugs, the best start position of a short
+    message is often wrong, so a message scores a plug with the best of its start
+    candidates from a sweep: the n_rotor_candidates best starts for the first plug and
+    the 3 best starts with the plugs so far for the others. The plug that is best summed
+    over the messages and the one whose summed gain over the starts is best are tried
+    with a sweep of all start positions of the messages, the better one is kept.
+    The plug board is fitted to at most max_plug_fit_chars characters, the other messages
+    only need a sweep with the fitted plug board. If a message is not confident about its
+    start after a round, the plug board is fitted again to the messages that are most
+    confident now, the plug board with the highest summed loglikelihood of all messages
+    is kept.
+
+    :param scorer: GroupLikelihoodScorer or DenseGroupLikelihoodScorer
+    :param n_rotor_candidates: number of start positions per message that the first plug
+    is scored with
+    :param max_plug_fit_chars: the plug board is fitted to the messages with the most confident
+    start positions, until their lengths add up to this. All messages are used if None.
+    :param max_n_rounds: maximum number of plug board fits
+    :param min_confidence: another round is only run if a message has a lower confidence
+    :param n_workers: number of processes for the sweeps, the messages are distributed over them.
+    The result is the same for any number of workers.
+    :param bounded: use bounded scoring in the sweeps, the result is the same
+    :param metrics: if given, events are emitted for the sweeps (message_sweeps),
+    for each plug (plug) and at the end (finished)
+    :return: list of the decrypted messages, list of their rotor start positions, the plug board
+    and list of the confidences of the start positions: the score of the decryption minus
+    the score with the second best start position. Wrong start positions are only ahead by
+    a small fraction of the score per group, see GroupLikelihoodScorer.
+    """
+    if not encrypted_messages:
+        raise ValueError("there are no messages to crack")
+    if max_n_rounds < 1:
+        raise ValueError(f"max_n_rounds must be at least 1, got {max_n_rounds}")
+    scorer = _as_batch_scorer(scorer, charset)
+    if not isinstance(scorer, DenseGroupLikelihoodScorer):
+        raise TypeError("the messages can only be pooled with group likelihood scorers")
+    n_chars = rotors[0].n_positions
+    n_rotors = len(rotors)
+    decoder_plugboard = enigma.Swapper(n_positions=n_chars)
+    decoder_enigma = enigma.Enigma(
+        copy.deepcopy(rotors),
+        decoder_plugboard,
+        copy.deepcopy(reflector),
+        charset=charset,
+    )
+    # the plug candidates of all messages are scored from their start positions
+    compiled_enigma = enigma.CompiledEnigma(
+        decoder_enigma, max_cache_size=len(encrypted_messages) * n_rotor_candidates
+    )
+    # shared by the sweeps of all messages
+    odometer_table = None
+    if n_chars ** (n_rotors + 1) <= _MAX_ODOMETER_TABLE_SIZE:
+        odometer_table = decoder_enigma.get_odometer_core_table()
+    encrypted_ints = [decoder_enigma.chars_to_ints(msg) for msg in encrypted_messages]
+    n_groups = np.array(
+        [len(msg) - scorer.n_chars_group + 1 for msg in encrypted_messages]
+    )
+
+    if n_workers > 1:
+        pool_context = multiprocessing.Pool(
+            n_workers,
+            initializer=_init_search_worker,
+            initargs=(
+                dict(
+                    decoder_enigma=decoder_enigma,
+                    scorer=scorer,
+                    bounded=bounded,
+                    odometer_table=odometer_table,
+                ),
+            ),
+        )
+    else:
+        pool_context = contextlib.nullcontext()
+
+    def sweep(msg_idxs, swap_dict, top_k, **event):
+        """
+        :return: list of the top_k (score, linear index) of each message, best first
+        """
+        tick = time.perf_counter()
+        tasks = [(swap_dict, encrypted_messages[idx], top_k) for idx in msg_idxs]
+        if pool is None:
+            decoder_plugboard.swap_dict = swap_dict
+            sweep_results = [
+                _sweep_message(
+                    decoder_enigma,
+                    msg,
+                    scorer,
+                    top_k,
+                    bounded=bounded,
+                    odometer_table=odometer_table,
+                )
+                for _, msg, top_k in tasks
+            ]
+        else:
+            sweep_results = pool.map(_sweep_message_in_worker, tasks)
+        if metrics is not None:
+            counters = sum(
+                (counters for _, counters in sweep_results), collections.Counter()
+            )
+            metrics.add(counters)
+            metrics.emit(
+                "message_sweeps",
+                n_messages=len(msg_idxs),
+                seconds=time.perf_counter() - tick,
+                **event,
+                **counters,
+            )
+        return [results for results, _ in sweep_results]
+
+    def summed_loglikelihood(msg_idxs, results) -> float:
+        return float(
+            sum(
+                n_groups[idx] * msg_results[0][0]
+                for idx, msg_results in zip(msg_idxs, results)
+            )
+        )
+
+    # with the first plugs, the right starts of the messages are among their best few
+    n_later_rotor_candidates = 3
+    all_idxs = list(range(len(encrypted_messages)))
+    with pool_context as pool:
+        plugless_results = sweep(all_idxs, dict(), n_rotor_candidates, round=0)
+        confidences = [_start_confidence(results) for results in plugless_results]
+        best_round = None
+        fit_idxs = None
+        for round_idx in range(max_n_rounds):
+            # the messages with the most confident start positions, stable for equal ones
+            previous_fit_idxs = fit_idxs
+            fit_idxs = list()
+            n_fit_chars = 0
+            for msg_idx in np.argsort(-np.array(confidences), kind="stable"):
+                if max_plug_fit_chars is not None and n_fit_chars >= max_plug_fit_chars:
+                    break
+                fit_idxs.append(int(msg_idx))
+                n_fit_chars += len(encrypted_messages[msg_idx])
+            # the same messages give the same plug board
+            if fit_idxs == previous_fit_idxs:
+                break
+
+            swap_dict = dict()
+            available_plug_positions = list(range(n_chars))
+            fit_results = [plugless_results[idx] for idx in fit_idxs]
+            for i in tqdm.tqdm(range(n_plugs), disable=disable_tqdm):
+                tick = time.perf_counter()
+                plug_candidates = _plug_candidates(available_plug_positions)
+                n_starts = n_rotor_candidates if i == 0 else n_later_rotor_candidates
+                pooled_loglikelihoods = np.zeros(len(plug_candidates))
+                pooled_gains = np.zeros(len(plug_candidates))
+                decoder_plugboard.swap_dict = swap_dict
+                n_starts_scored = 0
+                for msg_idx, msg_results in zip(fit_idxs, fit_results):
+                    n_starts_scored += len(msg_results[:n_starts])
+                    start_scores = n_groups[msg_idx] * np.array(
+                        [score for score, _ in msg_results[:n_starts]]
+                    )
+                    scores = n_groups[msg_idx] * _score_plug_candidates_per_start(
+                        compiled_enigma,
+                        encrypted_ints[msg_idx],
+                        scorer,
+                        _lin_idxs_to_positions(
+                            np.array(
+                                [lin_idx for _, lin_idx in msg_results[:n_starts]]
+                            ),
+                            n_rotors,
+                            n_chars,
+                        ).tolist(),
+                        plug_candidates,
+                    )
+                    pooled_loglikelihoods += np.max(scores, axis=0)
+                    # the wrong starts of a message gain little from a right plug
+                    pooled_gains += np.max(scores - start_scores[:, np.newaxis], axis=0)
+
+                # the best plugs by both measures are tried with a sweep of all starts,
+                # more of them for the first plug, which decides the rest
+                n_tries = 3 if i == 0 else 1
+                shortlist = list()
+                for pooled in [pooled_loglikelihoods, pooled_gains]:
+                    # stable, so the first of equal scores is tried first
+                    for idx in np.argsort(-pooled, kind="stable")[:n_tries].tolist():
+                        if plug_candidates[idx] not in shortlist:
+                            shortlist.append(plug_candidates[idx])
+                tried = list()
+                for swap in shortlist:
+                    tried_swap_dict = dict(swap_dict)
+                    tried_swap_dict.update({swap[0]: swap[1], swap[1]: swap[0]})
+                    results = sweep(
+                        fit_idxs,
+                        tried_swap_dict,
+                        n_later_rotor_candidates,
+                        round=round_idx,
+                        plug=i,
+                    )
+                    tried.append(
+                        (swap, summed_loglikelihood(fit_idxs, results), results)
+                    )
+                # max returns the first of equal totals
+                best_swap, pooled_loglikelihood, fit_results = max(
+                    tried, key=lambda attempt: attempt[1]
+                )
+                swap_dict.update(
+                    {best_swap[0]: best_swap[1], best_swap[1]: best_swap[0]}
+                )
+                available_plug_positions.remove(best_swap[0])
+                available_plug_positions.remove(best_swap[1])
+
+                if metrics is not None:
+                    seconds = time.perf_counter() - tick
+                    n_candidates = len(plug_candidates) * n_starts_scored
+                    metrics.add({"n_candidates": n_candidates, "plug_seconds": seconds})
+                    metrics.emit(
+                        "plug",
+                        round=round_idx,
+                        plug=i,
+                        swap=list(best_swap),
+                        pooled_loglikelihood=pooled_loglikelihood,
+                        n_messages=len(fit_idxs),
+                        n_candidates=n_candidates,
+                        seconds=seconds,
+                    )
+
+            # all messages with the fitted plug board
+            results = sweep(all_idxs, swap_dict, 2, round=round_idx)
+            total = summed_loglikelihood(all_idxs, results)
+            if best_round is None or total > best_round[0]:
+                best_round = (total, swap_dict, results)
+            confidences = [_start_confidence(msg_results) for msg_results in results]
+            if min(confidences) >= min_confidence:
+                break
+
+    _, swap_dict, results = best_round
+    decoder_plugboard.swap_dict = swap_dict
+    confidences = [_start_confidence(msg_results) for msg_results in results]
+    decoded_messages = list()
+    rotor_positions = _lin_idxs_to_positions(
+        np.array([msg_results[0][1] for msg_results in results]), n_rotors, n_chars
+    ).tolist()
+    for msg, positions in zip(encrypted_messages, rotor_positions):
+        decoder_enigma.set_rotor_positions(positions)
+        decoded_messages.append(decoder_enigma.encode_message(msg))
+    if metrics is not None:
+        metrics.emit(
+            "finished",
+            function="decode_messages_shared_plugboard",
+            confidences=confidences,
+            **metrics.summary(),
+        )
+
+    return decoded_messages, rotor_positions, decoder_plugboard, confidences
+
+
+def _selection_enigma(state: dict, selection: tuple) -> enigma.Enigma:
+    n_chars = len(state["charset"])
+    return enigma.Enigma(
+        [state["rotor_bank"][idx] for idx in selection],
+        enigma.Swapper(n_positions=n_chars),
+        state["reflector"],
+        charset=state["charset"],
+    )
 
-        self.len = self.n_val_per_dim ** self.n_dims
 
-    def __len__(self):
-        return self.len
+def _sweep_selection(state: dict, selection: tuple, threshold: float) -> tuple:
+    """
+    sweep the rotor start positions of one selection without plugs
 
-    def __iter__(self):
-        self.lin_idx = 0
-        return self
+    :param state: the search, see search_rotor_selections
+    :param threshold: with bounded scoring, positions that can not beat it are dropped
+    :return: the best score, -inf if all positions were dropped, the rotor start positions
+    and the counters of the sweep
+    """
+    decoder_enigma = _selection_enigma(state, selection)
+    n_chars = len(state["charset"])
+    odometer_table = None
+    if n_chars ** (len(selection) + 1) <= _MAX_ODOMETER_TABLE_SIZE:
+        odometer_table = decoder_enigma.get_odometer_core_table()
+    counters = collections.Counter()
+    [(score, lin_idx)], _ = _sweep_rotor_range(
+        decoder_enigma,
+        state["encrypted_ints"],
+        state["scorer"],
+        0,
+        n_chars ** len(selection),
+        2048,
+        1,
+        bounded=state["bounded"],
+        counters=counters,
+        odometer_table=odometer_table,
+        threshold=threshold,
+    )
+    [positions] = _lin_idxs_to_positions(
+        np.array([lin_idx]), len(selection), n_chars
+    ).tolist()
+    return float(score), positions, counters
 
-    def __next__(self):
-        if self.lin_idx < self.len:
-            baseconverted = conv_number_to_base(self.lin_idx, self.n_val_per_dim)
-            n_pad_zeros = self.n_dims - len(baseconverted)
-            self.lin_idx += 1
-            return n_pad_zeros * [0] + baseconverted
-        else:
-            raise StopIteration
 
+def _sweep_selection_in_worker(task: tuple) -> tuple:
+    selection, threshold = task
+    return _sweep_selection(_worker_state, selection, threshold)
 
-class TextScorerBase:
-    def score_text(self, text: str) -> float:
-        raise NotImplementedError
 
+def _fit_selection_plugs(
+    state: dict, selection: tuple, rotor_positions: list, n_plugs: int
+) -> tuple:
+    """
+    successive best plugs for one selection at its rotor start positions
 
-class GroupLikelihoodScorer(TextScorerBase):
-    def __init__(self, loglikelihooddict: dict, not_known_penalty_factor=2):
-        """
-        :param loglikelihooddict:
-        :param not_known_penalty_factor: If a group is encountered that is not in the loglikelihooddict,
-        choose a penalty based on the least liely group and the additional penalty factor
-        """
-        least_likely = min(loglikelihooddict, key=lambda k: loglikelihooddict[k])
-        self.lld = collections.defaultdict(
-            lambda: loglikelihooddict[least_likely] * not_known_penalty_factor,
-            loglikelihooddict,
+    :return: the swap dict of the plugs and the score of the decryption with them
+    """
+    decoder_enigma = _selection_enigma(state, selection)
+    compiled_enigma = enigma.CompiledEnigma(decoder_enigma)
+    available_plug_positions = list(range(len(state["charset"])))
+    score = _decrypt_and_score(
+        compiled_enigma, state["encrypted_message"], state["scorer"], rotor_positions
+    )
+    for _ in range(n_plugs):
+        candidates = _plug_candidates(available_plug_positions)
+        [(score, lin_idx)], _ = _best_plug_in_range(
+            compiled_enigma,
+            state["encrypted_message"],
+            state["scorer"],
+            rotor_positions,
+            candidates,
+            0,
+            len(candidates),
+            bounded=state["bounded"],
         )
-        self.n_chars_group = len(least_likely)
+        first, second = candidates[lin_idx]
+        decoder_enigma.plug_board.set_element_swap(first, second)
+        available_plug_positions.remove(first)
+        available_plug_positions.remove(second)
+    return decoder_enigma.plug_board.swap_dict, float(score)
 
-    def score_text(self, text: str) -> float:
-        score = 0.0
-        n_groups = len(text) - self.n_chars_group + 1
-        for i in range(n_groups):
-            group = text[i : i + self.n_chars_group]
-            score += self.lld[group]
-        score /= n_groups
-        return score
 
+def _fit_selection_plugs_in_worker(task: tuple) -> tuple:
+    selection, rotor_positions, n_plugs = task
+    return _fit_selection_plugs(_worker_state, selection, rotor_positions, n_plugs)
 
-def decode_message_successive_best(
+
+def search_rotor_selections(
     encrypted_message,
-    rotors: list,
-    n_plugs,
+    rotor_bank: list,
+    n_rotors: int,
+    n_plugs: int,
     reflector: enigma.Swapper,
     scorer: TextScorerBase,
     charset=string.ascii_lowercase,
-    disable_tqdm=False,
-):
-    n_chars = rotors[0].n_positions
-    # test encoder knows the machine
-    decoder_plugboard = enigma.Swapper(n_positions=n_chars)
-    decoder_enigma = enigma.Enigma(
-        copy.deepcopy(rotors),
-        decoder_plugboard,
-        copy.deepcopy(reflector),
+    top_k: int = 5,
+    disable_tqdm=True,
+    n_workers: int = 1,
+    bounded: bool = False,
+    metrics: metrics_enigma.Metrics = None,
+) -> list:
+    """
+    Search the rotors and their order, if the machine uses n_rotors rotors out of rotor_bank.
+    The rotor start positions of every ordered selection of rotors are swept without plugs,
+    the top_k selections with the best sweep scores get the plugs of the successive best search.
+    The rotors of the bank share their wiring tables with all selections, see get_rotor_wiring.
+
+    :param scorer: GroupLikelihoodScorer or scorer with a score_batch method
+    :param n_workers: number of processes, the selections are distributed over them.
+    The result is the same for any number of workers.
+    :param bounded: stop decrypting positions that can not beat the top_k best selections
+    swept so far, these selections are pruned. The result is the same.
+    :param metrics: if given, events are emitted for each batch of swept selections
+    (selection_sweeps), for the plugs of each of the top_k selections (selection_plugs)
+    and at the end (finished)
+    :return: list of the top_k (selection, rotor start positions, plug board, score),
+    best first. A selection is the tuple of the indices of its rotors in rotor_bank,
+    in the order of the rotors of an Enigma.
+    """
+    if n_rotors > len(rotor_bank):
+        raise ValueError(
+            f"can not select {n_rotors} rotors from a bank of {len(rotor_bank)} rotors"
+        )
+    n_chars = len(charset)
+    rotor_bank = copy.deepcopy(rotor_bank)
+    reflector = copy.deepcopy(reflector)
+    scorer = _as_batch_scorer(scorer, charset)
+    state = dict(
+        rotor_bank=rotor_bank,
+        reflector=reflector,
         charset=charset,
+        encrypted_message=encrypted_message,
+        scorer=scorer,
+        bounded=bounded,
+    )
+    selections = list(itertools.permutations(range(len(rotor_bank)), n_rotors))
+    state["encrypted_ints"] = _selection_enigma(state, selections[0]).chars_to_ints(
+        encrypted_message
     )
 
-    # go through all positions and get the score of the output text
-    highscore = -np.inf
-    best_pos = decoder_enigma.get_rotor_positions()
-
-    # TODO Parallel?
-    positions = iter(MultiindexIiterator(len(rotors), n_chars))
-    for pos in tqdm.tqdm(positions, disable=disable_tqdm):
-        decoder_enigma.set_rotor_positions(pos)
-        decoder_try = decoder_enigma.encode_message(encrypted_message)
-        score = scorer.score_text(decoder_try)
-        if score > highscore:
-            highscore = score
-            best_pos = pos
-
-    # decode the plugboard
-    # we have 10 plugs to distribute
-    available_plug_positions = list(range(n_chars))
-    for i in tqdm.tqdm(range(n_plugs), disable=disable_tqdm):
-        highscore = -np.inf
-        best_swap = (0, 1)
-        # go through all positions for the plug and get their score
-        # TODO loop parallel?
-        for first in available_plug_positions:
-            for second in available_plug_positions:
-                # we have to set a plug, self-connections are not allowed
-                if first == second:
-                    continue
-                decoder_plugboard.set_element_swap(first, second)
-                decoder_enigma.set_rotor_positions(best_pos)
-                decoder_try = decoder_enigma.encode_message(encrypted_message)
-                score = scorer.score_text(decoder_try)
-                if score > highscore:
-                    highscore = score
-                    best_swap = (first, second)
-                decoder_plugboard.unset_element_swap(first, second)
-
-        # use the best swap for further decrypting
-        decoder_plugboard.set_element_swap(best_swap[0], best_swap[1])
-        available_plug_positions.remove(best_swap[0])
-        available_plug_positions.remove(best_swap[1])
+    if n_workers > 1:
+        pool_context = multiprocessing.Pool(
+            n_workers, initializer=_init_search_worker, initargs=(state,)
+        )
+    else:
+        pool_context = contextlib.nullcontext()
+    with pool_context as pool, tqdm.tqdm(
+        total=len(selections), disable=disable_tqdm
+    ) as progress_bar:
+        # the threshold is updated after each batch, without pool after each selection
+        batch_size = 1 if pool is None else 4 * n_workers
+        sweep_results = list()
+        for batch_start in range(0, len(selections), batch_size):
+            tick = time.perf_counter()
+            scores = sorted((score for score, _, _ in sweep_results), reverse=True)
+            threshold = scores[top_k - 1] if len(scores) >= top_k else -np.inf
+            tasks = [
+                (selection, threshold)
+                for selection in selections[batch_start : batch_start + batch_size]
+            ]
+            if pool is None:
+                batch_results = [
+                    _sweep_selection(state, selection, threshold)
+                    for selection, threshold in tasks
+                ]
+            else:
+                batch_results = pool.map(_sweep_selection_in_worker, tasks)
+            sweep_results.extend(
+                (score, batch_start + i, positions)
+                for i, (score, positions, _) in enumerate(batch_results)
+            )
+            progress_bar.update(len(tasks))
+            if metrics is not None:
+                counters = sum(
+                    (counters for _, _, counters in batch_results),
+                    collections.Counter(),
+                )
+                metrics.add(counters)
+                metrics.emit(
+                    "selection_sweeps",
+                    n_selections=len(tasks),
+                    n_pruned=sum(score == -np.inf for score, _, _ in batch_results),
+                    seconds=time.perf_counter() - tick,
+                    **counters,
+                )
 
-    decoder_enigma.set_rotor_positions(best_pos)
-    decoded_msg = decoder_enigma.encode_message(encrypted_message)
+        # stable, so ties are won by the selection that comes first
+        best_sweeps = sorted(sweep_results, key=lambda result: -result[0])[:top_k]
+        tasks = [
+            (selections[selection_idx], positions, n_plugs)
+            for _, selection_idx, positions in best_sweeps
+        ]
+        tick = time.perf_counter()
+        if pool is None:
+            plug_results = [_fit_selection_plugs(state, *task) for task in tasks]
+        else:
+            plug_results = pool.map(_fit_selection_plugs_in_worker, tasks)
 
-    return decoded_msg, best_pos, decoder_plugboard
+    results = list()
+    for (selection, positions, _), (swap_dict, score) in zip(tasks, plug_results):
+        plugboard = enigma.Swapper(n_positions=n_chars)
+        plugboard.swap_dict = swap_dict
+        results.append((selection, positions, plugboard, score))
+        if metrics is not None:
+            metrics.emit(
+                "selection_plugs",
+                selection=list(selection),
+                rotor_positions=positions,
+                swap_dict=sorted(swap_dict.items()),
+                score=score,
+            )
+    results.sort(key=lambda result: -result[3])
+    if metrics is not None:
+        metrics.add({"plug_seconds": time.perf_counter() - tick})
+        metrics.emit(
+            "finished",
+            function="search_rotor_selections",
+            **metrics.summary(),
+        )
+    return results
 
 
 def _propose_rot_move(
@@ -165,32 +2278,521 @@ def _propose_rot_move(
 
 
 def _propose_plug_move(plugboard: enigma.Swapper, rng: np.random.default_rng):
-    plug_ends = list(plugboard.get_swapped_positions())
-    free_positions = list(plugboard.get_free_positions())
     # choose random plug end to connect to a random free location
-    return rng.choice(plug_ends), rng.choice(free_positions)
+    return plugboard.choose_swapped_position(rng), plugboard.choose_free_position(rng)
 
 
 def _assess_move(
-    decoder_enigma: enigma.Enigma,
+    compiled_enigma: enigma.CompiledEnigma,
     encrypted_message: str,
     scorer: TextScorerBase,
     old_score: float,
     score_scale: float,
     rng: np.random.default_rng,
+    score_cache: ScoreCache = None,
 ):
     # get the new score
-    rotor_pos = decoder_enigma.get_rotor_positions()
-    decoder_try = decoder_enigma.encode_message(encrypted_message)
-    decoder_enigma.set_rotor_positions(rotor_pos)
-    new_score = scorer.score_text(decoder_try)
+    rotor_pos = compiled_enigma.enigma.get_rotor_positions()
+    new_score = _cached_decrypt_and_score(
+        compiled_enigma, encrypted_message, scorer, rotor_pos, score_cache
+    )
+
+    return _accept_move(old_score, new_score, score_scale, rng), new_score
 
+
+def _accept_move(
+    old_score: float, new_score: float, score_scale: float, rng: np.random.Generator
+) -> bool:
     # mc decision making
     if new_score > old_score:
-        return True, new_score
+        return True
     else:
         thresh = math.exp((new_score - old_score) / score_scale)
-        return rng.random() < thresh, new_score
+        return rng.random() < thresh
+
+
+def _propose_moves(
+    rotor_positions: np.ndarray,
+    permutation: np.ndarray,
+    n_moves: int,
+    rng: np.random.Generator,
+):
+    """
+    vectorized version of _propose_rot_move and _propose_plug_move: each move is
+    a rotor move or, if there are plugs, with probability 1/2 a plug move.
+    Both kinds of moves are symmetric, so is their mixture.
+
+    :param rotor_positions: array (n_rotors) with the current rotor positions
+    :param permutation: array (n_positions) with the current plug board permutation
+    :return: arrays (n_moves x n_rotors) with the proposed rotor positions and
+    (n_moves x n_positions) with the proposed plug board permutations
+    """
+    n_chars = len(permutation)
+    rows = np.arange(n_moves)
+    prop_rotor_positions = np.tile(rotor_positions, (n_moves, 1))
+    prop_permutations = np.tile(permutation, (n_moves, 1))
+
+    swapped = np.flatnonzero(permutation != np.arange(n_chars))
+    free = np.flatnonzero(permutation == np.arange(n_chars))
+    if len(swapped) and len(free):
+        is_plug_move = rng.random(n_moves) < 0.5
+    else:
+        is_plug_move = np.zeros(n_moves, dtype=bool)
+
+    rot_rows = rows[~is_plug_move]
+    rot_idxs = rng.integers(len(rotor_positions), size=len(rot_rows))
+    directions = rng.choice([-1, 1], size=len(rot_rows))
+    prop_rotor_positions[rot_rows, rot_idxs] = (
+        prop_rotor_positions[rot_rows, rot_idxs] + directions
+    ) % n_chars
+
+    plug_rows = rows[is_plug_move]
+    if len(plug_rows):
+        # move one end of a plug to a free position
+        move_from = swapped[rng.integers(len(swapped), size=len(plug_rows))]
+        move_to = free[rng.integers(len(free), size=len(plug_rows))]
+        partners = permutation[move_from]
+        prop_permutations[plug_rows, move_from] = move_from
+        prop_permutations[plug_rows, partners] = move_to
+        prop_permutations[plug_rows, move_to] = partners
+
+    return prop_rotor_positions, prop_permutations
+
+
+def _score_configurations(
+    decoder_enigma: enigma.Enigma,
+    encrypted_ints: np.ndarray,
+    scorer: TextScorerBase,
+    rotor_positions: np.ndarray,
+    permutations: np.ndarray,
+) -> np.ndarray:
+    """
+    decrypt and score the message for a batch of machine settings in one go
+
+    :param rotor_positions: array (n_configurations x n_rotors)
+    :param permutations: array (n_configurations x n_positions) of plug board permutations
+    :return: array with the scores
+    """
+    rows = np.arange(len(permutations))[:, np.newaxis]
+    position_sequence = decoder_enigma._rotor_position_sequence(
+        rotor_positions, len(encrypted_ints)
+    )
+    numbers = permutations[rows, encrypted_ints[np.newaxis, :]]
+    numbers = decoder_enigma._apply_core(numbers, position_sequence)
+    decrypted = permutations[rows, numbers]
+    if isinstance(scorer, DenseGroupLikelihoodScorer):
+        return scorer.score_batch(decrypted)
+    return np.array(
+        [scorer.score_text(decoder_enigma.ints_to_chars(text)) for text in decrypted]
+    )
+
+
+def _logsumexp(values: np.ndarray) -> float:
+    max_value = np.max(values)
+    return max_value + math.log(np.sum(np.exp(values - max_value)))
+
+
+class _MCChain:
+    """
+    one markov chain over rotor positions and plugs, score_scale acts as its temperature.
+    Every step proposes one rotor move and, if there are plugs, one plug move.
+    Plug moves use plug_score_scale, which is score_scale unless a temperature schedule
+    sets it apart. With a score_cache, the full decryptions of the moves are looked up in it first.
+    """
+
+    def __init__(
+        self,
+        compiled_enigma: enigma.CompiledEnigma,
+        encrypted_message: str,
+        scorer: TextScorerBase,
+        score_scale: float,
+        rng: np.random.Generator,
+        score_cache: ScoreCache = None,
+        plug_score_scale: float = None,
+    ):
+        self.compiled_enigma = compiled_enigma
+        self.decoder_enigma = compiled_enigma.enigma
+        self.plugboard = compiled_enigma.enigma.plug_board
+        self.encrypted_message = encrypted_message
+        self.encrypted_ints = self.decoder_enigma.chars_to_ints(encrypted_message)
+        self.scorer = scorer
+        self.score_scale = score_scale
+        self.plug_score_scale = (
+            score_scale if plug_score_scale is None else plug_score_scale
+        )
+        self.rng = rng
+        self.score_cache = score_cache
+        self.n_steps = 0
+        self.n_accepted_rot = 0
+        self.n_accepted_plug = 0
+        # number of scored configurations and of the calls to score them
+        self.n_candidates = 0
+        self.n_scorer_calls = 0
+        self._start_from_machine()
+
+    def _start_from_machine(self):
+        # the chain continues from the current settings of the machine
+        self.rotor_positions = self.decoder_enigma.get_rotor_positions()
+        self.has_plugs = bool(self.plugboard.get_swapped_positions())
+        self.score = _cached_decrypt_and_score(
+            self.compiled_enigma,
+            self.encrypted_message,
+            self.scorer,
+            self.rotor_positions,
+            self.score_cache,
+        )
+        self.plug_state = self._make_plug_state()
+        self.best_score = self.score
+        self.best_rotor_positions = self.rotor_positions
+        self.best_swap_dict = self.plugboard.swap_dict
+
+    def _make_plug_state(self):
+        # plug moves only rescore the positions that the move changes
+        if self.has_plugs and isinstance(self.scorer, DenseGroupLikelihoodScorer):
+            return PlugboardCrackingState(
+                self.compiled_enigma,
+                self.encrypted_message,
+                self.scorer,
+                self.rotor_positions,
+            )
+        return None
+
+    def _assess_move(self, score_scale: float) -> tuple:
+        # cache hits do not call the scorer
+        n_misses = None if self.score_cache is None else self.score_cache.n_misses
+        accept, new_score = _assess_move(
+            self.compiled_enigma,
+            self.encrypted_message,
+            self.scorer,
+            self.score,
+            score_scale,
+            self.rng,
+            score_cache=self.score_cache,
+        )
+        if n_misses is None:
+            self.n_scorer_calls += 1
+        else:
+            self.n_scorer_calls += self.score_cache.n_misses - n_misses
+        return accept, new_score
+
+    def step(self):
+        n_chars = self.plugboard.n_positions
+        self.n_steps += 1
+
+        # rotor move
+        self.n_candidates += 1
+        prop_rot_pos = _propose_rot_move(self.rotor_positions, n_chars, self.rng)
+        self.decoder_enigma.set_rotor_positions(prop_rot_pos)
+        accept, new_score = self._assess_move(self.score_scale)
+        if accept:
+            self.n_accepted_rot += 1
+            self.score = new_score
+            self.rotor_positions = prop_rot_pos
+            self.plug_state = self._make_plug_state()
+        else:
+            self.decoder_enigma.set_rotor_positions(self.rotor_positions)
+
+        if self.has_plugs:
+            self.n_candidates += 1
+            if self.plug_state is None:
+                self.plug_state = self._make_plug_state()
+            # plugboard move
+            prop_plug_move = _propose_plug_move(self.plugboard, self.rng)
+            if self.plug_state is not None:
+                self.n_scorer_calls += 1
+                new_score = self.plug_state.move_one_swap_side(
+                    prop_plug_move[0], prop_plug_move[1]
+                )
+                accept = _accept_move(
+                    self.score, new_score, self.plug_score_scale, self.rng
+                )
+            else:
+                self.plugboard.move_one_swap_side(prop_plug_move[0], prop_plug_move[1])
+                accept, new_score = self._assess_move(self.plug_score_scale)
+            if accept:
+                self.score = new_score
+                self.n_accepted_plug += 1
+            elif self.plug_state is not None:
+                self.plug_state.undo()
+            else:
+                # undo the move
+                self.plugboard.move_one_swap_side(prop_plug_move[1], prop_plug_move[0])
+
+        if self.score > self.best_score:
+            self.best_score = self.score
+            self.best_rotor_positions = self.rotor_positions
+            self.best_swap_dict = self.plugboard.swap_dict
+
+    def multiple_try_step(self, n_tries: int):
+        """
+        multiple-try Metropolis step: n_tries proposals are scored together, one of them
+        is picked with probability proportional to exp(score / score_scale) and accepted
+        against n_tries - 1 reference moves from the picked one and the current state.
+        This keeps detailed balance because the proposals are symmetric.
+        """
+        self.n_steps += 1
+        self.n_candidates += 2 * n_tries - 1
+        # the proposals and the reference moves are scored in one batch each
+        self.n_scorer_calls += 2
+        rotor_positions = np.array(self.rotor_positions, dtype=np.int64)
+        permutation = self.plugboard.get_permutation()
+
+        prop_rotor_positions, prop_permutations = _propose_moves(
+            rotor_positions, permutation, n_tries, self.rng
+        )
+        prop_scores = _score_configurations(
+            self.decoder_enigma,
+            self.encrypted_ints,
+            self.scorer,
+            prop_rotor_positions,
+            prop_permutations,
+        )
+        prop_log_weights = prop_scores / self.score_scale
+        probabilities = np.exp(prop_log_weights - np.max(prop_log_weights))
+        picked = self.rng.choice(n_tries, p=probabilities / np.sum(probabilities))
+
+        ref_rotor_positions, ref_permutations = _propose_moves(
+            prop_rotor_positions[picked],
+            prop_permutations[picked],
+            n_tries - 1,
+            self.rng,
+        )
+        ref_scores = _score_configurations(
+            self.decoder_enigma,
+            self.encrypted_ints,
+            self.scorer,
+            ref_rotor_positions,
+            ref_permutations,
+        )
+        ref_log_weights = np.append(ref_scores, self.score) / self.score_scale
+
+        log_ratio = _logsumexp(prop_log_weights) - _logsumexp(ref_log_weights)
+        if log_ratio < 0 and self.rng.random() >= math.exp(log_ratio):
+            return
+
+        if np.array_equal(prop_permutations[picked], permutation):
+            self.n_accepted_rot += 1
+        else:
+            self.n_accepted_plug += 1
+        self.score = prop_scores[picked]
+        self.rotor_positions = prop_rotor_positions[picked].tolist()
+        self.decoder_enigma.set_rotor_positions(self.rotor_positions)
+        self.plugboard.swap_dict = {
+            pos: partner
+            for pos, partner in enumerate(prop_permutations[picked].tolist())
+            if pos != partner
+        }
+        # built again when a single move needs it
+        self.plug_state = None
+
+        if self.score > self.best_score:
+            self.best_score = self.score
+            self.best_rotor_positions = self.rotor_positions
+            self.best_swap_dict = self.plugboard.swap_dict
+
+    def get_state(self) -> dict:
+        """
+        :return: everything needed to continue the chain on another machine, without the machine
+        """
+        return dict(
+            rotor_positions=self.rotor_positions,
+            swap_dict=self.plugboard.swap_dict,
+            score=self.score,
+            score_scale=self.score_scale,
+            plug_score_scale=self.plug_score_scale,
+            rng=self.rng,
+            n_steps=self.n_steps,
+            n_accepted_rot=self.n_accepted_rot,
+            n_accepted_plug=self.n_accepted_plug,
+            n_candidates=self.n_candidates,
+            n_scorer_calls=self.n_scorer_calls,
+            best_score=self.best_score,
+            best_rotor_positions=self.best_rotor_positions,
+            best_swap_dict=self.best_swap_dict,
+            # the total of plug moves is updated incrementally, it can differ in the last bits
+            plug_total=(
+                None if self.plug_state is None else self.plug_state.total_loglikelihood
+            ),
+        )
+
+    @classmethod
+    def from_state(
+        cls,
+        compiled_enigma: enigma.CompiledEnigma,
+        encrypted_message: str,
+        scorer: TextScorerBase,
+        state: dict,
+        score_cache: ScoreCache = None,
+    ):
+        compiled_enigma.enigma.plug_board.swap_dict = state["swap_dict"]
+        compiled_enigma.enigma.set_rotor_positions(state["rotor_positions"])
+        chain = cls(
+            compiled_enigma,
+            encrypted_message,
+            scorer,
+            state["score_scale"],
+            state["rng"],
+            score_cache=score_cache,
+            plug_score_scale=state["plug_score_scale"],
+        )
+        chain.score = state["score"]
+        chain.best_score = state["score"]
+        if chain.plug_state is not None and state.get("plug_total") is not None:
+            chain.plug_state.total_loglikelihood = state["plug_total"]
+        chain.n_steps = state["n_steps"]
+        chain.n_accepted_rot = state["n_accepted_rot"]
+        chain.n_accepted_plug = state["n_accepted_plug"]
+        chain.n_candidates = state["n_candidates"]
+        chain.n_scorer_calls = state["n_scorer_calls"]
+        if state["best_score"] >= chain.best_score:
+            chain.best_score = state["best_score"]
+            chain.best_rotor_positions = state["best_rotor_positions"]
+            chain.best_swap_dict = state["best_swap_dict"]
+        return chain
+
+
+def _chain_state_to_json(state: dict) -> dict:
+    """
+    :return: the chain state of _MCChain.get_state with only json types
+    """
+    state = dict(state)
+    state["rng"] = state["rng"].bit_generator.state
+    for key in ["swap_dict", "best_swap_dict"]:
+        state[key] = sorted(state[key].items())
+    for key in ["rotor_positions", "best_rotor_positions"]:
+        state[key] = [int(pos) for pos in state[key]]
+    return state
+
+
+def _chain_state_from_json(state: dict) -> dict:
+    state = dict(state)
+    rng = np.random.default_rng()
+    rng.bit_generator.state = state["rng"]
+    state["rng"] = rng
+    for key in ["swap_dict", "best_swap_dict"]:
+        state[key] = dict(state[key])
+    return state
+
+
+class TemperatureScheduleBase:
+    """
+    sets the score scales (temperatures) of the rotor and the plug moves of decode_message_MC
+    after each block, from the acceptance rates of the moves in the block
+    """
+
+    def next_score_scales(
+        self, block: int, score_scales: tuple, acceptance_rates: tuple
+    ) -> tuple:
+        """
+        :param block: index of the block that just ended
+        :param score_scales: current (rotor, plug) score scales
+        :param acceptance_rates: (rotor, plug) acceptance rates per step in the block,
+        the plug rate is None if there are no plugs
+        :return: (rotor, plug) score scales for the next block
+        """
+        raise NotImplementedError
+
+
+class GeometricSchedule(TemperatureScheduleBase):
+    """
+    simulated annealing, both score scales are multiplied by factor after each block
+    until they reach min_score_scale
+    """
+
+    def __init__(self, factor: float = 0.9, min_score_scale: float = 0.01):
+        self.factor = factor
+        self.min_score_scale = min_score_scale
+
+    def next_score_scales(
+        self, block: int, score_scales: tuple, acceptance_rates: tuple
+    ) -> tuple:
+        return tuple(
+            max(score_scale * self.factor, self.min_score_scale)
+            for score_scale in score_scales
+        )
+
+
+class AdaptiveSchedule(TemperatureScheduleBase):
+    """
+    tunes the score scale of each move type towards target_acceptance: the scale is multiplied
+    by exp(adaptation_rate * (target_acceptance - acceptance rate)) after each block.
+    Chains that are stuck in a local maximum heat up until they get out of it.
+    """
+
+    def __init__(
+        self,
+        target_acceptance: float = 0.5,
+        adaptation_rate: float = 2.0,
+        min_score_scale: float = 0.001,
+        max_score_scale: float = 1000.0,
+    ):
+        self.target_acceptance = target_acceptance
+        self.adaptation_rate = adaptation_rate
+        self.min_score_scale = min_score_scale
+        self.max_score_scale = max_score_scale
+
+    def next_score_scales(
+        self, block: int, score_scales: tuple, acceptance_rates: tuple
+    ) -> tuple:
+        next_scales = list()
+        for score_scale, acceptance_rate in zip(score_scales, acceptance_rates):
+            if acceptance_rate is not None:
+                score_scale *= math.exp(
+                    self.adaptation_rate * (self.target_acceptance - acceptance_rate)
+                )
+                score_scale = min(
+                    max(score_scale, self.min_score_scale), self.max_score_scale
+                )
+            next_scales.append(score_scale)
+        return tuple(next_scales)
+
+
+def _chain_counts(chain: _MCChain) -> dict:
+    return dict(
+        n_steps=chain.n_steps,
+        n_accepted_rot=chain.n_accepted_rot,
+        n_accepted_plug=chain.n_accepted_plug,
+        n_candidates=chain.n_candidates,
+        n_scorer_calls=chain.n_scorer_calls,
+    )
+
+
+def _emit_chain_block(
+    metrics: metrics_enigma.Metrics,
+    chain: _MCChain,
+    counts_before: dict,
+    seconds: float,
+    **fields,
+):
+    """
+    add the counts of the chain since counts_before to metrics and emit an mc_block event
+    with the acceptance rates of the block and the score trajectory
+    """
+    counts = {
+        name: value - counts_before[name]
+        for name, value in _chain_counts(chain).items()
+    }
+    n_steps = max(counts["n_steps"], 1)
+    metrics.add(
+        {
+            "n_candidates": counts["n_candidates"],
+            "n_scorer_calls": counts["n_scorer_calls"],
+            "mc_seconds": seconds,
+        }
+    )
+    metrics.emit(
+        "mc_block",
+        score_scale=chain.score_scale,
+        plug_score_scale=chain.plug_score_scale,
+        acceptance_rate_rot=counts["n_accepted_rot"] / n_steps,
+        acceptance_rate_plug=counts["n_accepted_plug"] / n_steps,
+        score=float(chain.score),
+        best_score=float(chain.best_score),
+        seconds=seconds,
+        candidates_per_second=counts["n_candidates"] / seconds,
+        **counts,
+        **fields,
+    )
 
 
 def decode_message_MC(
@@ -203,8 +2805,36 @@ def decode_message_MC(
     n_attempts_per_block=1000,
     max_n_blocks=100,
     charset=string.ascii_lowercase,
+    n_tries: int = 1,
+    checkpoint_path: str = None,
+    checkpoint_interval: float = 60.0,
+    metrics: metrics_enigma.Metrics = None,
+    score_cache: ScoreCache = None,
+    schedule: TemperatureScheduleBase = None,
+    patience: int = None,
 ):
+    """
+    :param score_scale: temperature of the chain, the start value if there is a schedule
+    :param n_tries: number of proposals per step, more than one uses multiple-try
+    Metropolis steps that decrypt and score all proposals of a step together.
+    They use score_scale for the moves of both types.
+    :param checkpoint_path: if given, the chain is written to this json file after a block
+    at most every checkpoint_interval seconds. A run with the same parameters resumes from it,
+    max_n_blocks can be raised to continue a finished run.
+    :param metrics: if given, an mc_block event with the acceptance rates and scores is
+    emitted after each block and a finished event at the end
+    :param score_cache: if given, the scores of the full decryptions of single moves are
+    looked up in it first. It must only be shared between runs with the same message and
+    scorer. Multiple-try steps score their proposals in batches without the cache.
+    :param schedule: if given, sets the score scales of the rotor and the plug moves
+    after each block, see GeometricSchedule and AdaptiveSchedule
+    :param patience: if given, the run stops when the best score has not improved for this
+    many blocks. Otherwise it stops when the average score of a block changed by less than
+    a relative 1e-4 from the previous block.
+    :return: decoded message, rotor positions and plugboard of the best state of the chain
+    """
     n_chars = rotors[0].n_positions
+    scorer = as_dense_scorer(scorer, charset)
     # test encoder knows the machine
     decoder_plugboard = enigma.Swapper(n_positions=n_chars)
     decoder_plugboard.assign_random_swaps(n_swaps=n_plugs)
@@ -214,69 +2844,334 @@ def decode_message_MC(
         copy.deepcopy(reflector),
         charset=charset,
     )
+    # rotor moves keep revisiting the same start positions
+    compiled_enigma = enigma.CompiledEnigma(decoder_enigma)
 
-    last_rotor_positions = decoder_enigma.get_rotor_positions()
-    last_dec_msg = decoder_enigma.encode_message(encrypted_message)
-    last_score = scorer.score_text(last_dec_msg)
-
-    rng = np.random.default_rng(42)
-
-    last_block_avg_score = -np.inf
+    checkpointer = _Checkpointer(
+        checkpoint_path,
+        checkpoint_interval,
+        run=dict(
+            kind="decode_message_MC",
+            message=_message_digest(encrypted_message),
+            **_machine_run_params(decoder_enigma),
+            scorer=_scorer_digest(scorer),
+            n_plugs=n_plugs,
+            score_scale=score_scale,
+            n_attempts_per_block=n_attempts_per_block,
+            n_tries=n_tries,
+            schedule=(
+                None if schedule is None else [type(schedule).__name__, vars(schedule)]
+            ),
+            patience=patience,
+        ),
+    )
+    progress = checkpointer.get("mc")
+    if progress is None:
+        chain = _MCChain(
+            compiled_enigma,
+            encrypted_message,
+            scorer,
+            score_scale,
+            np.random.default_rng(42),
+            score_cache=score_cache,
+        )
+        first_block = 0
+        last_block_avg_score = -np.inf
+        n_stagnant_blocks = 0
+        converged = False
+    else:
+        chain = _MCChain.from_state(
+            compiled_enigma,
+            encrypted_message,
+            scorer,
+            _chain_state_from_json(progress["chain"]),
+            score_cache=score_cache,
+        )
+        first_block = progress["n_blocks"]
+        last_block_avg_score = progress["last_block_avg_score"]
+        n_stagnant_blocks = progress["n_stagnant_blocks"]
+        converged = progress["converged"]
 
-    for i in range(max_n_blocks):
+    for i in range(first_block, max_n_blocks):
+        if converged:
+            break
+        tick = time.perf_counter()
+        chain_counts = _chain_counts(chain)
+        last_best_score = chain.best_score
         block_scores = list()
-        block_accepted_rot = 0
-        block_accepted_plug = 0
         for _ in range(n_attempts_per_block):
+            if n_tries > 1:
+                chain.multiple_try_step(n_tries)
+            else:
+                chain.step()
+            block_scores.append(chain.score)
+
+        block_avg_score = np.mean(block_scores)
+        if chain.best_score > last_best_score:
+            n_stagnant_blocks = 0
+        else:
+            n_stagnant_blocks += 1
+        if patience is not None:
+            converged = n_stagnant_blocks >= patience
+        else:
+            # there is nothing to compare the first block to
+            converged = bool(
+                np.isfinite(last_block_avg_score)
+                and abs((block_avg_score - last_block_avg_score) / last_block_avg_score)
+                < 0.0001
+            )
+        if not converged:
+            last_block_avg_score = block_avg_score
+        if metrics is not None:
+            _emit_chain_block(
+                metrics,
+                chain,
+                chain_counts,
+                time.perf_counter() - tick,
+                block=i,
+                block_avg_score=float(block_avg_score),
+                n_stagnant_blocks=n_stagnant_blocks,
+            )
+        if schedule is not None:
+            n_steps = max(chain.n_steps - chain_counts["n_steps"], 1)
+            chain.score_scale, chain.plug_score_scale = schedule.next_score_scales(
+                i,
+                (chain.score_scale, chain.plug_score_scale),
+                (
+                    (chain.n_accepted_rot - chain_counts["n_accepted_rot"]) / n_steps,
+                    (
+                        (chain.n_accepted_plug - chain_counts["n_accepted_plug"])
+                        / n_steps
+                        if chain.has_plugs
+                        else None
+                    ),
+                ),
+            )
 
-            # rotor move
-            prop_rot_pos = _propose_rot_move(last_rotor_positions, n_chars, rng)
-            decoder_enigma.set_rotor_positions(prop_rot_pos)
-            accept, new_score = _assess_move(
-                decoder_enigma, encrypted_message, scorer, last_score, score_scale, rng
+        # the plug moves depend on the order of the plugs in the plug board and a resumed
+        # chain starts from their canonical order, so every run continues from it
+        decoder_plugboard.swap_dict = decoder_plugboard.swap_dict
+        if checkpointer.path is not None:
+            checkpointer.update(
+                mc=dict(
+                    n_blocks=i + 1,
+                    last_block_avg_score=float(last_block_avg_score),
+                    n_stagnant_blocks=n_stagnant_blocks,
+                    converged=bool(converged),
+                    chain=_chain_state_to_json(chain.get_state()),
+                )
             )
-            if accept:
-                block_accepted_rot += 1
-                last_score = new_score
-                last_rotor_positions = prop_rot_pos
-
-            if n_plugs > 0:
-                # plugboard move
-                prop_plug_move = _propose_plug_move(decoder_plugboard, rng)
-                decoder_plugboard.move_one_swap_side(
-                    prop_plug_move[0], prop_plug_move[1]
+    checkpointer.update(force=True)
+
+    # a hot chain can have left the best state again
+    decoder_plugboard.swap_dict = chain.best_swap_dict
+    decoder_enigma.set_rotor_positions(chain.best_rotor_positions)
+    decoded_msg = decoder_enigma.encode_message(encrypted_message)
+    if metrics is not None:
+        if score_cache is not None:
+            metrics.emit("score_cache", **score_cache.get_stats())
+        metrics.emit("finished", function="decode_message_MC", **metrics.summary())
+
+    return decoded_msg, chain.best_rotor_positions, decoder_plugboard
+
+
+def _run_chain(
+    compiled_enigma: enigma.CompiledEnigma,
+    encrypted_message: str,
+    scorer: TextScorerBase,
+    state: dict,
+    n_steps: int,
+) -> dict:
+    chain = _MCChain.from_state(compiled_enigma, encrypted_message, scorer, state)
+    for _ in range(n_steps):
+        chain.step()
+    return chain.get_state()
+
+
+def _run_chain_in_worker(task: tuple) -> dict:
+    state, n_steps = task
+    return _run_chain(
+        _worker_state["compiled_enigma"],
+        _worker_state["encrypted_message"],
+        _worker_state["scorer"],
+        state,
+        n_steps,
+    )
+
+
+def _swap_neighbour_chains(states: list, rng: np.random.Generator) -> list:
+    """
+    replica exchange between neighbouring temperatures, the configurations are swapped
+    and the temperatures, random generators and statistics stay with their chain.
+
+    :return: list with a bool for each neighbour pair (i, i + 1), True if swapped
+    """
+    swapped = list()
+    for i in range(len(states) - 1):
+        cold, hot = states[i], states[i + 1]
+        # detailed balance for exp(score / score_scale) of both chains
+        log_prob = (hot["score"] - cold["score"]) * (
+            1 / cold["score_scale"] - 1 / hot["score_scale"]
+        )
+        swap = log_prob >= 0 or rng.random() < math.exp(log_prob)
+        if swap:
+            for key in ["rotor_positions", "swap_dict", "score", "plug_total"]:
+                cold[key], hot[key] = hot[key], cold[key]
+            # a chain can receive a configuration that is better than its own best
+            for state in [cold, hot]:
+                if state["score"] > state["best_score"]:
+                    state["best_score"] = state["score"]
+                    state["best_rotor_positions"] = state["rotor_positions"]
+                    state["best_swap_dict"] = state["swap_dict"]
+        swapped.append(swap)
+    return swapped
+
+
+def decode_message_parallel_tempering(
+    encrypted_message,
+    rotors: list,
+    n_plugs: int,
+    reflector: enigma.Swapper,
+    scorer: TextScorerBase,
+    score_scales: list = (0.05, 0.1, 0.2, 0.4),
+    n_steps_per_exchange: int = 100,
+    n_exchanges: int = 100,
+    charset=string.ascii_lowercase,
+    n_workers: int = 1,
+    seed: int = 42,
+    metrics: metrics_enigma.Metrics = None,
+):
+    """
+    run one markov chain per score scale and exchange the configurations of chains with
+    neighbouring score scales every n_steps_per_exchange steps.
+    The chains run on n_workers processes in between the exchanges.
+
+    :param score_scales: temperatures of the chains, from cold to hot
+    :param metrics: if given, an exchange event with the scores of the chains is emitted
+    after each exchange and a finished event at the end
+    :return: decoded message, rotor positions and plugboard of the best state found,
+    and a list with the statistics of each chain
+    """
+    n_chars = rotors[0].n_positions
+    scorer = as_dense_scorer(scorer, charset)
+    decoder_plugboard = enigma.Swapper(n_positions=n_chars)
+    decoder_enigma = enigma.Enigma(
+        copy.deepcopy(rotors),
+        decoder_plugboard,
+        copy.deepcopy(reflector),
+        charset=charset,
+    )
+    compiled_enigma = enigma.CompiledEnigma(decoder_enigma)
+
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(score_scales) + 1)
+    exchange_rng = np.random.default_rng(seed_sequences[-1])
+    states = list()
+    for score_scale, seed_sequence in zip(score_scales, seed_sequences):
+        rng = np.random.default_rng(seed_sequence)
+        decoder_plugboard.assign_random_swaps(
+            n_swaps=n_plugs, seed=int(rng.integers(2**31))
+        )
+        chain = _MCChain(compiled_enigma, encrypted_message, scorer, score_scale, rng)
+        states.append(chain.get_state())
+    n_swaps_accepted = np.zeros(len(score_scales) - 1, dtype=int)
+
+    if n_workers > 1:
+        pool_context = multiprocessing.Pool(
+            n_workers,
+            initializer=_init_search_worker,
+            initargs=(
+                dict(
+                    compiled_enigma=enigma.CompiledEnigma(decoder_enigma),
+                    encrypted_message=encrypted_message,
+                    scorer=scorer,
+                ),
+            ),
+        )
+    else:
+        pool_context = contextlib.nullcontext()
+    with pool_context as pool:
+        for exchange in range(n_exchanges):
+            tick = time.perf_counter()
+            n_candidates_before = sum(state["n_candidates"] for state in states)
+            n_scorer_calls_before = sum(state["n_scorer_calls"] for state in states)
+            if pool is None:
+                states = [
+                    _run_chain(
+                        compiled_enigma,
+                        encrypted_message,
+                        scorer,
+                        state,
+                        n_steps_per_exchange,
+                    )
+                    for state in states
+                ]
+            else:
+                states = pool.map(
+                    _run_chain_in_worker,
+                    [(state, n_steps_per_exchange) for state in states],
                 )
-                accept, new_score = _assess_move(
-                    decoder_enigma,
-                    encrypted_message,
-                    scorer,
-                    last_score,
-                    score_scale,
-                    rng,
+            swapped = _swap_neighbour_chains(states, exchange_rng)
+            n_swaps_accepted += swapped
+            if metrics is not None:
+                seconds = time.perf_counter() - tick
+                n_candidates = (
+                    sum(state["n_candidates"] for state in states) - n_candidates_before
+                )
+                metrics.add(
+                    {
+                        "n_candidates": n_candidates,
+                        "n_scorer_calls": sum(
+                            state["n_scorer_calls"] for state in states
+                        )
+                        - n_scorer_calls_before,
+                        "mc_seconds": seconds,
+                    }
+                )
+                metrics.emit(
+                    "exchange",
+                    exchange=exchange,
+                    scores=[float(state["score"]) for state in states],
+                    best_scores=[float(state["best_score"]) for state in states],
+                    swapped=swapped,
+                    seconds=seconds,
+                    candidates_per_second=n_candidates / seconds,
                 )
-                if accept:
-                    last_score = new_score
-                    block_accepted_plug += 1
-                else:
-                    # undo the move
-                    decoder_plugboard.move_one_swap_side(
-                        prop_plug_move[1], prop_plug_move[0]
-                    )
 
-            block_scores.append(last_score)
+    # the first of equal scores wins, so the result does not depend on n_workers
+    best_state = max(states, key=lambda state: state["best_score"])
+    decoder_plugboard.swap_dict = best_state["best_swap_dict"]
+    decoder_enigma.set_rotor_positions(best_state["best_rotor_positions"])
+    decoded_msg = decoder_enigma.encode_message(encrypted_message)
 
-        block_avg_score = np.mean(block_scores)
-        if (
-            abs((block_avg_score - last_block_avg_score) / last_block_avg_score)
-            < 0.0001
-        ):
-            break
-        last_block_avg_score = block_avg_score
-        # print(f'avg score {last_block_avg_score}')
-        # print(f'acceptance rate rot {block_accepted_rot / n_attempts_per_block}')
-        # print(f'acceptance rate plug {block_accepted_plug / n_attempts_per_block}')
+    chain_stats = list()
+    for i, state in enumerate(states):
+        n_steps = max(state["n_steps"], 1)
+        chain_stats.append(
+            {
+                "score_scale": state["score_scale"],
+                "acceptance_rate_rot": state["n_accepted_rot"] / n_steps,
+                "acceptance_rate_plug": state["n_accepted_plug"] / n_steps,
+                # exchanges with the next hotter chain
+                "exchange_rate": (
+                    float(n_swaps_accepted[i] / n_exchanges)
+                    if i < len(n_swaps_accepted) and n_exchanges > 0
+                    else None
+                ),
+                "score": state["score"],
+                "best_score": state["best_score"],
+            }
+        )
 
-    # use the final settings to return
-    decoded_msg = decoder_enigma.encode_message(encrypted_message)
+    if metrics is not None:
+        metrics.emit(
+            "finished",
+            function="decode_message_parallel_tempering",
+            **metrics.summary(),
+        )
 
-    return decoded_msg, last_rotor_positions, decoder_plugboard
+    return (
+        decoded_msg,
+        best_state["best_rotor_positions"],
+        decoder_plugboard,
+        chain_stats,
+    )
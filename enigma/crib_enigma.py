@@ -0,0 +1,213 @@
+import numpy as np
+import tqdm
+
+import enigma
+import crack_enigma
+
+
+def find_legal_offsets(
+    encrypted_ints: np.ndarray, crib_ints: np.ndarray, reflector: enigma.Swapper
+) -> list:
+    """
+    A machine with a reflector without fixed points never encodes a character to itself,
+    so the crib can not be at an offset where one of its characters matches the ciphertext.
+
+    :return: list of the offsets at which the crib can be placed in the ciphertext
+    """
+    offsets = list(range(len(encrypted_ints) - len(crib_ints) + 1))
+    reflector_permutation = reflector.get_permutation()
+    if np.any(reflector_permutation == np.arange(len(reflector_permutation))):
+        return offsets
+    return [
+        offset
+        for offset in offsets
+        if not np.any(encrypted_ints[offset : offset + len(crib_ints)] == crib_ints)
+    ]
+
+
+def build_menu(crib_ints: np.ndarray, encrypted_ints: np.ndarray, offset: int):
+    """
+    The menu links the plain and the cipher character at every position of the crib.
+    With the plug board P and the permutation C_j of the rotors and the reflector at
+    crib position j, each link (u, v, j) means P(v) = C_j(P(u)). C_j is an involution,
+    so the link also holds in the other direction, both directions are returned.
+
+    :return: arrays first_chars, second_chars, crib_idxs
+    """
+    cipher_ints = encrypted_ints[offset : offset + len(crib_ints)]
+    crib_idxs = np.arange(len(crib_ints))
+    return (
+        np.concatenate([crib_ints, cipher_ints]),
+        np.concatenate([cipher_ints, crib_ints]),
+        np.concatenate([crib_idxs, crib_idxs]),
+    )
+
+
+def _core_tables(
+    decoder_enigma: enigma.Enigma,
+    start_positions: np.ndarray,
+    offset: int,
+    len_crib: int,
+    odometer_table: np.ndarray = None,
+) -> np.ndarray:
+    """
+    :param odometer_table: Enigma.get_odometer_core_table of decoder_enigma, if given the
+    permutations are looked up in it
+    :return: array (n_starts x len_crib x n_chars) with the permutation of the rotors and the
+    reflector at each crib position, for each of the rotor start positions
+    """
+    n_chars = len(decoder_enigma.charset)
+    if odometer_table is not None:
+        values = decoder_enigma.get_odometer_values(start_positions)[:, np.newaxis]
+        steps = np.arange(offset + 1, offset + len_crib + 1)[np.newaxis, :]
+        return odometer_table[(values + steps) % len(odometer_table)]
+    position_sequence = decoder_enigma._rotor_position_sequence(
+        start_positions, offset + len_crib
+    )
+    position_sequence = [
+        positions[:, offset:, np.newaxis] for positions in position_sequence
+    ]
+    return decoder_enigma._apply_core(
+        np.arange(n_chars)[np.newaxis, np.newaxis, :], position_sequence
+    )
+
+
+def _propagate_plug_hypotheses(
+    core_tables: np.ndarray, menu: tuple, plugs: np.ndarray, n_plugs: int = None
+):
+    """
+    Deduce plugs from the menu and the symmetry of the plug board until nothing changes,
+    hypotheses that contradict themselves are dropped.
+
+    :param core_tables: array (n_starts x len_crib x n_chars), see _core_tables
+    :param plugs: array (n_hypotheses x n_chars) with the plug partner of each character,
+    -1 if unknown. Row i is a hypothesis for the start i // (n_hypotheses / n_starts).
+    :param n_plugs: if given, hypotheses with more plugs are dropped
+    :return: indices of the surviving hypotheses and their plugs
+    """
+    first_chars, second_chars, crib_idxs = menu
+    n_chars = plugs.shape[1]
+    chars = np.arange(n_chars, dtype=plugs.dtype)
+    start_idxs = np.arange(len(plugs)) // (len(plugs) // len(core_tables))
+    hypothesis_idxs = np.arange(len(plugs))
+    # flat lookups are faster than indexing the 3D array
+    len_crib = core_tables.shape[1]
+    flat_core_tables = core_tables.astype(plugs.dtype).ravel()
+    link_offsets = crib_idxs * n_chars
+
+    changed = True
+    while changed and len(plugs):
+        rows = np.arange(len(plugs))[:, np.newaxis]
+
+        # links of the menu
+        first_plugs = plugs[:, first_chars]
+        second_plugs = plugs[:, second_chars]
+        is_known = first_plugs >= 0
+        table_offsets = start_idxs[:, np.newaxis] * (len_crib * n_chars) + link_offsets
+        implied = flat_core_tables[table_offsets + np.where(is_known, first_plugs, 0)]
+        is_contradiction = np.any(
+            is_known & (second_plugs >= 0) & (second_plugs != implied), axis=1
+        )
+        new_rows, new_links = np.nonzero(is_known & (second_plugs < 0))
+        plugs[new_rows, second_chars[new_links]] = implied[new_rows, new_links]
+        changed = len(new_rows) > 0
+
+        # the plug board is symmetric
+        is_known = plugs >= 0
+        partners = np.where(is_known, plugs, 0)
+        partner_plugs = plugs[rows, partners]
+        is_contradiction |= np.any(
+            is_known & (partner_plugs >= 0) & (partner_plugs != chars), axis=1
+        )
+        new_rows, new_chars = np.nonzero(is_known & (partner_plugs < 0))
+        plugs[new_rows, partners[new_rows, new_chars]] = new_chars
+        changed |= len(new_rows) > 0
+
+        if n_plugs is not None:
+            n_plugged = np.sum((plugs >= 0) & (plugs != chars), axis=1)
+            is_contradiction |= n_plugged > 2 * n_plugs
+
+        keep = ~is_contradiction
+        plugs = plugs[keep]
+        start_idxs = start_idxs[keep]
+        hypothesis_idxs = hypothesis_idxs[keep]
+
+    return hypothesis_idxs, plugs
+
+
+def crib_attack(
+    encrypted_message: str,
+    crib: str,
+    rotors: list,
+    reflector: enigma.Swapper,
+    charset: str,
+    offsets: list = None,
+    n_plugs: int = None,
+    block_size: int = 1024,
+    disable_tqdm=True,
+) -> list:
+    """
+    Known plaintext attack. For each legal offset of the crib and each rotor start position,
+    every partner of the most frequent menu character is tried as plug hypothesis and
+    propagated through the menu, see _propagate_plug_hypotheses.
+
+    :param offsets: offsets of the crib in the ciphertext to try, all legal offsets if None
+    :param n_plugs: maximum number of plugs, if known
+    :param block_size: number of rotor start positions that are propagated together
+    :return: list of the surviving settings (offset, rotor start positions, swap dict of the
+    deduced plugs). Characters that are not in the menu have no plugs in the swap dict.
+    """
+    decoder_enigma = enigma.Enigma(
+        rotors, enigma.Swapper(n_positions=len(charset)), reflector, charset=charset
+    )
+    n_chars = len(charset)
+    n_rotors = len(rotors)
+    encrypted_ints = decoder_enigma.chars_to_ints(encrypted_message)
+    crib_ints = decoder_enigma.chars_to_ints(crib)
+    if offsets is None:
+        offsets = find_legal_offsets(encrypted_ints, crib_ints, reflector)
+
+    positions = crack_enigma.MultiindexIiterator(n_rotors, n_chars)
+    # all start positions are tried, so the core permutation of every odometer value is needed
+    odometer_table = None
+    if n_chars ** (n_rotors + 1) <= crack_enigma._MAX_ODOMETER_TABLE_SIZE:
+        odometer_table = decoder_enigma.get_odometer_core_table()
+    survivors = list()
+    with tqdm.tqdm(total=len(offsets) * len(positions), disable=disable_tqdm) as bar:
+        for offset in offsets:
+            menu = build_menu(crib_ints, encrypted_ints, offset)
+            # the most frequent character of the menu gives the most deductions
+            hypothesis_char = np.argmax(np.bincount(menu[0], minlength=n_chars))
+            for start_positions in positions.iter_blocks(block_size):
+                core_tables = _core_tables(
+                    decoder_enigma,
+                    start_positions,
+                    offset,
+                    len(crib_ints),
+                    odometer_table=odometer_table,
+                )
+                plugs = np.full(
+                    (len(start_positions) * n_chars, n_chars), -1, dtype=np.int16
+                )
+                hypotheses = np.tile(np.arange(n_chars), len(start_positions))
+                plugs[:, hypothesis_char] = hypotheses
+                plugs[np.arange(len(plugs)), hypotheses] = hypothesis_char
+
+                hypothesis_idxs, plugs = _propagate_plug_hypotheses(
+                    core_tables, menu, plugs, n_plugs=n_plugs
+                )
+                for hypothesis_idx, plug_row in zip(hypothesis_idxs, plugs.tolist()):
+                    swap_dict = {
+                        char: partner
+                        for char, partner in enumerate(plug_row)
+                        if partner >= 0 and partner != char
+                    }
+                    survivors.append(
+                        (
+                            offset,
+                            start_positions[hypothesis_idx // n_chars].tolist(),
+                            swap_dict,
+                        )
+                    )
+                bar.update(len(start_positions))
+    return survivors
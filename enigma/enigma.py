@@ -1,7 +1,11 @@
+import collections
 import numpy as np
 
 import string
 
+# charset to send arbitrary binary data through the machine
+BYTE_CHARSET = bytes(range(256))
+
 
 def gen_permutor_lists(n_elements: int, seed: int):
     elements = range(n_elements)
@@ -36,29 +40,101 @@ def gen_swap_dict(elements: list, n_swaps: int, seed):
     return swap_dict
 
 
-class Rotor:
-    def __init__(self, n_positions: int = 26, seed: int = 0):
-        self.seed = seed
-        self.n_positions = n_positions
+def _as_int_array(buffer) -> np.ndarray:
+    # view buffers such as bytes or memoryview as uint8 array without copying
+    if isinstance(buffer, np.ndarray):
+        return buffer
+    return np.frombuffer(buffer, dtype=np.uint8)
 
-        self.position = 0
 
+class _RotorWiring:
+    """
+    immutable wiring of a rotor, shared between all rotors with the same n_positions and seed
+    """
+
+    __slots__ = (
+        "forward_adds",
+        "backward_adds",
+        "forward_table",
+        "backward_table",
+        "forward_lists",
+        "backward_lists",
+    )
+
+    def __init__(self, n_positions: int, seed: int):
         # who is connected to who at pos 0:
-        positions = np.arange(self.n_positions)
+        positions = np.arange(n_positions)
         rng = np.random.default_rng(seed)
         connected_forward = rng.permutation(positions)
-        connected_backwards = np.array(
-            [np.where(connected_forward == pos) for pos in positions]
-        ).squeeze()
+        connected_backwards = np.empty_like(connected_forward)
+        connected_backwards[connected_forward] = positions
 
         # the actual wiring, i.e. the relative difference between the connections on the in-side and the out-side
         self.forward_adds = connected_forward - positions
         self.backward_adds = connected_backwards - positions
 
+        # lookup tables for every rotor position, table[pos, input_] is the output
+        add_idx = np.add.outer(positions, positions) % n_positions
+        self.forward_table = (
+            positions[None, :] + self.forward_adds[add_idx]
+        ) % n_positions
+        self.backward_table = (
+            positions[None, :] + self.backward_adds[add_idx]
+        ) % n_positions
+        # plain python ints for the character by character access
+        self.forward_lists = self.forward_table.tolist()
+        self.backward_lists = self.backward_table.tolist()
+
+        for array in [
+            self.forward_adds,
+            self.backward_adds,
+            self.forward_table,
+            self.backward_table,
+        ]:
+            array.setflags(write=False)
+
+
+_rotor_wiring_cache = dict()
+
+
+def get_rotor_wiring(n_positions: int, seed: int) -> _RotorWiring:
+    key = (n_positions, seed)
+    if key not in _rotor_wiring_cache:
+        _rotor_wiring_cache[key] = _RotorWiring(n_positions, seed)
+    return _rotor_wiring_cache[key]
+
+
+class Rotor:
+    __slots__ = ("seed", "n_positions", "position", "_wiring")
+
+    def __init__(self, n_positions: int = 26, seed: int = 0):
+        self.seed = seed
+        self.n_positions = n_positions
+
+        self.position = 0
+
+        self._wiring = get_rotor_wiring(n_positions, seed)
+
+    # copies and pickles only carry the setting, the wiring comes from the cache
+    def __getstate__(self):
+        return self.n_positions, self.seed, self.position
+
+    def __setstate__(self, state):
+        n_positions, seed, position = state
+        self.__init__(n_positions=n_positions, seed=seed)
+        self.position = position
+
+    @property
+    def forward_adds(self) -> np.ndarray:
+        return self._wiring.forward_adds
+
+    @property
+    def backward_adds(self) -> np.ndarray:
+        return self._wiring.backward_adds
+
     def rotate_return_carryover(self, n_steps: int) -> int:
-        div, mod = np.divmod(self.position + n_steps, self.n_positions)
-        self.position = mod
-        return int(div)
+        div, self.position = divmod(self.position + n_steps, self.n_positions)
+        return div
 
     def set_position(self, pos: int):
         self.position = pos % self.n_positions
@@ -67,55 +143,153 @@ class Rotor:
         return self.position
 
     def get_permuted_output_forward(self, input_: int) -> int:
-        add_idx = (input_ + self.position) % self.n_positions
-        return int((input_ + self.forward_adds[add_idx]) % self.n_positions)
+        return self._wiring.forward_lists[self.position][input_]
 
     def get_permuted_output_backward(self, input_: int) -> int:
-        add_idx = (input_ + self.position) % self.n_positions
-        return int((input_ + self.backward_adds[add_idx]) % self.n_positions)
+        return self._wiring.backward_lists[self.position][input_]
+
+    def get_permutation_tables(self):
+        """
+        :return: forward and backward lookup tables of shape (n_positions x n_positions).
+        table[pos, input_] is the output of the rotor at position pos. The tables are read only.
+        """
+        return self._wiring.forward_table, self._wiring.backward_table
+
+
+class _IndexedSet:
+    """
+    set of the integers 0 ... n_elements-1 with O(1) add, remove and random choice
+    """
+
+    __slots__ = ("items", "index")
+
+    def __init__(self, n_elements: int, fill: bool):
+        self.items = list(range(n_elements)) if fill else list()
+        self.index = list(range(n_elements)) if fill else n_elements * [-1]
+
+    def __contains__(self, element: int) -> bool:
+        return self.index[element] >= 0
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def add(self, element: int):
+        if self.index[element] < 0:
+            self.index[element] = len(self.items)
+            self.items.append(element)
+
+    def remove(self, element: int):
+        idx = self.index[element]
+        if idx < 0:
+            return
+        last = self.items.pop()
+        if last != element:
+            self.items[idx] = last
+            self.index[last] = idx
+        self.index[element] = -1
+
+    def choice(self, rng: np.random.Generator) -> int:
+        return self.items[rng.integers(len(self.items))]
 
 
 class Swapper:
+    __slots__ = ("n_positions", "_partners", "_free", "_swapped")
+
     def __init__(self, n_positions: int = 26):
         self.n_positions = n_positions
-        self.swap_dict = dict()
+        # every position is connected to itself if it is not swapped
+        self._partners = list(range(n_positions))
+        self._free = _IndexedSet(n_positions, fill=True)
+        self._swapped = _IndexedSet(n_positions, fill=False)
+
+    def __getstate__(self):
+        return self.n_positions, self.swap_dict
+
+    def __setstate__(self, state):
+        n_positions, swap_dict = state
+        self.__init__(n_positions=n_positions)
+        self.swap_dict = swap_dict
+
+    @property
+    def swap_dict(self) -> dict:
+        """
+        new dict with the swaps, changing it does not change the swapper.
+        Change the swaps with set_element_swap, unset_element_swap or by assigning a dict.
+        """
+        return {
+            pos: partner
+            for pos, partner in enumerate(self._partners)
+            if pos in self._swapped
+        }
+
+    @swap_dict.setter
+    def swap_dict(self, swap_dict: dict):
+        # start from a new swapper, so the state does not depend on the previous swaps
+        self.__init__(n_positions=self.n_positions)
+        for e1, e2 in swap_dict.items():
+            self.set_element_swap(e1, e2)
+
+    def _release(self, pos: int):
+        self._partners[pos] = pos
+        self._swapped.remove(pos)
+        self._free.add(pos)
+
+    def _connect(self, pos: int, partner: int):
+        self._partners[pos] = partner
+        self._free.remove(pos)
+        self._swapped.add(pos)
 
     def assign_random_swaps(self, n_swaps: int = 10, seed: int = 42):
         assert n_swaps <= self.n_positions // 2
-        self.swap_dict = gen_swap_dict(list(range(self.n_positions)), n_swaps, seed)
+        swap_dict = gen_swap_dict(list(range(self.n_positions)), n_swaps, seed)
+        self.swap_dict = {int(e1): int(e2) for e1, e2 in swap_dict.items()}
 
     def set_element_swap(self, e1: int, e2: int):
-        # todo sanity check
-        self.swap_dict[e1] = e2
-        self.swap_dict[e2] = e1
+        # previous partners are released so the swaps stay symmetric
+        for pos in [e1, e2]:
+            if pos in self._swapped:
+                self._release(self._partners[pos])
+        self._connect(e1, e2)
+        self._connect(e2, e1)
 
     def unset_element_swap(self, e1: int, e2: int):
-        self.swap_dict.pop(e1)
-        self.swap_dict.pop(e2)
+        for pos in [e1, e2]:
+            if pos not in self._swapped:
+                raise KeyError(pos)
+        self._release(e1)
+        self._release(e2)
 
     def move_one_swap_side(self, move_from: int, move_to: int, sanity_checks=True):
         if sanity_checks:
-            if move_from not in self.swap_dict.keys():
+            if move_from not in self._swapped:
                 raise ValueError("move_from was not part of a swap before moving")
-            if move_to in self.swap_dict.keys():
+            if move_to in self._swapped:
                 raise ValueError("move_to is already taken")
 
-        # set the new connection
-        self.set_element_swap(self.swap_dict[move_from], move_to)
-        # remove the old connection
-        self.swap_dict.pop(move_from)
+        # set the new connection, this also removes the old one
+        self.set_element_swap(self._partners[move_from], move_to)
 
     def get_output(self, input_: int) -> int:
         # if swapped, return the swap value, else return the input
-        return self.swap_dict.get(input_, input_)
+        return self._partners[input_]
 
     def get_free_positions(self) -> set:
-        all_pos = set(range(self.n_positions))
-        taken_pos = set(self.swap_dict.keys())
-        return all_pos - taken_pos
+        return set(self._free.items)
 
     def get_swapped_positions(self) -> set:
-        return set(self.swap_dict.keys())
+        return set(self._swapped.items)
+
+    def choose_free_position(self, rng: np.random.Generator) -> int:
+        return self._free.choice(rng)
+
+    def choose_swapped_position(self, rng: np.random.Generator) -> int:
+        return self._swapped.choice(rng)
+
+    def get_permutation(self) -> np.ndarray:
+        """
+        :return: lookup table of length n_positions, permutation[input_] is the output
+        """
+        return np.array(self._partners)
 
 
 class Enigma:
@@ -124,14 +298,29 @@ class Enigma:
         rotors,
         plugboard: Swapper,
         reflector: Swapper,
-        charset: str = string.ascii_uppercase,
+        charset=string.ascii_uppercase,
     ):
+        """
+        :param charset: str, or bytes (e.g. BYTE_CHARSET) to encode bytes instead of text
+        """
         self.charset = charset
         n_chars = len(charset)
 
         self.char_to_number_map = dict()
         for i, char in enumerate(self.charset):
             self.char_to_number_map[char] = i
+        # vectorized versions of the map for the integer encoding
+        self._is_bytes_charset = isinstance(charset, (bytes, bytearray))
+        if self._is_bytes_charset:
+            self._codepoints = np.frombuffer(charset, dtype=np.uint8).astype(np.uint32)
+        else:
+            self._codepoints = np.array(
+                [ord(char) for char in self.charset], dtype=np.uint32
+            )
+        self._sorted_order = np.argsort(self._codepoints)
+        self._sorted_codepoints = self._codepoints[self._sorted_order]
+        # bytes can be used as character indices directly
+        self._is_identity_charset = bool(np.all(self._codepoints == np.arange(n_chars)))
 
         rotor_lengths = np.array([rot.n_positions for rot in rotors])
         if not np.all(rotor_lengths == n_chars):
@@ -160,22 +349,268 @@ class Enigma:
     def get_rotor_positions(self):
         return [rot.position for rot in self.rotors]
 
-    def encode_message(self, input_: str) -> str:
-        input_ints = [self.char_to_number_map[char] for char in input_]
-
-        output = str()
-        for input_int in input_ints:
-            number = self.plug_board.get_output(input_int)
-            # first rotor always gets rotated with each new character
-            rot_step = 1
-            for rot in self.rotors:
-                rot_step = rot.rotate_return_carryover(rot_step)
-                number = rot.get_permuted_output_forward(number)
-            number = self.reflector.get_output(number)
-            for rot in reversed(self.rotors):
-                number = rot.get_permuted_output_backward(number)
-            number = self.plug_board.get_output(number)
-
-            output += self.charset[number]
-
-        return output
+    def encode_message(self, input_):
+        """
+        :param input_: str made from the charset, or bytes if the charset is bytes
+        :return: the encoded message, same type as the input
+        """
+        output_ints = self.encode_ints(self.chars_to_ints(input_))
+        return self.ints_to_chars(output_ints)
+
+    def encode_ints(self, input_, out=None) -> np.ndarray:
+        """
+        Encode character indices and advance the rotors, like encode_message.
+
+        :param input_: character indices as bytes, bytearray, memoryview or integer array.
+        Buffers are read without copying.
+        :param out: optional writable buffer or integer array of the same length
+        to write the output into
+        :return: the output as numpy array (a view on out if it was given)
+        """
+        input_ints = _as_int_array(input_)
+        if out is None:
+            out_ints = np.empty(len(input_ints), dtype=input_ints.dtype)
+        else:
+            out_ints = _as_int_array(out)
+            if not len(out_ints) == len(input_ints):
+                raise ValueError("output buffer does not have the size of the input")
+
+        start_positions = np.array([self.get_rotor_positions()], dtype=np.int64)
+        out_ints[:] = self._encode_ints_lockstep(input_ints[None, :], start_positions)[
+            0
+        ]
+        self._advance_rotors(len(input_ints))
+        return out_ints
+
+    def encode_bytes(self, input_, out=None) -> np.ndarray:
+        """
+        Encode characters given as bytes (e.g. ascii text for a str charset)
+        and advance the rotors, like encode_message.
+
+        :param input_: bytes, bytearray, memoryview or uint8 array
+        :param out: optional writable buffer or uint8 array of the same length
+        :return: the output as uint8 array (a view on out if it was given)
+        """
+        if self._is_identity_charset:
+            return self.encode_ints(input_, out=out)
+        if out is None:
+            out = np.empty(len(_as_int_array(input_)), dtype=np.uint8)
+        out_ints = _as_int_array(out)
+        output_ints = self.encode_ints(self.chars_to_ints(input_))
+        out_ints[:] = self._codepoints[output_ints]
+        return out_ints
+
+    def _advance_rotors(self, n_steps: int):
+        # same as the stepping in encode_message, but for all characters at once
+        carryover = n_steps
+        for rot in self.rotors:
+            carryover, rot.position = divmod(
+                int(rot.position) + carryover, rot.n_positions
+            )
+
+    def chars_to_ints(self, text) -> np.ndarray:
+        """
+        :return: the character indices of a message
+        """
+        if isinstance(text, str):
+            codepoints = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+        else:
+            codepoints = _as_int_array(text)
+            if self._is_identity_charset:
+                return codepoints
+        sorted_idxs = np.searchsorted(self._sorted_codepoints, codepoints)
+        sorted_idxs = np.minimum(sorted_idxs, len(self.charset) - 1)
+        if not np.all(self._sorted_codepoints[sorted_idxs] == codepoints):
+            raise KeyError("message contains characters that are not in the charset")
+        return self._sorted_order[sorted_idxs]
+
+    def ints_to_chars(self, ints: np.ndarray):
+        if self._is_bytes_charset:
+            return self._codepoints[ints].astype(np.uint8).tobytes()
+        return self._codepoints[ints].tobytes().decode("utf-32-le")
+
+    def _rotor_position_sequence(
+        self, start_positions: np.ndarray, n_steps: int, first_step: int = 0
+    ):
+        """
+        :param first_step: index of the first character in the message
+        :return: for each rotor an array (n_messages x n_steps) with the rotor position
+        that is used to encode the character at that step
+        """
+        # the first rotor is rotated before each character, the others by the carryover
+        carryover = np.arange(first_step + 1, first_step + n_steps + 1)[None, :]
+        position_sequence = list()
+        for rot_idx, rot in enumerate(self.rotors):
+            carryover, positions = np.divmod(
+                start_positions[:, rot_idx, None] + carryover, rot.n_positions
+            )
+            position_sequence.append(positions)
+        return position_sequence
+
+    def get_odometer_values(self, start_positions: np.ndarray) -> np.ndarray:
+        """
+        The rotors step like an odometer with the first rotor as the lowest digit, so the
+        rotor positions at each character only depend on the odometer value
+        sum_k(position_k * n_chars**k), which increases by one before each character.
+
+        :param start_positions: rotor positions, shape (n_messages x n_rotors)
+        :return: the odometer values of the positions
+        """
+        n_chars = len(self.charset)
+        return np.asarray(start_positions, dtype=np.int64) @ (
+            n_chars ** np.arange(len(self.rotors), dtype=np.int64)
+        )
+
+    def get_odometer_core_table(self) -> np.ndarray:
+        """
+        :return: array (n_chars**n_rotors x n_chars), row v is the permutation of the rotors and
+        the reflector (without the plug board) at the odometer value v,
+        see get_odometer_values. The array is read only.
+        """
+        n_chars = len(self.charset)
+        rotor_positions = np.arange(n_chars)[np.newaxis, :, np.newaxis]
+        # built from the slowest rotor outwards, a rotor only needs one permutation per
+        # position for each state of the slower rotors
+        table = self.reflector.get_permutation()[np.newaxis, :]
+        for rot in reversed(self.rotors):
+            forward, backward = rot.get_permutation_tables()
+            # [slower state, position, input]
+            table = backward[rotor_positions, table[:, forward]]
+            table = table.reshape(-1, n_chars)
+        table = table.astype(np.min_scalar_type(n_chars - 1))
+        table.setflags(write=False)
+        return table
+
+    def _apply_core(self, numbers: np.ndarray, position_sequence: list) -> np.ndarray:
+        """
+        send numbers through the rotors, the reflector and back through the rotors,
+        i.e. everything but the plug board
+        """
+        reflector = self.reflector.get_permutation()
+        tables = [rot.get_permutation_tables() for rot in self.rotors]
+        for (forward, _), positions in zip(tables, position_sequence):
+            numbers = forward[positions, numbers]
+        numbers = reflector[numbers]
+        for (_, backward), positions in zip(
+            reversed(tables), reversed(position_sequence)
+        ):
+            numbers = backward[positions, numbers]
+        return numbers
+
+    def _encode_ints_lockstep(self, input_ints: np.ndarray, start_positions):
+        plug_board = self.plug_board.get_permutation()
+        position_sequence = self._rotor_position_sequence(
+            start_positions, input_ints.shape[1]
+        )
+
+        is_char = input_ints >= 0
+        numbers = plug_board[np.where(is_char, input_ints, 0)]
+        numbers = self._apply_core(numbers, position_sequence)
+        numbers = plug_board[numbers]
+
+        return np.where(is_char, numbers, input_ints)
+
+    def encode_batch(self, messages, start_positions):
+        """
+        Encode many messages in lock-step, each one starting from its own rotor positions.
+        The result is identical to calling set_rotor_positions and encode_message for each
+        message, but the rotor positions of this machine are not changed.
+
+        :param messages: list of strings, or integer array (n_messages x max_length) of
+        character indices where shorter messages are padded at the end with negative values
+        :param start_positions: rotor start positions, shape (n_messages x n_rotors)
+        :return: list of encoded strings if messages is a list of strings,
+        otherwise an integer array of the same shape with the padding kept in place
+        """
+        start_positions = np.asarray(start_positions, dtype=np.int64).reshape(
+            -1, len(self.rotors)
+        )
+        if isinstance(messages, np.ndarray):
+            input_ints = messages.reshape(len(start_positions), -1)
+            return self._encode_ints_lockstep(input_ints, start_positions).astype(
+                messages.dtype, copy=False
+            )
+
+        if not len(messages) == len(start_positions):
+            raise ValueError("need one set of start positions per message")
+        lengths = [len(msg) for msg in messages]
+        input_ints = np.full((len(messages), max(lengths, default=0)), -1)
+        for msg_idx, msg in enumerate(messages):
+            input_ints[msg_idx, : lengths[msg_idx]] = self.chars_to_ints(msg)
+
+        output_ints = self._encode_ints_lockstep(input_ints, start_positions)
+        return [
+            self.ints_to_chars(output_ints[msg_idx, :length])
+            for msg_idx, length in enumerate(lengths)
+        ]
+
+
+class CompiledEnigma:
+    """
+    Enigma with precomputed keystream tables.
+    The stepping of the rotors is deterministic, so the permutation that is applied to
+    the i-th character only depends on the rotor start positions and i.
+    The tables of the rotor/reflector core are computed once per start position and kept
+    in an LRU cache. The plug board is read from the machine on each call,
+    so changing plugs does not invalidate the cache.
+    The rotor wiring and the reflector must not be changed after compilation.
+    """
+
+    def __init__(self, enigma_: Enigma, max_cache_size: int = 128):
+        self.enigma = enigma_
+        self.n_chars = len(enigma_.charset)
+        self.max_cache_size = max_cache_size
+        self._core_cache = collections.OrderedDict()
+        self.n_cache_hits = 0
+        self.n_cache_misses = 0
+
+    def get_core_table(self, start_positions, length: int) -> np.ndarray:
+        """
+        :return: array (length x n_chars), row i is the permutation of the rotors and the
+        reflector (without the plug board) that is applied to the i-th character
+        """
+        key = tuple(int(pos) for pos in start_positions)
+        table = self._core_cache.get(key)
+        if table is not None and len(table) >= length:
+            self.n_cache_hits += 1
+            self._core_cache.move_to_end(key)
+            return table[:length]
+
+        self.n_cache_misses += 1
+        position_sequence = self.enigma._rotor_position_sequence(
+            np.array([key]), length
+        )
+        numbers = np.broadcast_to(np.arange(self.n_chars), (length, self.n_chars))
+        table = self.enigma._apply_core(
+            numbers, [positions.T for positions in position_sequence]
+        )
+        table.setflags(write=False)
+
+        self._core_cache[key] = table
+        self._core_cache.move_to_end(key)
+        while len(self._core_cache) > self.max_cache_size:
+            self._core_cache.popitem(last=False)
+        return table
+
+    def get_permutation_table(self, start_positions, length: int) -> np.ndarray:
+        """
+        :return: array (length x n_chars), row i is the full permutation
+        (plug board, rotors, reflector, rotors, plug board) applied to the i-th character
+        """
+        plug_board = self.enigma.plug_board.get_permutation()
+        return plug_board[self.get_core_table(start_positions, length)[:, plug_board]]
+
+    def encode_ints(self, input_ints: np.ndarray, start_positions) -> np.ndarray:
+        plug_board = self.enigma.plug_board.get_permutation()
+        core_table = self.get_core_table(start_positions, len(input_ints))
+        return plug_board[
+            core_table[np.arange(len(input_ints)), plug_board[input_ints]]
+        ]
+
+    def encode_message(self, input_: str, start_positions) -> str:
+        """
+        same as setting the rotor positions of the machine and calling encode_message,
+        but the rotor positions of the machine are not changed
+        """
+        input_ints = self.enigma.chars_to_ints(input_)
+        return self.enigma.ints_to_chars(self.encode_ints(input_ints, start_positions))
@@ -0,0 +1,110 @@
+import collections
+import contextlib
+import json
+import time
+
+
+class MemoryRecorder:
+    """
+    keeps the records of a run in memory, in the order they were emitted
+    """
+
+    def __init__(self):
+        self.records = list()
+
+    def __call__(self, record: dict):
+        self.records.append(record)
+
+    def get_events(self, event: str) -> list:
+        return [record for record in self.records if record["event"] == event]
+
+
+class JsonlRecorder:
+    """
+    writes each record as one json line, the file is flushed after each record
+    so a running job can be followed with tail -f
+    """
+
+    def __init__(self, path: str, mode: str = "a"):
+        self.out_file = open(path, mode)
+
+    def __call__(self, record: dict):
+        self.out_file.write(json.dumps(record) + "\n")
+        self.out_file.flush()
+
+    def close(self):
+        self.out_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Metrics:
+    """
+    Counters and timings of a cracking run. Events are passed as dicts to the recorder,
+    any callable that takes one dict works, e.g. a MemoryRecorder, a JsonlRecorder or a function.
+    The cracking functions take metrics=None by default and then only check for None once
+    per block, so runs without metrics are not slowed down.
+    """
+
+    def __init__(self, recorder=None):
+        self.recorder = recorder
+        self.counters = collections.Counter()
+        self.timings = collections.defaultdict(float)
+        self.start_time = time.perf_counter()
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] += n
+
+    def add_time(self, name: str, seconds: float):
+        self.timings[name] += seconds
+
+    def add(self, counters: dict):
+        """
+        :param counters: counts, and timings with names ending in _seconds
+        """
+        for name, value in counters.items():
+            if name.endswith("_seconds"):
+                self.add_time(name[: -len("_seconds")], value)
+            else:
+                self.count(name, value)
+
+    @contextlib.contextmanager
+    def timer(self, name: str):
+        tick = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] += time.perf_counter() - tick
+
+    def emit(self, event: str, **fields):
+        """
+        :param fields: json serializable values of the event, the event name and the
+        seconds since the start of the run are added
+        """
+        if self.recorder is None:
+            return
+        record = {
+            "event": event,
+            "elapsed_seconds": time.perf_counter() - self.start_time,
+        }
+        record.update(fields)
+        self.recorder(record)
+
+    def summary(self) -> dict:
+        """
+        :return: all counters and timings, the seconds since the start of the run
+        and the candidates decrypted per second
+        """
+        summary = dict(self.counters)
+        summary.update(
+            {f"{name}_seconds": value for name, value in self.timings.items()}
+        )
+        summary["elapsed_seconds"] = time.perf_counter() - self.start_time
+        summary["candidates_per_second"] = (
+            self.counters["n_candidates"] / summary["elapsed_seconds"]
+        )
+        return summary
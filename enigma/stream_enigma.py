@@ -0,0 +1,128 @@
+import argparse
+import io
+import mmap
+import string
+
+import enigma
+
+
+def _iter_file_chunks(file_, chunk_size: int):
+    """
+    read a file in chunks of chunk_size. Binary files on disk are memory mapped,
+    pages that have been read are released again so the resident memory stays flat.
+    """
+    try:
+        fileno = file_.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        fileno = None
+
+    if fileno is not None and isinstance(file_.read(0), bytes):
+        start = file_.tell()
+        try:
+            mapping = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can not be mapped
+            return
+        with mapping:
+            released = 0
+            for chunk_start in range(start, len(mapping), chunk_size):
+                yield mapping[chunk_start : chunk_start + chunk_size]
+                done = min(chunk_start + chunk_size, len(mapping))
+                done -= done % mmap.PAGESIZE
+                if hasattr(mapping, "madvise") and done > released:
+                    mapping.madvise(mmap.MADV_DONTNEED, released, done - released)
+                    released = done
+        return
+
+    while True:
+        chunk = file_.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+class EnigmaStreamEncoder:
+    """
+    Encode an input of arbitrary size chunk by chunk.
+    The rotor positions are carried over from one chunk to the next,
+    so the concatenated output is identical to encoding the concatenated input in one call.
+    """
+
+    def __init__(self, enigma_: enigma.Enigma, chunk_size: int = 2**20):
+        self.enigma = enigma_
+        self.chunk_size = chunk_size
+
+    def encode_chunk(self, chunk):
+        """
+        :param chunk: str, or a bytes-like object with one byte per character
+        :return: encoded chunk, str for str input and bytes otherwise
+        """
+        if isinstance(chunk, str):
+            return self.enigma.encode_message(chunk)
+        return self.enigma.encode_bytes(chunk).tobytes()
+
+    def iter_encode(self, source):
+        """
+        :param source: file object (text or binary) or iterable of str / bytes chunks.
+        Chunks larger than chunk_size are split so that memory use stays bounded.
+        :return: generator of encoded chunks
+        """
+        if hasattr(source, "read"):
+            chunks = _iter_file_chunks(source, self.chunk_size)
+        else:
+            chunks = source
+
+        for chunk in chunks:
+            for chunk_start in range(0, len(chunk), self.chunk_size):
+                yield self.encode_chunk(
+                    chunk[chunk_start : chunk_start + self.chunk_size]
+                )
+
+    def encode_file(self, in_path: str, out_path: str):
+        with open(in_path, "rb") as in_file, open(out_path, "wb") as out_file:
+            for encoded_chunk in self.iter_encode(in_file):
+                out_file.write(encoded_chunk)
+
+
+CHARSETS = {
+    "upper": string.ascii_uppercase,
+    "lower": string.ascii_lowercase,
+    "bytes": enigma.BYTE_CHARSET,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Encode a file with an enigma machine in constant memory. "
+        "Every byte of the input is one character, so text files must only contain "
+        "characters of the charset unless the byte charset is used."
+    )
+    parser.add_argument("input_file")
+    parser.add_argument("output_file")
+    parser.add_argument("--charset", choices=list(CHARSETS), default="upper")
+    parser.add_argument("--rotor-seeds", type=int, nargs="+", default=[21, 32, 34])
+    parser.add_argument("--rotor-positions", type=int, nargs="+", default=None)
+    parser.add_argument("--n-plugs", type=int, default=10)
+    parser.add_argument("--plugboard-seed", type=int, default=41)
+    parser.add_argument("--reflector-seed", type=int, default=3)
+    parser.add_argument("--chunk-size", type=int, default=2**20)
+    args = parser.parse_args()
+
+    charset = CHARSETS[args.charset]
+    n_chars = len(charset)
+    rotors = [enigma.Rotor(n_positions=n_chars, seed=seed) for seed in args.rotor_seeds]
+    plugboard = enigma.Swapper(n_positions=n_chars)
+    plugboard.assign_random_swaps(n_swaps=args.n_plugs, seed=args.plugboard_seed)
+    reflector = enigma.Swapper(n_positions=n_chars)
+    reflector.assign_random_swaps(n_swaps=n_chars // 2, seed=args.reflector_seed)
+    encoder = enigma.Enigma(rotors, plugboard, reflector, charset=charset)
+    if args.rotor_positions is not None:
+        encoder.set_rotor_positions(args.rotor_positions)
+
+    EnigmaStreamEncoder(encoder, chunk_size=args.chunk_size).encode_file(
+        args.input_file, args.output_file
+    )
+
+
+if __name__ == "__main__":
+    main()
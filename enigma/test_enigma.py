@@ -1,10 +1,20 @@
+import copy
 import dill
+import io
+import json
+import os
 import string
+import tempfile
+import numpy as np
 
 import unittest as ut
 
 import enigma
+import bulk_enigma
 import crack_enigma
+import crib_enigma
+import metrics_enigma
+import stream_enigma
 
 
 def string_compare(s1: string, s2: string) -> float:
@@ -32,6 +42,28 @@ class UtilsTest(ut.TestCase):
         for i, s in zip(it, shouldbe):
             self.assertListEqual(i, s)
 
+    def test_multiindexiterator_ranges(self):
+        full = list(crack_enigma.MultiindexIiterator(3, 4))
+        self.assertEqual(len(full), 64)
+        self.assertListEqual(full[-1], [3, 3, 3])
+
+        for start, stop, step in [(0, None, 1), (5, 60, 7), (17, 18, 1), (3, 64, 16)]:
+            it = crack_enigma.MultiindexIiterator(
+                3, 4, start=start, stop=stop, step=step
+            )
+            expected = full[start:stop:step]
+            self.assertEqual(len(it), len(expected))
+            self.assertListEqual(list(it), expected)
+            # iterating again starts from the beginning
+            self.assertListEqual(list(it), expected)
+
+            blocks = list(it.iter_blocks(5))
+            self.assertListEqual(np.concatenate(blocks).tolist(), expected)
+
+        it = crack_enigma.MultiindexIiterator(3, 4)[10:50:3][2:]
+        self.assertListEqual(list(it), full[10:50:3][2:])
+        self.assertListEqual(crack_enigma.MultiindexIiterator(3, 4)[-1], [3, 3, 3])
+
     def test_string_compare(self):
         a = "abcdff"
         b = "abefff"
@@ -79,6 +111,47 @@ class SwapperTest(ut.TestCase):
         self.assertEqual(plugboard.get_output(7), 7)
         self.assertEqual(plugboard.get_output(8), 8)
 
+    def test_set_swap_dict(self):
+        # the state only depends on the swaps, not on the history
+        swapper_1 = enigma.Swapper(10)
+        swapper_1.assign_random_swaps(n_swaps=3, seed=1)
+        swapper_1.swap_dict = {2: 7, 7: 2}
+        swapper_2 = enigma.Swapper(10)
+        swapper_2.swap_dict = {2: 7, 7: 2}
+        rng_1 = np.random.default_rng(5)
+        rng_2 = np.random.default_rng(5)
+        for _ in range(10):
+            self.assertEqual(
+                swapper_1.choose_free_position(rng_1),
+                swapper_2.choose_free_position(rng_2),
+            )
+
+    def test_free_and_swapped_positions(self):
+        plugboard = enigma.Swapper(n_positions=10)
+        plugboard.assign_random_swaps(n_swaps=3, seed=1)
+        rng = np.random.default_rng(0)
+        for _ in range(50):
+            move_from = plugboard.choose_swapped_position(rng)
+            move_to = plugboard.choose_free_position(rng)
+            plugboard.move_one_swap_side(move_from, move_to)
+
+            swapped = plugboard.get_swapped_positions()
+            self.assertEqual(len(swapped), 6)
+            self.assertSetEqual(swapped, set(plugboard.swap_dict))
+            self.assertSetEqual(
+                plugboard.get_free_positions(), set(range(10)) - swapped
+            )
+            permutation = plugboard.get_permutation()
+            self.assertTrue(np.all(permutation[permutation] == np.arange(10)))
+
+        copied = copy.deepcopy(plugboard)
+        self.assertDictEqual(copied.swap_dict, plugboard.swap_dict)
+
+        # the swap dict is a copy, changes only apply when it is assigned
+        swap_dict = plugboard.swap_dict
+        swap_dict.pop(next(iter(swap_dict)))
+        self.assertDictEqual(copied.swap_dict, plugboard.swap_dict)
+
 
 class RotorTest(ut.TestCase):
     def test_rotor(self):
@@ -98,6 +171,53 @@ class RotorTest(ut.TestCase):
         out2 = rotor.get_permuted_output_forward(in_)
         self.assertNotEqual(out, out2)
 
+    def test_rotor_tables(self):
+        rotor = enigma.Rotor(n_positions=10, seed=42)
+        forward, backward = rotor.get_permutation_tables()
+        for pos in range(10):
+            rotor.set_position(pos)
+            for in_ in range(10):
+                out = rotor.get_permuted_output_forward(in_)
+                self.assertEqual(forward[pos, in_], out)
+                self.assertEqual(backward[pos, out], in_)
+
+    def test_rotor_wiring_is_shared(self):
+        rotor = enigma.Rotor(n_positions=10, seed=42)
+        rotor.set_position(3)
+        copied = copy.deepcopy(rotor)
+        self.assertEqual(copied.position, 3)
+        self.assertIs(copied.forward_adds, rotor.forward_adds)
+        self.assertIs(
+            enigma.Rotor(n_positions=10, seed=42).get_permutation_tables()[0],
+            rotor.get_permutation_tables()[0],
+        )
+
+
+def encode_message_stepwise(encoder: enigma.Enigma, input_: str) -> str:
+    # reference implementation that walks every character through the machine
+    output = list()
+    for char in input_:
+        number = encoder.plug_board.get_output(encoder.char_to_number_map[char])
+        rot_step = 1
+        for rot in encoder.rotors:
+            rot_step = rot.rotate_return_carryover(rot_step)
+            number = rot.get_permuted_output_forward(number)
+        number = encoder.reflector.get_output(number)
+        for rot in reversed(encoder.rotors):
+            number = rot.get_permuted_output_backward(number)
+        output.append(encoder.charset[encoder.plug_board.get_output(number)])
+    return "".join(output)
+
+
+def make_encoder(charset: str) -> enigma.Enigma:
+    n_chars = len(charset)
+    plugboard = enigma.Swapper(n_positions=n_chars)
+    plugboard.assign_random_swaps(n_swaps=10, seed=41)
+    rotors = [enigma.Rotor(n_positions=n_chars, seed=seed) for seed in [1, 2]]
+    reflector = enigma.Swapper(n_positions=n_chars)
+    reflector.assign_random_swaps(n_swaps=n_chars // 2, seed=3)
+    return enigma.Enigma(rotors, plugboard, reflector, charset=charset)
+
 
 class EnigmaTest(ut.TestCase):
     charset = string.ascii_lowercase
@@ -127,6 +247,282 @@ class EnigmaTest(ut.TestCase):
         decoded_message = encoder.encode_message(encoded_message)
         self.assertEqual(decoded_message, self.test_message)
 
+    def test_encode_matches_stepwise(self):
+        encoder = self.setup_encoder()
+        encoder.set_rotor_positions([20, 25])
+        expected = encode_message_stepwise(encoder, self.test_message)
+        expected_positions = encoder.get_rotor_positions()
+
+        encoder.set_rotor_positions([20, 25])
+        self.assertEqual(encoder.encode_message(self.test_message), expected)
+        self.assertListEqual(encoder.get_rotor_positions(), expected_positions)
+
+    def test_encode_ints_and_bytes(self):
+        encoder = self.setup_encoder()
+        encoder.set_rotor_positions([4, 5])
+        expected = encoder.encode_message(self.test_message)
+
+        # ascii bytes into a caller supplied buffer, in two pieces
+        out = bytearray(len(self.test_message))
+        data = memoryview(self.test_message.encode())
+        encoder.set_rotor_positions([4, 5])
+        encoder.encode_bytes(data[:30], out=memoryview(out)[:30])
+        encoder.encode_bytes(data[30:], out=memoryview(out)[30:])
+        self.assertEqual(out.decode(), expected)
+
+        # character indices
+        input_ints = np.array(
+            [encoder.char_to_number_map[c] for c in self.test_message]
+        )
+        encoder.set_rotor_positions([4, 5])
+        output_ints = encoder.encode_ints(input_ints)
+        self.assertEqual("".join(self.charset[i] for i in output_ints), expected)
+
+    def test_byte_charset(self):
+        n_chars = len(enigma.BYTE_CHARSET)
+        plugboard = enigma.Swapper(n_positions=n_chars)
+        plugboard.assign_random_swaps(n_swaps=50, seed=41)
+        rotors = [enigma.Rotor(n_positions=n_chars, seed=seed) for seed in [1, 2]]
+        reflector = enigma.Swapper(n_positions=n_chars)
+        reflector.assign_random_swaps(n_swaps=n_chars // 2, seed=3)
+        encoder = enigma.Enigma(rotors, plugboard, reflector, enigma.BYTE_CHARSET)
+
+        payload = bytes(
+            np.random.default_rng(0).integers(0, 256, size=1000, dtype=np.uint8)
+        )
+        encoder.set_rotor_positions([255, 17])
+        encoded = encoder.encode_message(payload)
+        self.assertIsInstance(encoded, bytes)
+        self.assertNotEqual(encoded, payload)
+
+        decoded = np.empty(len(payload), dtype=np.uint8)
+        encoder.set_rotor_positions([255, 17])
+        encoder.encode_ints(encoded, out=decoded)
+        self.assertEqual(decoded.tobytes(), payload)
+
+    def setup_encoder(self):
+        return make_encoder(self.charset)
+
+    def test_encode_batch(self):
+        encoder = self.setup_encoder()
+        # different lengths so the carryover of the first rotor is tested as well
+        messages = [self.test_message[:length] for length in [0, 5, 30, 72]]
+        start_positions = [[0, 0], [25, 3], [20, 25], [7, 12]]
+
+        expected = list()
+        for msg, pos in zip(messages, start_positions):
+            encoder.set_rotor_positions(pos)
+            expected.append(encoder.encode_message(msg))
+
+        encoder.set_rotor_positions([1, 1])
+        self.assertListEqual(encoder.encode_batch(messages, start_positions), expected)
+        # the batch does not touch the state of the machine
+        self.assertListEqual(encoder.get_rotor_positions(), [1, 1])
+
+        # integer arrays with padding
+        padded = np.full((len(messages), len(self.test_message)), -1)
+        for msg_idx, msg in enumerate(messages):
+            padded[msg_idx, : len(msg)] = [encoder.char_to_number_map[c] for c in msg]
+        encoded = encoder.encode_batch(padded, start_positions)
+        self.assertEqual(encoded.shape, padded.shape)
+        for msg_idx, msg in enumerate(expected):
+            self.assertEqual(
+                "".join(self.charset[i] for i in encoded[msg_idx, : len(msg)]), msg
+            )
+            self.assertTrue(np.all(encoded[msg_idx, len(msg) :] == -1))
+
+    def test_compiled_enigma(self):
+        encoder = self.setup_encoder()
+        compiled = enigma.CompiledEnigma(encoder, max_cache_size=2)
+        start_positions = [25, 7]
+
+        encoder.set_rotor_positions(start_positions)
+        expected = encoder.encode_message(self.test_message)
+        encoder.set_rotor_positions([0, 0])
+        self.assertEqual(
+            compiled.encode_message(self.test_message, start_positions), expected
+        )
+        self.assertListEqual(encoder.get_rotor_positions(), [0, 0])
+
+        # shorter messages and plug board changes reuse the table
+        plug_end = list(encoder.plug_board.swap_dict)[0]
+        encoder.plug_board.unset_element_swap(
+            plug_end, encoder.plug_board.get_output(plug_end)
+        )
+        encoder.set_rotor_positions(start_positions)
+        expected = encoder.encode_message(self.test_message[:10])
+        self.assertEqual(
+            compiled.encode_message(self.test_message[:10], start_positions), expected
+        )
+        self.assertEqual(compiled.n_cache_misses, 1)
+        self.assertEqual(compiled.n_cache_hits, 1)
+
+        # each row of the full table is a permutation
+        table = compiled.get_permutation_table(start_positions, 30)
+        self.assertEqual(table.shape, (30, self.n_chars))
+        self.assertTrue(np.all(np.sort(table, axis=1) == np.arange(self.n_chars)))
+
+        # least recently used start positions are dropped
+        compiled.get_core_table([1, 1], 5)
+        compiled.get_core_table([2, 2], 5)
+        compiled.get_core_table(start_positions, 5)
+        self.assertEqual(compiled.n_cache_misses, 4)
+
+    def test_odometer_core_table(self):
+        n_chars = len(self.charset)
+        reflector = enigma.Swapper(n_positions=n_chars)
+        reflector.assign_random_swaps(n_swaps=n_chars // 2, seed=3)
+        plug_board = enigma.Swapper(n_positions=n_chars)
+        plug_board.assign_random_swaps(n_swaps=4, seed=5)
+        messages = 3 * [self.test_message[:60]]
+        for n_rotors in [1, 2, 3]:
+            rotors = [
+                enigma.Rotor(n_positions=n_chars, seed=seed) for seed in range(n_rotors)
+            ]
+            encoder = enigma.Enigma(rotors, plug_board, reflector, self.charset)
+            table = encoder.get_odometer_core_table()
+            self.assertEqual(table.shape, (n_chars**n_rotors, n_chars))
+
+            start_positions = np.array(
+                [n_rotors * [0], n_rotors * [25], [7, 12, 3][:n_rotors]]
+            )
+            values = encoder.get_odometer_values(start_positions)[:, np.newaxis]
+            steps = np.arange(1, len(messages[0]) + 1)[np.newaxis, :]
+            plug = plug_board.get_permutation()
+            msg_ints = np.array([encoder.chars_to_ints(msg) for msg in messages])
+            decoded_ints = plug[
+                np.take_along_axis(
+                    table[(values + steps) % len(table)],
+                    plug[msg_ints][:, :, np.newaxis],
+                    axis=2,
+                )[:, :, 0]
+            ]
+            expected = encoder.encode_batch(messages, start_positions.tolist())
+            self.assertListEqual(
+                ["".join(self.charset[i] for i in row) for row in decoded_ints],
+                expected,
+            )
+
+
+class StreamEnigmaTest(ut.TestCase):
+    charset = string.ascii_lowercase
+    test_message = 40 * EnigmaTest.test_message
+
+    def setup_encoder(self):
+        encoder = make_encoder(self.charset)
+        encoder.set_rotor_positions([3, 9])
+        return encoder
+
+    def test_stream_equals_single_call(self):
+        expected = self.setup_encoder().encode_message(self.test_message)
+
+        # iterable of uneven str chunks
+        stream_encoder = stream_enigma.EnigmaStreamEncoder(
+            self.setup_encoder(), chunk_size=100
+        )
+        chunks = [
+            self.test_message[i : i + 77] for i in range(0, len(self.test_message), 77)
+        ]
+        chunks.insert(3, "")
+        self.assertEqual("".join(stream_encoder.iter_encode(chunks)), expected)
+
+        # binary file object without a file descriptor
+        stream_encoder = stream_enigma.EnigmaStreamEncoder(
+            self.setup_encoder(), chunk_size=100
+        )
+        in_file = io.BytesIO(self.test_message.encode())
+        encoded = b"".join(stream_encoder.iter_encode(in_file))
+        self.assertEqual(encoded.decode(), expected)
+
+    def test_encode_file(self):
+        expected = self.setup_encoder().encode_message(self.test_message)
+        stream_encoder = stream_enigma.EnigmaStreamEncoder(
+            self.setup_encoder(), chunk_size=1000
+        )
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            in_path = os.path.join(tmp_dir, "in.txt")
+            out_path = os.path.join(tmp_dir, "out.txt")
+            with open(in_path, "w") as in_file:
+                in_file.write(self.test_message)
+            stream_encoder.encode_file(in_path, out_path)
+            with open(out_path, "r") as out_file:
+                self.assertEqual(out_file.read(), expected)
+
+
+class BulkEnigmaTest(ut.TestCase):
+    charset = string.ascii_lowercase
+
+    def test_bulk_results_in_order(self):
+        encoder = make_encoder(self.charset)
+        rng = np.random.default_rng(1)
+        jobs = [
+            (EnigmaTest.test_message[: rng.integers(1, 72)], rng.integers(0, 26, 2))
+            for _ in range(50)
+        ]
+        expected = list()
+        for msg, pos in jobs:
+            encoder.set_rotor_positions(pos)
+            expected.append(encoder.encode_message(msg))
+
+        # pool of workers
+        bulk_encoder = bulk_enigma.BulkEncoder(
+            encoder, n_workers=2, chunk_size=7, min_n_jobs_for_pool=10
+        )
+        self.assertListEqual(bulk_encoder.map(iter(jobs)), expected)
+
+        # in process fallback
+        bulk_encoder = bulk_enigma.BulkEncoder(encoder, min_n_jobs_for_pool=100)
+        self.assertListEqual(bulk_encoder.map(jobs), expected)
+
+
+class DenseScorerTest(ut.TestCase):
+    def test_dense_scorer_matches_group_scorer(self):
+        charset = string.ascii_lowercase
+        rng = np.random.default_rng(5)
+        texts = rng.integers(0, len(charset), size=(20, 50))
+        # some real language so that known groups are hit
+        texts[0] = [charset.index(c) for c in EnigmaTest.test_message[:50]]
+
+        with open("./language_stats.dill", "rb") as read_file:
+            language_stats = dill.load(read_file)
+        for groupname in ["diads", "triads", "quads"]:
+            scorer = crack_enigma.GroupLikelihoodScorer(language_stats[groupname])
+            dense_scorer = crack_enigma.DenseGroupLikelihoodScorer(
+                language_stats[groupname], charset=charset
+            )
+            expected = [
+                scorer.score_text("".join(charset[i] for i in text)) for text in texts
+            ]
+            np.testing.assert_allclose(dense_scorer.score_batch(texts), expected)
+            self.assertAlmostEqual(dense_scorer.score_ints(texts[0]), expected[0])
+            self.assertAlmostEqual(
+                dense_scorer.score_text(EnigmaTest.test_message),
+                scorer.score_text(EnigmaTest.test_message),
+            )
+
+    def test_large_tables_stay_sparse(self):
+        charset = string.printable
+        scorer = crack_enigma.GroupLikelihoodScorer({"test": -1.0, "ests": -2.0})
+        # 100**4 groups, the dict scorer is used
+        self.assertIs(crack_enigma.as_dense_scorer(scorer, charset), scorer)
+
+        n_chars = len(charset)
+        reflector = enigma.Swapper(n_positions=n_chars)
+        reflector.assign_random_swaps(n_swaps=n_chars // 2, seed=3)
+        rotors = [enigma.Rotor(n_positions=n_chars, seed=0)]
+        encoder = enigma.Enigma(rotors, enigma.Swapper(n_chars), reflector, charset)
+        encoder.set_rotor_positions([7])
+        encrypted_message = encoder.encode_message("tests tests tests")
+        decoded_msg, best_pos, _ = crack_enigma.decode_message_successive_best(
+            encrypted_message, rotors, 0, reflector, scorer, charset, disable_tqdm=True
+        )
+        self.assertEqual(decoded_msg, "tests tests tests")
+        self.assertListEqual(list(best_pos), [7])
+
+        # the sweeps need a scorer for batches
+        with self.assertRaises(ValueError):
+            crack_enigma.sweep_rotor_positions(encrypted_message, encoder, scorer)
+
 
 class CrackEnigmaCommon:
     def setup_enigma_and_msg(self, len_msg, n_rotors, n_plugs):
@@ -175,7 +571,405 @@ class CrackEnigmaCommon:
         encoder.set_rotor_positions(n_rotors * [0])
 
 
+class PlugboardCrackingStateTest(ut.TestCase, CrackEnigmaCommon):
+    def test_incremental_updates(self):
+        self.setup_enigma_and_msg(300, 2, 0)
+        with open("./language_stats.dill", "rb") as read_file:
+            group_likelihood = dill.load(read_file)["quads"]
+        scorer = crack_enigma.DenseGroupLikelihoodScorer(group_likelihood, self.charset)
+        plugboard = enigma.Swapper(self.n_chars)
+        plugboard.assign_random_swaps(n_swaps=4, seed=2)
+        compiled = enigma.CompiledEnigma(
+            enigma.Enigma(self.rotors, plugboard, self.reflector, self.charset)
+        )
+        state = crack_enigma.PlugboardCrackingState(
+            compiled, self.encrypted_message, scorer, [3, 8]
+        )
+
+        def check():
+            decrypted = compiled.encode_message(self.encrypted_message, [3, 8])
+            self.assertEqual(state.get_decrypted_message(), decrypted)
+            self.assertAlmostEqual(state.score, scorer.score_text(decrypted))
+
+        rng = np.random.default_rng(3)
+        for i in range(100):
+            before = (plugboard.swap_dict, state.score)
+            if i % 3 == 0:
+                first, second = rng.choice(self.n_chars, size=2, replace=False)
+                state.set_element_swap(first, second)
+            else:
+                state.move_one_swap_side(
+                    plugboard.choose_swapped_position(rng),
+                    plugboard.choose_free_position(rng),
+                )
+            check()
+            if rng.random() < 0.5:
+                state.undo()
+                self.assertEqual((plugboard.swap_dict, state.score), before)
+                check()
+        self.assertLess(state.n_updated_positions, 100 * 300)
+
+
+class InterruptedScorer(crack_enigma.DenseGroupLikelihoodScorer):
+    """
+    raises KeyboardInterrupt after n_batches calls of score_batch, to interrupt a run
+    """
+
+    n_batches = None
+
+    def score_batch(self, texts: np.ndarray) -> np.ndarray:
+        if self.n_batches is not None:
+            if self.n_batches == 0:
+                raise KeyboardInterrupt
+            self.n_batches -= 1
+        return super().score_batch(texts)
+
+
 class CrackEnigmaSuccessiveBestTest(ut.TestCase, CrackEnigmaCommon):
+    def test_rotor_sweep_matches_loop(self):
+        self.setup_enigma_and_msg(60, 2, 0)
+        with open("./language_stats.dill", "rb") as read_file:
+            group_likelihood = dill.load(read_file)["triads"]
+        scorer = crack_enigma.GroupLikelihoodScorer(group_likelihood)
+        decoder_enigma = enigma.Enigma(
+            self.rotors, enigma.Swapper(self.n_chars), self.reflector, self.charset
+        )
+
+        loop_results = list()
+        for pos in crack_enigma.MultiindexIiterator(2, self.n_chars):
+            decoder_enigma.set_rotor_positions(pos)
+            score = scorer.score_text(
+                decoder_enigma.encode_message(self.encrypted_message)
+            )
+            loop_results.append((score, pos))
+        loop_results.sort(key=lambda result: -result[0])
+
+        sweep_results = crack_enigma.sweep_rotor_positions(
+            self.encrypted_message, decoder_enigma, scorer, block_size=100, top_k=20
+        )
+        self.assertListEqual(sweep_results, loop_results[:20])
+        self.assertListEqual(sweep_results[0][1], self.rotor_positions)
+
+        # sharded over processes
+        sweep_results = crack_enigma.sweep_rotor_positions(
+            self.encrypted_message, decoder_enigma, scorer, top_k=20, n_workers=3
+        )
+        self.assertListEqual(sweep_results, loop_results[:20])
+
+    def test_odometer_table_sweep(self):
+        self.setup_enigma_and_msg(80, 3, 0)
+        with open("./language_stats.dill", "rb") as read_file:
+            group_likelihood = dill.load(read_file)["triads"]
+        scorer = crack_enigma.DenseGroupLikelihoodScorer(group_likelihood)
+        decoder_enigma = enigma.Enigma(
+            self.rotors, enigma.Swapper(self.n_chars), self.reflector, self.charset
+        )
+        encrypted_ints = decoder_enigma.chars_to_ints(self.encrypted_message)
+        odometer_table = decoder_enigma.get_odometer_core_table()
+        for bounded in [False, True]:
+            args = (decoder_enigma, encrypted_ints, scorer, 1000, 3000, 256, 10)
+            self.assertEqual(
+                crack_enigma._sweep_rotor_range(
+                    *args, bounded=bounded, odometer_table=odometer_table
+                )[0],
+                crack_enigma._sweep_rotor_range(*args, bounded=bounded)[0],
+            )
+
+    def test_prefilter_recall(self):
+        # the true rotor positions of the fixtures survive the index of coincidence prefilter
+        prefilter_fraction = 0.05
+        n_kept = 0
+        fixtures = [(200, 1, 0), (60, 2, 0), (100, 2, 2), (100, 2, 5), (100, 3, 2)]
+        for len_msg, n_rotors, n_plugs in fixtures:
+            self.setup_enigma_and_msg(len_msg, n_rotors, n_plugs)
+            decoder_enigma = enigma.Enigma(
+                self.rotors, enigma.Swapper(self.n_chars), self.reflector, self.charset
+            )
+            n_prefiltered = int(np.ceil(prefilter_fraction * self.n_chars**n_rotors))
+            prefilter_results = crack_enigma.sweep_rotor_positions(
+                self.encrypted_message,
+                decoder_enigma,
+                crack_enigma.IndexOfCoincidenceScorer(self.charset),
+                top_k=n_prefiltered,
+            )
+            n_kept += self.rotor_positions in [pos for _, pos in prefilter_results]
+        self.assertEqual(n_kept / len(fixtures), 1.0)
+
+        with open("./language_stats.dill", "rb") as read_file:
+            group_likelihood = dill.load(read_file)["triads"]
+        scorer = crack_enigma.GroupLikelihoodScorer(group_likelihood)
+        self.setup_enigma_and_msg(100, 2, 2)
+        decoder_enigma = enigma.Enigma(
+            self.rotors, enigma.Swapper(self.n_chars), self.reflector, self.charset
+        )
+        full_results = crack_enigma.sweep_rotor_positions(
+            self.encrypted_message, decoder_enigma, scorer, top_k=5
+        )
+        for n_workers in [1, 2]:
+            prefiltered_results = crack_enigma.sweep_rotor_positions(
+                self.encrypted_message,
+                decoder_enigma,
+                scorer,
+                block_size=10,
+                top_k=5,
+                n_workers=n_workers,
+                prefilter_fraction=prefilter_fraction,
+            )
+            self.assertListEqual(prefiltered_results[:1], full_results[:1])
+
+        decrypted_msg, decoded_pos, _ = crack_enigma.decode_message_successive_best(
+            self.encrypted_message,
+            self.rotors,
+            2,
+            self.reflector,
+            scorer,
+            charset=self.charset,
+            disable_tqdm=True,
+            prefilter_fraction=prefilter_fraction,
+        )
+        self.assertListEqual(decoded_pos, self.rotor_positions)
+        self.assertGreater(string_compare(decrypted_msg, self.message), 0.9)
+
+    def test_bounded_scoring(self):
+        n_plugs = 2
+        self.setup_enigma_and_msg(200, 3, n_plugs)
+        with open("./language_stats.dill", "rb") as read_file:
+            group_likelihood = dill.load(read_file)["quads"]
+        scorer = crack_enigma.GroupLikelihoodScorer(group_likelihood)
+        decoder_enigma = enigma.Enigma(
+            self.rotors, enigma.Swapper(self.n_chars), self.reflector, self.charset
+        )
+
+        sweep_results = crack_enigma.sweep_rotor_positions(
+            self.encrypted_message, decoder_enigma, scorer, block_size=500, top_k=3
+        )
+        stats = dict()
+        bounded_results = crack_enigma.sweep_rotor_positions(
+            self.encrypted_message,
+            decoder_enigma,
+            scorer,
+            block_size=500,
+            top_k=3,
+            bounded=True,
+            stats=stats,
+        )
+        self.assertListEqual(bounded_results, sweep_results)
+        self.assertEqual(stats["n_chars_total"], self.n_chars**3 * 200)
+        self.assertGreater(stats["n_chars_saved"], 0)
+
+        results = list()
+        for bounded in [False, True]:
+            stats = dict()
+            decrypted_msg, decoded_pos, plugboard = (
+                crack_enigma.decode_message_successive_best(
+                    self.encrypted_message,
+                    self.rotors,
+                    n_plugs,
+                    self.reflector,
+                    scorer,
+                    charset=self.charset,
+                    disable_tqdm=True,
+                    bounded=bounded,
+                    stats=stats,
+                )
+            )
+            results.append((decrypted_msg, decoded_pos, plugboard.swap_dict))
+        self.assertEqual(results[0], results[1])
+        self.assertGreater(stats["n_chars_saved"], 0)
+
+    def test_plug_candidates_match_loop(self):
+        self.setup_enigma_and_msg(80, 2, 3)
+        with open("./language_stats.dill", "rb") as read_file:
+            group_likelihood = dill.load(read_file)["triads"]
+        scorer = crack_enigma.GroupLikelihoodScorer(group_likelihood)
+        dense_scorer = crack_enigma.DenseGroupLikelihoodScorer.from_group_scorer(
+            scorer, self.charset
+        )
+        plugboard = enigma.Swapper(self.n_chars)
+        plugboard.set_element_swap(0, 5)
+        compiled_enigma = enigma.CompiledEnigma(
+            enigma.Enigma(self.rotors, plugboard, self.reflector, self.charset)
+        )
+        available_plug_positions = sorted(plugboard.get_free_positions())
+
+        # all ordered pairs, first best wins
+        highscore = -np.inf
+        for first in available_plug_positions:
+            for second in available_plug_positions:
+                if first == second:
+                    continue
+                plugboard.set_element_swap(first, second)
+                score = crack_enigma._decrypt_and_score(
+                    compiled_enigma,
+                    self.encrypted_message,
+                    scorer,
+                    self.rotor_positions,
+                )
+                plugboard.unset_element_swap(first, second)
+                if score > highscore:
+                    highscore = score
+                    best_swap = (first, second)
+
+        candidates = crack_enigma._plug_candidates(available_plug_positions)
+        self.assertEqual(len(candidates), 24 * 23 // 2)
+        scores, _ = crack_enigma._score_plug_candidates(
+            compiled_enigma,
+            self.encrypted_message,
+            dense_scorer,
+            self.rotor_positions,
+            candidates,
+            block_size=50,
+        )
+        for (first, second), score in zip(candidates[::37], scores[::37]):
+            plugboard.set_element_swap(first, second)
+            self.assertEqual(
+                score,
+                crack_enigma._decrypt_and_score(
+                    compiled_enigma,
+                    self.encrypted_message,
+                    dense_scorer,
+                    self.rotor_positions,
+                ),
+            )
+            plugboard.unset_element_swap(first, second)
+
+        for plug_scorer in [scorer, dense_scorer]:
+            [(score, lin_idx)], _ = crack_enigma._best_plug_in_range(
+                compiled_enigma,
+                self.encrypted_message,
+                plug_scorer,
+                self.rotor_positions,
+                candidates,
+                0,
+                len(candidates),
+            )
+            self.assertEqual(candidates[lin_idx], best_swap)
+            self.assertAlmostEqual(score, highscore)
+        self.assertDictEqual(plugboard.swap_dict, {0: 5, 5: 0})
+
+    def test_resume_sweep(self):
+        # the plugs are part of the checkpointed run
+        self.setup_enigma_and_msg(100, 2, 2)
+        with open("./language_stats.dill", "rb") as read_file:
+            group_likelihood = dill.load(read_file)["triads"]
+        scorer = InterruptedScorer.from_group_scorer(
+            crack_enigma.GroupLikelihoodScorer(group_likelihood), self.charset
+        )
+        decoder_enigma = enigma.Enigma(
+            self.rotors, self.plugboard, self.reflector, charset=self.charset
+        )
+
+        expected = crack_enigma.sweep_rotor_positions(
+            self.encrypted_message, decoder_enigma, scorer, block_size=16, top_k=5
+        )
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            checkpoint_path = os.path.join(tmp_dir, "sweep.json")
+            scorer.n_batches = 20
+            with self.assertRaises(KeyboardInterrupt):
+                crack_enigma.sweep_rotor_positions(
+                    self.encrypted_message,
+                    decoder_enigma,
+                    scorer,
+                    block_size=16,
+                    top_k=5,
+                    checkpoint_path=checkpoint_path,
+                    checkpoint_interval=0,
+                )
+            scorer.n_batches = None
+            resumed = crack_enigma.sweep_rotor_positions(
+                self.encrypted_message,
+                decoder_enigma,
+                scorer,
+                block_size=16,
+                top_k=5,
+                checkpoint_path=checkpoint_path,
+                checkpoint_interval=0,
+            )
+            with self.assertRaises(ValueError):
+                crack_enigma.sweep_rotor_positions(
+                    self.encrypted_message,
+                    decoder_enigma,
+                    scorer,
+                    block_size=16,
+                    top_k=3,
+                    checkpoint_path=checkpoint_path,
+                )
+            other_reflector = enigma.Swapper(n_positions=self.n_chars)
+            other_reflector.assign_random_swaps(n_swaps=self.n_chars // 2, seed=4)
+            with self.assertRaises(ValueError):
+                crack_enigma.sweep_rotor_positions(
+                    self.encrypted_message,
+                    enigma.Enigma(
+                        self.rotors, self.plugboard, other_reflector, self.charset
+                    ),
+                    scorer,
+                    block_size=16,
+                    top_k=5,
+                    checkpoint_path=checkpoint_path,
+                )
+        self.assertEqual(expected, resumed)
+
+    def test_resume_successive_best(self):
+        n_plugs = 3
+        self.setup_enigma_and_msg(100, 1, n_plugs)
+        with open("./language_stats.dill", "rb") as read_file:
+            group_likelihood = dill.load(read_file)["triads"]
+        scorer = InterruptedScorer.from_group_scorer(
+            crack_enigma.GroupLikelihoodScorer(group_likelihood), self.charset
+        )
+
+        def run(checkpoint_path=None):
+            decrypted_msg, decoded_pos, plugboard = (
+                crack_enigma.decode_message_successive_best(
+                    self.encrypted_message,
+                    self.rotors,
+                    n_plugs,
+                    self.reflector,
+                    scorer,
+                    charset=self.charset,
+                    disable_tqdm=True,
+                    checkpoint_path=checkpoint_path,
+                    checkpoint_interval=0,
+                )
+            )
+            return decrypted_msg, decoded_pos, plugboard.swap_dict
+
+        expected = run()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            checkpoint_path = os.path.join(tmp_dir, "successive_best.json")
+            # the rotor sweep and the first plug are done
+            scorer.n_batches = 8
+            with self.assertRaises(KeyboardInterrupt):
+                run(checkpoint_path)
+            scorer.n_batches = None
+            resumed = run(checkpoint_path)
+        self.assertEqual(expected, resumed)
+
+    def test_parallel_matches_serial(self):
+        n_plugs = 2
+        self.setup_enigma_and_msg(100, 2, n_plugs)
+        with open("./language_stats.dill", "rb") as read_file:
+            group_likelihood = dill.load(read_file)["diads"]
+        scorer = crack_enigma.GroupLikelihoodScorer(group_likelihood)
+
+        results = list()
+        for n_workers in [1, 2, 3]:
+            decrypted_msg, decoded_pos, plugboard = (
+                crack_enigma.decode_message_successive_best(
+                    self.encrypted_message,
+                    self.rotors,
+                    n_plugs,
+                    self.reflector,
+                    scorer,
+                    charset=self.charset,
+                    disable_tqdm=True,
+                    n_workers=n_workers,
+                )
+            )
+            results.append((decrypted_msg, decoded_pos, plugboard.swap_dict))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[0], results[2])
+
     def test_diad_cracking(self):
         self.check_crack_with_grouplikelihood("diads")
 
@@ -214,6 +1008,252 @@ class CrackEnigmaSuccessiveBestTest(ut.TestCase, CrackEnigmaCommon):
         self.assertEqual(self.message, decrypted_msg)
 
 
+class SharedPlugboardTest(ut.TestCase, CrackEnigmaCommon):
+    def setup_messages(self, n_messages, len_msg, n_rotors, n_plugs):
+        self.setup_enigma_and_msg(0, n_rotors, n_plugs)
+        encoder = enigma.Enigma(
+            self.rotors, self.plugboard, self.reflector, charset=self.charset
+        )
+        rng = np.random.default_rng(7)
+        self.messages = list()
+        self.start_positions = list()
+        self.encrypted_messages = list()
+        for i in range(n_messages):
+            offset = i * (len(self.message_full) - len_msg) // n_messages
+            self.messages.append(self.message_full[offset : offset + len_msg])
+            self.start_positions.append(
+                rng.integers(0, self.n_chars, size=n_rotors).tolist()
+            )
+            encoder.set_rotor_positions(self.start_positions[-1])
+            self.encrypted_messages.append(encoder.encode_message(self.messages[-1]))
+
+    def test_shared_plugboard(self):
+        self.setup_messages(12, 40, 1, 6)
+        with open("./language_stats.dill", "rb") as read_file:
+            group_likelihood = dill.load(read_file)["triads"]
+        scorer = crack_enigma.GroupLikelihoodScorer(group_likelihood)
+
+        # one message is too short for its plugs
+        decoded_msg, _, _ = crack_enigma.decode_message_successive_best(
+            self.encrypted_messages[0],
+            self.rotors,
+            6,
+            self.reflector,
+            scorer,
+            disable_tqdm=True,
+        )
+        self.assertNotEqual(decoded_msg, self.messages[0])
+
+        recorder = metrics_enigma.MemoryRecorder()
+        (
+            decoded_messages,
+            rotor_positions,
+            plugboard,
+            confidences,
+        ) = crack_enigma.decode_messages_shared_plugboard(
+            self.encrypted_messages,
+            self.rotors,
+            6,
+            self.reflector,
+            scorer,
+            metrics=metrics_enigma.Metrics(recorder),
+        )
+        self.assertListEqual(decoded_messages, self.messages)
+        self.assertListEqual(rotor_positions, self.start_positions)
+        self.assertDictEqual(plugboard.swap_dict, self.plugboard.swap_dict)
+        self.assertTrue(all(confidence >= 1 for confidence in confidences))
+        self.assertEqual(len(recorder.get_events("plug")) % 6, 0)
+        [finished] = recorder.get_events("finished")
+        self.assertListEqual(finished["confidences"], confidences)
+
+        # the messages are swept on a process pool
+        results = crack_enigma.decode_messages_shared_plugboard(
+            self.encrypted_messages,
+            self.rotors,
+            6,
+            self.reflector,
+            scorer,
+            n_workers=2,
+            bounded=True,
+        )
+        self.assertListEqual(results[0], decoded_messages)
+        self.assertListEqual(results[1], rotor_positions)
+        self.assertListEqual(results[3], confidences)
+
+        # all messages are swept once even if no confidence is too low
+        results = crack_enigma.decode_messages_shared_plugboard(
+            self.encrypted_messages,
+            self.rotors,
+            6,
+            self.reflector,
+            scorer,
+            min_confidence=-np.inf,
+        )
+        self.assertEqual(len(results[0]), len(self.messages))
+        with self.assertRaises(ValueError):
+            crack_enigma.decode_messages_shared_plugboard(
+                self.encrypted_messages,
+                self.rotors,
+                6,
+                self.reflector,
+                scorer,
+                max_n_rounds=0,
+            )
+        with self.assertRaises(ValueError):
+            crack_enigma.decode_messages_shared_plugboard(
+                [], self.rotors, 6, self.reflector, scorer
+            )
+
+    def test_shared_plugboard_two_rotors(self):
+        self.setup_messages(12, 150, 2, 6)
+        with open("./language_stats.dill", "rb") as read_file:
+            group_likelihood = dill.load(read_file)["triads"]
+        scorer = crack_enigma.GroupLikelihoodScorer(group_likelihood)
+
+        (
+            decoded_messages,
+            rotor_positions,
+            plugboard,
+            _,
+        ) = crack_enigma.decode_messages_shared_plugboard(
+            self.encrypted_messages,
+            self.rotors,
+            6,
+            self.reflector,
+            scorer,
+        )
+        self.assertListEqual(decoded_messages, self.messages)
+        self.assertListEqual(rotor_positions, self.start_positions)
+        self.assertDictEqual(plugboard.swap_dict, self.plugboard.swap_dict)
+
+
+class RotorSelectionTest(ut.TestCase, CrackEnigmaCommon):
+    def test_search_rotor_selections(self):
+        self.setup_enigma_and_msg(150, 0, 3)
+        rotor_bank = [
+            enigma.Rotor(n_positions=self.n_chars, seed=seed) for seed in range(4)
+        ]
+        encoder = enigma.Enigma(
+            [rotor_bank[3], rotor_bank[0]],
+            self.plugboard,
+            self.reflector,
+            charset=self.charset,
+        )
+        encoder.set_rotor_positions([4, 17])
+        encrypted_message = encoder.encode_message(self.message)
+        with open("./language_stats.dill", "rb") as read_file:
+            group_likelihood = dill.load(read_file)["triads"]
+        scorer = crack_enigma.GroupLikelihoodScorer(group_likelihood)
+        bank_positions = [rot.position for rot in rotor_bank]
+
+        results = crack_enigma.search_rotor_selections(
+            encrypted_message, rotor_bank, 2, 3, self.reflector, scorer, top_k=3
+        )
+        self.assertEqual(len(results), 3)
+        selection, rotor_positions, plugboard, score = results[0]
+        self.assertTupleEqual(selection, (3, 0))
+        self.assertListEqual(rotor_positions, [4, 17])
+        self.assertDictEqual(plugboard.swap_dict, self.plugboard.swap_dict)
+        self.assertListEqual(
+            [result[3] for result in results],
+            sorted((result[3] for result in results), reverse=True),
+        )
+        # the bank is not changed
+        self.assertListEqual([rot.position for rot in rotor_bank], bank_positions)
+
+        # pruned selections and workers give the same result
+        recorder = metrics_enigma.MemoryRecorder()
+        for kwargs in [
+            dict(bounded=True, metrics=metrics_enigma.Metrics(recorder)),
+            dict(n_workers=2),
+        ]:
+            other_results = crack_enigma.search_rotor_selections(
+                encrypted_message,
+                rotor_bank,
+                2,
+                3,
+                self.reflector,
+                scorer,
+                top_k=3,
+                **kwargs,
+            )
+            self.assertListEqual(
+                [
+                    (sel, pos, plugs.swap_dict, s)
+                    for sel, pos, plugs, s in other_results
+                ],
+                [(sel, pos, plugs.swap_dict, s) for sel, pos, plugs, s in results],
+            )
+        sweep_events = recorder.get_events("selection_sweeps")
+        self.assertEqual(sum(event["n_selections"] for event in sweep_events), 12)
+        self.assertGreater(sum(event["n_pruned"] for event in sweep_events), 0)
+        self.assertEqual(len(recorder.get_events("selection_plugs")), 3)
+
+        with self.assertRaises(ValueError):
+            crack_enigma.search_rotor_selections(
+                encrypted_message, rotor_bank, 5, 3, self.reflector, scorer
+            )
+
+
+class CribEnigmaTest(ut.TestCase, CrackEnigmaCommon):
+    def test_legal_offsets(self):
+        self.setup_enigma_and_msg(100, 2, 10)
+        crib = self.message[40:60]
+        decoder_enigma = enigma.Enigma(
+            self.rotors, self.plugboard, self.reflector, self.charset
+        )
+        encrypted_ints = decoder_enigma.chars_to_ints(self.encrypted_message)
+        crib_ints = decoder_enigma.chars_to_ints(crib)
+        offsets = crib_enigma.find_legal_offsets(
+            encrypted_ints, crib_ints, self.reflector
+        )
+        self.assertIn(40, offsets)
+        self.assertLess(len(offsets), 81)
+        for offset in offsets:
+            self.assertFalse(
+                np.any(encrypted_ints[offset : offset + len(crib)] == crib_ints)
+            )
+
+    def test_crib_attack(self):
+        n_plugs = 10
+        self.setup_enigma_and_msg(100, 2, n_plugs)
+        offset = 40
+        crib = self.message[offset : offset + 20]
+
+        survivors = crib_enigma.crib_attack(
+            self.encrypted_message,
+            crib,
+            self.rotors,
+            self.reflector,
+            self.charset,
+            offsets=[offset - 1, offset, offset + 1],
+            n_plugs=n_plugs,
+            block_size=100,
+        )
+        self.assertGreater(len(survivors), 0)
+        self.assertLess(len(survivors), 5)
+        true_survivors = [
+            survivor
+            for survivor in survivors
+            if survivor[:2] == (offset, self.rotor_positions)
+        ]
+        self.assertEqual(len(true_survivors), 1)
+
+        # the deduced plugs are true plugs and decrypt the crib
+        [(_, rotor_positions, swap_dict)] = true_survivors
+        true_swap_dict = self.plugboard.swap_dict
+        for char, partner in swap_dict.items():
+            self.assertEqual(true_swap_dict[char], partner)
+        plugboard = enigma.Swapper(self.n_chars)
+        plugboard.swap_dict = swap_dict
+        decoder_enigma = enigma.Enigma(
+            self.rotors, plugboard, self.reflector, self.charset
+        )
+        decoder_enigma.set_rotor_positions(rotor_positions)
+        decrypted_msg = decoder_enigma.encode_message(self.encrypted_message)
+        self.assertEqual(decrypted_msg[offset : offset + len(crib)], crib)
+
+
 class CrackEnigmaMCTest(ut.TestCase, CrackEnigmaCommon):
     def test_triad_cracking(self):
         n_plugs = 0
@@ -224,6 +1264,54 @@ class CrackEnigmaMCTest(ut.TestCase, CrackEnigmaCommon):
             group_likelihood = dill.load(read_file)["triads"]
         scorer = crack_enigma.GroupLikelihoodScorer(group_likelihood)
 
+        # rotor moves of one step get stuck in local maxima at a constant low temperature,
+        # a hot start that cools down finds the rotor position
+        recorder = metrics_enigma.MemoryRecorder()
+        decrypted_msg, decoded_pos, decoder_plugboard = crack_enigma.decode_message_MC(
+            self.encrypted_message,
+            self.rotors,
+            n_plugs,
+            self.reflector,
+            scorer,
+            charset=self.charset,
+            score_scale=2,
+            n_attempts_per_block=100,
+            max_n_blocks=100,
+            schedule=crack_enigma.GeometricSchedule(factor=0.9, min_score_scale=0.05),
+            patience=10,
+            metrics=metrics_enigma.Metrics(recorder),
+        )
+        self.assertGreater(string_compare(decrypted_msg, self.message), 0.85)
+        self.assertEqual(decoded_pos, self.rotor_positions)
+        [finished] = recorder.get_events("finished")
+        self.assertLess(finished["n_scorer_calls"], 100 * 100)
+
+        score_scales = [
+            event["score_scale"] for event in recorder.get_events("mc_block")
+        ]
+        np.testing.assert_allclose(score_scales[:3], [2, 2 * 0.9, 2 * 0.9 * 0.9])
+        self.assertAlmostEqual(
+            score_scales[-1], max(2 * 0.9 ** (len(score_scales) - 1), 0.05)
+        )
+
+    def test_adaptive_schedule(self):
+        schedule = crack_enigma.AdaptiveSchedule(
+            target_acceptance=0.5, adaptation_rate=2.0, max_score_scale=10
+        )
+        rot_scale, plug_scale = schedule.next_score_scales(0, (1.0, 1.0), (0.0, 1.0))
+        self.assertAlmostEqual(rot_scale, np.exp(1.0))
+        self.assertAlmostEqual(plug_scale, np.exp(-1.0))
+        # without plugs the plug scale stays, the scales stay in their bounds
+        self.assertEqual(
+            schedule.next_score_scales(0, (9.0, 1.0), (0.0, None)), (10, 1.0)
+        )
+
+        n_plugs = 0
+        self.setup_enigma_and_msg(200, 1, n_plugs)
+        with open("./language_stats.dill", "rb") as read_file:
+            group_likelihood = dill.load(read_file)["triads"]
+        scorer = crack_enigma.GroupLikelihoodScorer(group_likelihood)
+
         decrypted_msg, decoded_pos, decoder_plugboard = crack_enigma.decode_message_MC(
             self.encrypted_message,
             self.rotors,
@@ -234,8 +1322,322 @@ class CrackEnigmaMCTest(ut.TestCase, CrackEnigmaCommon):
             score_scale=0.2,
             n_attempts_per_block=100,
             max_n_blocks=100,
+            schedule=crack_enigma.AdaptiveSchedule(),
+            patience=10,
+        )
+        self.assertEqual(decoded_pos, self.rotor_positions)
+        self.assertEqual(decrypted_msg, self.message)
+
+    def test_multiple_try_detailed_balance(self):
+        # on a tiny machine the chain can be compared to the exact distribution
+        charset = "abcd"
+        rng = np.random.default_rng(0)
+        loglikelihooddict = {c1 + c2: rng.normal() for c1 in charset for c2 in charset}
+        scorer = crack_enigma.DenseGroupLikelihoodScorer(loglikelihooddict, charset)
+        reflector = enigma.Swapper(n_positions=4)
+        reflector.assign_random_swaps(n_swaps=2, seed=3)
+        plugboard = enigma.Swapper(n_positions=4)
+        compiled_enigma = enigma.CompiledEnigma(
+            enigma.Enigma([enigma.Rotor(4, seed=1)], plugboard, reflector, charset)
         )
+        encrypted_message = "abcdabddcaab"
+        score_scale = 0.3
+
+        states = [
+            (rotor_pos, first, second)
+            for rotor_pos in range(4)
+            for first in range(4)
+            for second in range(first + 1, 4)
+        ]
+        log_weights = list()
+        for rotor_pos, first, second in states:
+            plugboard.swap_dict = {first: second, second: first}
+            score = crack_enigma._decrypt_and_score(
+                compiled_enigma, encrypted_message, scorer, [rotor_pos]
+            )
+            log_weights.append(score / score_scale)
+        expected = np.exp(np.array(log_weights) - np.max(log_weights))
+        expected /= np.sum(expected)
+
+        plugboard.swap_dict = {0: 1, 1: 0}
+        compiled_enigma.enigma.set_rotor_positions([0])
+        chain = crack_enigma._MCChain(
+            compiled_enigma,
+            encrypted_message,
+            scorer,
+            score_scale,
+            np.random.default_rng(1),
+        )
+        n_steps = 5000
+        counts = dict.fromkeys(states, 0)
+        for _ in range(n_steps):
+            chain.multiple_try_step(4)
+            first, second = sorted(chain.plugboard.swap_dict)
+            counts[(chain.rotor_positions[0], first, second)] += 1
+        visited = np.array([counts[state] for state in states]) / n_steps
+        self.assertLess(0.5 * np.sum(np.abs(visited - expected)), 0.05)
+        self.assertEqual(
+            chain.score,
+            crack_enigma._decrypt_and_score(
+                compiled_enigma, encrypted_message, scorer, chain.rotor_positions
+            ),
+        )
+
+    def test_resume(self):
+        n_plugs = 2
+        self.setup_enigma_and_msg(200, 1, n_plugs)
+        with open("./language_stats.dill", "rb") as read_file:
+            group_likelihood = dill.load(read_file)["triads"]
+        scorer = crack_enigma.GroupLikelihoodScorer(group_likelihood)
+
+        def run(checkpoint_path, max_n_blocks):
+            decrypted_msg, decoded_pos, plugboard = crack_enigma.decode_message_MC(
+                self.encrypted_message,
+                self.rotors,
+                n_plugs,
+                self.reflector,
+                scorer,
+                charset=self.charset,
+                score_scale=0.2,
+                n_attempts_per_block=50,
+                max_n_blocks=max_n_blocks,
+                checkpoint_path=checkpoint_path,
+                checkpoint_interval=0,
+            )
+            return decrypted_msg, decoded_pos, plugboard.swap_dict
+
+        # a run without a checkpoint takes the same path as an interrupted one
+        expected = run(None, 6)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            checkpoint_path = os.path.join(tmp_dir, "interrupted.json")
+            run(checkpoint_path, 3)
+            resumed = run(checkpoint_path, 6)
+        self.assertEqual(expected, resumed)
+
+    def test_parallel_tempering(self):
+        n_plugs = 2
+        self.setup_enigma_and_msg(200, 1, n_plugs)
+
+        with open("./language_stats.dill", "rb") as read_file:
+            group_likelihood = dill.load(read_file)["triads"]
+        scorer = crack_enigma.GroupLikelihoodScorer(group_likelihood)
+
+        results = list()
+        for n_workers in [1, 2]:
+            (
+                decrypted_msg,
+                decoded_pos,
+                decoder_plugboard,
+                chain_stats,
+            ) = crack_enigma.decode_message_parallel_tempering(
+                self.encrypted_message,
+                self.rotors,
+                n_plugs,
+                self.reflector,
+                scorer,
+                score_scales=[0.05, 0.1, 0.2, 0.4],
+                n_steps_per_exchange=100,
+                n_exchanges=20,
+                charset=self.charset,
+                n_workers=n_workers,
+            )
+            results.append(
+                (decrypted_msg, decoded_pos, decoder_plugboard.swap_dict, chain_stats)
+            )
+
+        self.assertEqual(results[0], results[1])
         self.assertGreater(string_compare(decrypted_msg, self.message), 0.85)
+        self.assertEqual(len(chain_stats), 4)
+        self.assertIsNone(chain_stats[-1]["exchange_rate"])
+        for stats in chain_stats:
+            self.assertGreaterEqual(stats["best_score"], stats["score"])
+            self.assertTrue(0 <= stats["acceptance_rate_rot"] <= 1)
+            self.assertTrue(0 <= stats["acceptance_rate_plug"] <= 1)
+        # hotter chains accept more
+        self.assertLess(
+            chain_stats[0]["acceptance_rate_plug"],
+            chain_stats[-1]["acceptance_rate_plug"],
+        )
+
+
+class MetricsTest(ut.TestCase, CrackEnigmaCommon):
+    def test_successive_best_events(self):
+        n_plugs = 2
+        self.setup_enigma_and_msg(100, 2, n_plugs)
+        with open("./language_stats.dill", "rb") as read_file:
+            group_likelihood = dill.load(read_file)["triads"]
+        scorer = crack_enigma.GroupLikelihoodScorer(group_likelihood)
+
+        results = list()
+        recorder = metrics_enigma.MemoryRecorder()
+        for metrics in [None, metrics_enigma.Metrics(recorder)]:
+            decrypted_msg, decoded_pos, plugboard = (
+                crack_enigma.decode_message_successive_best(
+                    self.encrypted_message,
+                    self.rotors,
+                    n_plugs,
+                    self.reflector,
+                    scorer,
+                    charset=self.charset,
+                    disable_tqdm=True,
+                    prefilter_fraction=0.5,
+                    metrics=metrics,
+                )
+            )
+            results.append((decrypted_msg, decoded_pos, plugboard.swap_dict))
+        self.assertEqual(results[0], results[1])
+
+        sweep_events = recorder.get_events("sweep_stage")
+        self.assertEqual(
+            [event["stage"] for event in sweep_events], ["prefilter", "scorer"]
+        )
+        self.assertEqual(sweep_events[0]["n_candidates"], self.n_chars**2)
+        self.assertEqual(sweep_events[1]["n_candidates"], self.n_chars**2 // 2)
+        for event in sweep_events:
+            self.assertGreater(event["encode_seconds"], 0)
+            self.assertGreater(event["score_seconds"], 0)
+
+        plug_events = recorder.get_events("plug")
+        for event in plug_events:
+            first, second = event["swap"]
+            self.assertEqual(results[0][2][first], second)
+        self.assertEqual([event["n_candidates"] for event in plug_events], [325, 276])
+
+        [finished] = recorder.get_events("finished")
+        self.assertEqual(finished["n_candidates"], self.n_chars**2 * 3 // 2 + 325 + 276)
+        self.assertGreater(finished["candidates_per_second"], 0)
+
+    def test_mc_events_to_jsonl(self):
+        n_plugs = 2
+        self.setup_enigma_and_msg(200, 1, n_plugs)
+        with open("./language_stats.dill", "rb") as read_file:
+            group_likelihood = dill.load(read_file)["triads"]
+        scorer = crack_enigma.GroupLikelihoodScorer(group_likelihood)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "metrics.jsonl")
+            with metrics_enigma.JsonlRecorder(path) as recorder:
+                crack_enigma.decode_message_MC(
+                    self.encrypted_message,
+                    self.rotors,
+                    n_plugs,
+                    self.reflector,
+                    scorer,
+                    charset=self.charset,
+                    score_scale=0.2,
+                    n_attempts_per_block=50,
+                    max_n_blocks=4,
+                    metrics=metrics_enigma.Metrics(recorder),
+                )
+            with open(path, "r") as read_file:
+                records = [json.loads(line) for line in read_file]
+
+        block_events = [record for record in records if record["event"] == "mc_block"]
+        self.assertEqual(len(block_events), 4)
+        best_scores = [event["best_score"] for event in block_events]
+        self.assertEqual(best_scores, sorted(best_scores))
+        for event in block_events:
+            self.assertEqual(event["n_steps"], 50)
+            self.assertEqual(event["n_candidates"], 100)
+            self.assertTrue(0 <= event["acceptance_rate_rot"] <= 1)
+            self.assertTrue(0 <= event["acceptance_rate_plug"] <= 1)
+        self.assertEqual(records[-1]["event"], "finished")
+        self.assertEqual(records[-1]["n_candidates"], 400)
+
+
+class ScoreCacheTest(ut.TestCase, CrackEnigmaCommon):
+    def test_lru(self):
+        self.setup_enigma_and_msg(50, 1, 2)
+        scorer = crack_enigma.IndexOfCoincidenceScorer(self.charset)
+        compiled_enigma = enigma.CompiledEnigma(
+            enigma.Enigma(
+                self.rotors, self.plugboard, self.reflector, charset=self.charset
+            )
+        )
+        score_cache = crack_enigma.ScoreCache(max_size=2)
+
+        def score(rotor_pos):
+            return score_cache.decrypt_and_score(
+                compiled_enigma, self.encrypted_message, scorer, [rotor_pos]
+            )
+
+        for rotor_pos in [0, 1, 0, 2, 0, 1]:
+            self.assertEqual(
+                score(rotor_pos),
+                crack_enigma._decrypt_and_score(
+                    compiled_enigma, self.encrypted_message, scorer, [rotor_pos]
+                ),
+            )
+        # 1 was dropped when 2 was added, 0 was used more recently
+        self.assertEqual(score_cache.n_hits, 2)
+        self.assertEqual(score_cache.n_misses, 4)
+        self.assertEqual(len(score_cache), 2)
+
+        # the plug board is part of the key
+        compiled_enigma.enigma.plug_board.swap_dict = dict()
+        score(0)
+        self.assertEqual(score_cache.n_misses, 5)
+
+    def test_mc_with_cache(self):
+        n_plugs = 2
+        self.setup_enigma_and_msg(200, 1, n_plugs)
+        with open("./language_stats.dill", "rb") as read_file:
+            group_likelihood = dill.load(read_file)["triads"]
+        scorer = crack_enigma.GroupLikelihoodScorer(group_likelihood)
+
+        results = list()
+        score_cache = crack_enigma.ScoreCache(max_size=1000)
+        for cache in [None, score_cache]:
+            decrypted_msg, decoded_pos, plugboard = crack_enigma.decode_message_MC(
+                self.encrypted_message,
+                self.rotors,
+                n_plugs,
+                self.reflector,
+                scorer,
+                charset=self.charset,
+                score_scale=0.2,
+                n_attempts_per_block=100,
+                max_n_blocks=10,
+                score_cache=cache,
+            )
+            results.append((decrypted_msg, decoded_pos, plugboard.swap_dict))
+        self.assertEqual(results[0], results[1])
+        self.assertGreater(score_cache.n_hits, 0)
+        self.assertLessEqual(len(score_cache), 1000)
+
+    def test_successive_best_with_cache(self):
+        n_plugs = 2
+        self.setup_enigma_and_msg(100, 1, n_plugs)
+        with open("./language_stats.dill", "rb") as read_file:
+            group_likelihood = dill.load(read_file)["triads"]
+
+        # scorers that are not dense are scored one setting at a time,
+        # dense ones score the plug candidates that are not cached in batches
+        for scorer in [
+            crack_enigma.IndexOfCoincidenceScorer(self.charset),
+            crack_enigma.GroupLikelihoodScorer(group_likelihood),
+        ]:
+            results = list()
+            score_cache = crack_enigma.ScoreCache()
+            for cache in [None, score_cache, score_cache]:
+                decrypted_msg, decoded_pos, plugboard = (
+                    crack_enigma.decode_message_successive_best(
+                        self.encrypted_message,
+                        self.rotors,
+                        n_plugs,
+                        self.reflector,
+                        scorer,
+                        charset=self.charset,
+                        disable_tqdm=True,
+                        score_cache=cache,
+                    )
+                )
+                results.append((decrypted_msg, decoded_pos, plugboard.swap_dict))
+            self.assertEqual(results[0], results[1])
+            self.assertEqual(results[0], results[2])
+            # the second run only had hits
+            self.assertGreater(score_cache.n_hits, 0)
+            self.assertEqual(score_cache.n_hits, score_cache.n_misses)
 
 
 if __name__ == "__main__":